@@ -0,0 +1,267 @@
+"""Benchmarks of the engine, observation, agent and serialization hot paths.
+
+Every benchmark runs on each fixed-seed scenario of scenarios.py and reports
+its per-call latency distribution and the memory it allocates per call. The
+'play' benchmark also reports the steps per second of SimpleAgents playing on
+from the scenario.
+
+Run all the benchmarks and save the results:
+python benchmarks/run.py --output=results.json
+
+Compare against a stored baseline and fail on a regression of more than 20%:
+python benchmarks/run.py --baseline=baseline.json --threshold=0.2
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from pommerman import utility
+
+import scenarios
+
+# The number of steps the 'play' benchmark plays per call, and the fraction of
+# the calls of the other benchmarks it makes.
+PLAY_STEPS = 50
+PLAY_REPEAT = 0.1
+
+
+def _benchmarks(scenario):
+    """Returns the benchmarks of scenario.
+
+    Returns:
+      A list of (name, fn, setup), and a list of the number of steps played by
+      the 'play' benchmark so far.
+    """
+    env = scenario.env
+    agent_id = scenario.agent_id
+    max_blast_strength = env._agent_view_size or 10
+    played = [0]
+
+    def forward_model_step():
+        env.model.step(
+            scenario.actions,
+            env._board,
+            env._agents,
+            env._bombs,
+            env._items,
+            env._flames,
+            max_blast_strength=max_blast_strength)
+
+    def simple_agent_act():
+        env._agents[agent_id].act(scenario.obs[agent_id], env.action_space)
+
+    def play_setup():
+        # The agents play the same game on every call.
+        scenario.restore()
+        env._seed_agents()
+
+    def play():
+        obs = scenario.obs
+        for _ in range(PLAY_STEPS):
+            obs, _, done, _ = env.step(env.act(obs))
+            played[0] += 1
+            if done:
+                break
+
+    restore = scenario.restore
+    benchmarks = [
+        ('forward_model_step', forward_model_step, restore),
+        ('env_step', lambda: env.step(scenario.actions), restore),
+        ('get_observations', env.get_observations, restore),
+        ('simple_agent_act', simple_agent_act, restore),
+        ('featurize', lambda: env.featurize(scenario.obs[agent_id]), restore),
+        ('get_json_info', env.get_json_info, restore),
+        ('play', play, play_setup),
+    ]
+    if scenario.name == 'early_game':
+        # Boards do not depend on the state, so one scenario is enough.
+        rng = random.Random(0)
+        benchmarks.append(('make_board', lambda: utility.make_board(
+            env._board_size, env._num_rigid, env._num_wood, rng), restore))
+    return benchmarks, played
+
+
+def measure(fn, setup, repeat, warmup, alloc_repeat):
+    """Times repeat calls of fn, each after a call of setup.
+
+    Returns:
+      A dict with the number of calls, the mean, min, p50, p90, p99 and max
+      latency in microseconds, the calls per second and the peak and net
+      bytes allocated per call.
+    """
+    for _ in range(warmup):
+        setup()
+        fn()
+
+    times = np.empty(repeat)
+    for num in range(repeat):
+        setup()
+        start = time.perf_counter()
+        fn()
+        times[num] = time.perf_counter() - start
+
+    # Traced separately, as tracing slows every allocation down.
+    peaks = np.empty(alloc_repeat)
+    nets = np.empty(alloc_repeat)
+    tracemalloc.start()
+    try:
+        for num in range(alloc_repeat):
+            setup()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks[num] = peak - before
+            nets[num] = current - before
+    finally:
+        tracemalloc.stop()
+
+    micros = times * 1e6
+    return {
+        'calls': repeat,
+        'mean_us': float(micros.mean()),
+        'min_us': float(micros.min()),
+        'p50_us': float(np.percentile(micros, 50)),
+        'p90_us': float(np.percentile(micros, 90)),
+        'p99_us': float(np.percentile(micros, 99)),
+        'max_us': float(micros.max()),
+        'calls_per_sec': float(repeat / times.sum()),
+        'alloc_peak_bytes': int(np.median(peaks)),
+        'alloc_net_bytes': int(np.median(nets)),
+    }
+
+
+def run(names=None, repeat=200, warmup=10, alloc_repeat=20):
+    """Runs the benchmarks.
+
+    Args:
+      names: Only run the benchmarks whose 'scenario/benchmark' name contains
+        one of these strings. All of them if None.
+      repeat: The number of timed calls of each benchmark.
+      warmup: The number of untimed calls before.
+      alloc_repeat: The number of calls traced for allocations.
+
+    Returns:
+      A dict with the 'meta' data of the run and the 'results' of each
+      'scenario/benchmark'.
+    """
+    results = {}
+    for make_scenario in scenarios.SCENARIOS:
+        scenario = make_scenario()
+        benchmarks, played = _benchmarks(scenario)
+        for name, fn, setup in benchmarks:
+            name = '%s/%s' % (scenario.name, name)
+            if names and not any(part in name for part in names):
+                continue
+
+            start = time.perf_counter()
+            if name.endswith('/play'):
+                calls = [max(1, int(num * PLAY_REPEAT))
+                         for num in (repeat, warmup, alloc_repeat)]
+                played[0] = 0
+                result = measure(fn, setup, *calls)
+                # Every call of play, timed or not, counted its steps.
+                result['steps_per_sec'] = \
+                    played[0] / sum(calls) * result['calls_per_sec']
+            else:
+                result = measure(fn, setup, repeat, warmup, alloc_repeat)
+            results[name] = result
+            print('%-36s p50 %9.1fus  p99 %9.1fus  %8d B/call  (%.1fs)' %
+                  (name, result['p50_us'], result['p99_us'],
+                   result['alloc_peak_bytes'], time.perf_counter() - start))
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, metric='p50_us', threshold=0.2):
+    """Compares results against baseline.
+
+    Args:
+      results, baseline: Dicts returned by `run`.
+      metric: The latency metric to compare, e.g. 'p50_us' or 'mean_us'.
+      threshold: The relative slow down over which a benchmark regressed.
+
+    Returns:
+      The names of the benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            print('%-36s new' % name)
+            continue
+        ratio = result[metric] / baseline['results'][name][metric]
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print('%-36s %9.1fus -> %9.1fus  %+6.1f%%%s' %
+              (name, baseline['results'][name][metric], result[metric],
+               100 * (ratio - 1), '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    '''CLI entry point to run the benchmarks'''
+    parser = argparse.ArgumentParser(description='Pommerman benchmarks.')
+    parser.add_argument(
+        '--filter',
+        default=None,
+        help='Comma delineated list of substrings. Only the benchmarks whose '
+        'scenario/benchmark name contains one of them run.')
+    parser.add_argument(
+        '--repeat',
+        default=200,
+        type=int,
+        help='Number of timed calls of each benchmark.')
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='File to write the results to as JSON.')
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        help='Results of an earlier run to compare against.')
+    parser.add_argument(
+        '--metric',
+        default='p50_us',
+        help='Latency metric compared against the baseline.')
+    parser.add_argument(
+        '--threshold',
+        default=0.2,
+        type=float,
+        help='Relative slow down over the baseline that fails the run.')
+    args = parser.parse_args()
+
+    names = args.filter.split(',') if args.filter else None
+    results = run(names, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if regressions:
+            print('%d benchmarks regressed by more than %d%%: %s' %
+                  (len(regressions), 100 * args.threshold,
+                   ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''Fixed-seed game states to benchmark the engine on.
+
+Each scenario plays SimpleAgents from a fixed seed up to a chosen step and
+keeps a snapshot of it, so every benchmark call can start from exactly the
+same state.
+'''
+from pommerman import agents
+from pommerman import configs
+
+
+class Scenario(object):
+    '''A Pomme env and a snapshot of one of its states.'''
+
+    def __init__(self, name, env, snapshot):
+        self.name = name
+        self.env = env
+        self.snapshot = snapshot
+        self.restore()
+        self.actions = env.act(self.obs)
+        self.restore()
+
+    def restore(self):
+        '''Puts the env back in the scenario's state'''
+        self.env.restore(self.snapshot)
+        self.obs = self.env.get_observations()
+
+    @property
+    def agent_id(self):
+        '''The id of the first agent alive'''
+        return next(agent.agent_id for agent in self.env._agents
+                    if agent.is_alive)
+
+
+def _make_env(config, seed, **kwargs):
+    '''Makes the env of config with four seeded SimpleAgents.
+
+    This is `pommerman.make`, with the env kwargs of the config overridden by
+    kwargs.
+    '''
+    config = config()
+    env_kwargs = dict(config['env_kwargs'], **kwargs)
+    env = config['env'](**env_kwargs)
+    agent_list = [agents.SimpleAgent() for _ in range(4)]
+    for agent_id, agent in enumerate(agent_list):
+        agent.init_agent(agent_id, env_kwargs['game_type'])
+    env.set_agents(agent_list)
+    env.set_init_game_state(None)
+    env.seed(seed)
+    return env
+
+
+def _play(env, num_steps):
+    """Plays up to num_steps steps and yields the snapshot of each step.
+
+    The game stops early if it ends.
+    """
+    obs = env.reset()
+    yield env.snapshot()
+    for _ in range(num_steps):
+        obs, _, done, _ = env.step(env.act(obs))
+        if done:
+            return
+        yield env.snapshot()
+
+
+def early_game():
+    '''FFA right after the reset: no bombs, every agent alive.'''
+    env = _make_env(configs.ffa_competition_env, seed=0)
+    snapshot = list(_play(env, 0))[-1]
+    return Scenario('early_game', env, snapshot)
+
+
+def late_game():
+    '''FFA with the most bombs on the board between steps 100 and 400.'''
+    env = _make_env(configs.ffa_competition_env, seed=5)
+    snapshots = list(_play(env, 400))[100:]
+    snapshot = max(snapshots, key=lambda snapshot: len(snapshot['bombs']))
+    return Scenario('late_game', env, snapshot)
+
+
+def team_fogged():
+    '''Partially observable Team game at step 100.'''
+    env = _make_env(configs.team_competition_env, seed=2)
+    snapshot = list(_play(env, 100))[-1]
+    return Scenario('team_fogged', env, snapshot)
+
+
+def v1_collapse():
+    '''Collapsing Team game one step before the first ring collapses.'''
+    first_collapse = 60
+    env = _make_env(
+        configs.team_competition_v1_env, seed=3, first_collapse=first_collapse)
+    snapshot = list(_play(env, first_collapse - 1))[-1]
+    assert snapshot['step_count'] == first_collapse - 1, \
+        "The game ended before the collapse"
+    return Scenario('v1_collapse', env, snapshot)
+
+
+SCENARIOS = [early_game, late_game, team_fogged, v1_collapse]
@@ -2,12 +2,16 @@
 import gym
 import inspect
 from . import agents
+from . import batch_forward_model
 from . import configs
 from . import constants
+from . import dataset
 from . import forward_model
 from . import helpers
 from . import utility
 from . import network
+from . import replay
+from . import state
 
 gym.logger.set_level(40)
 REGISTRY = None
@@ -1,5 +1,6 @@
 '''Entry point into the agents module set'''
 from .base_agent import BaseAgent
+from .batch_simple_agent import BatchSimpleAgent
 from .docker_agent import DockerAgent
 from .http_agent import HttpAgent
 from .player_agent import PlayerAgent
@@ -1,11 +1,21 @@
 '''This is the base abstraction for agents in pommerman.
 All agents should inherent from this class'''
+import random
+
 from .. import characters
 
 
 class BaseAgent:
     """Parent abstract Agent."""
 
+    # The arrays in observations are read-only views shared with the env.
+    # Agents that write to them set this to get their own copies instead.
+    copy_observations = False
+
+    # Where the agent draws its random numbers from. It is the global random
+    # module until `seed` gives the agent a generator of its own.
+    _rng = random
+
     def __init__(self, character=characters.Bomber):
         self._character = character
 
@@ -24,6 +34,10 @@ class BaseAgent:
         """
         pass
 
+    def seed(self, seed):
+        '''Gives the agent its own random number generator, seeded with seed.'''
+        self._rng = random.Random(seed)
+
     def init_agent(self, id, game_type):
         self._character = self._character(id, game_type)
 
@@ -0,0 +1,356 @@
+'''A SimpleAgent that decides the actions of many agents in one call.'''
+import random
+
+import numpy as np
+
+from .. import constants
+from .. import utility
+from .simple_agent import SimpleAgent, _PASSABLE, _board_geometry, \
+    _lookup_table
+
+_DEPTH = 10
+_EXCLUDED = _lookup_table(
+    [constants.Item.Fog, constants.Item.Rigid, constants.Item.Flames])
+# The rank of each powerup in the order SimpleAgent looks for them.
+_POWERUP_RANK = np.full(256, -1, dtype=np.int64)
+_POWERUP_RANK[[
+    constants.Item.ExtraBomb.value, constants.Item.IncrRange.value,
+    constants.Item.Kick.value
+]] = np.arange(3)
+
+# The moves in the order SimpleAgent looks at them, with their offsets.
+_NEIGHBORS = [(constants.Action.Up, (-1, 0)), (constants.Action.Down, (1, 0)),
+              (constants.Action.Left, (0, -1)),
+              (constants.Action.Right, (0, 1))]
+_RANDOM_MOVES = [(constants.Action.Stop, (0, 0)),
+                 (constants.Action.Left, (0, -1)),
+                 (constants.Action.Right, (0, 1)),
+                 (constants.Action.Up, (-1, 0)),
+                 (constants.Action.Down, (1, 0))]
+
+
+def _neighbors(planes, rows, cols, moves):
+    """Returns what each plane holds next to the given cell in each move.
+
+    Args:
+      planes: A [N, B, B] bool array.
+      rows, cols: The row and column of a cell of each plane.
+      moves: A list of (action, (row, col)) offsets.
+
+    Returns:
+      A [N, len(moves)] bool array, False for the moves off the board.
+    """
+    padded = np.pad(planes, ((0, 0), (1, 1), (1, 1)))
+    offsets = np.array([offset for _, offset in moves]) + 1
+    return padded[np.arange(len(planes))[:, None],
+                  rows[:, None] + offsets[:, 0], cols[:, None] + offsets[:, 1]]
+
+
+def _nearest(candidates, order):
+    """Returns the flat index of the cell SimpleAgent._nearest_position picks.
+
+    That is the last cell in iteration order among the nearest candidates, or
+    -1 if there are none.
+
+    Args:
+      candidates: A [N, B*B] array holding the distance of every candidate
+        cell and np.inf everywhere else.
+      order: A [N, B*B] array ranking the cells by iteration order.
+    """
+    nearest = candidates.min(axis=1, keepdims=True)
+    keys = np.where((candidates == nearest) & np.isfinite(candidates), order,
+                    -1)
+    return np.where(np.isfinite(nearest[:, 0]), keys.argmax(axis=1), -1)
+
+
+class BatchSimpleAgent(object):
+    """Decides the actions of many SimpleAgents at once.
+
+    Each slot holds the memory of one SimpleAgent: its recently visited
+    positions and its previous direction. `act` takes the observations of
+    any of the slots, from one or many games, and works out reachability,
+    bomb danger and the candidate directions of all of them with array
+    operations. Only the final choice is made agent by agent.
+
+    Each slot draws its random numbers from the global random module until
+    `seed` gives it a generator of its own, as with `BaseAgent.seed`. Given
+    the same random streams, the actions are the ones the SimpleAgents would
+    take. Slots that share the global stream have to be passed in the order
+    the SimpleAgents would act in. The random numbers SimpleAgent spends on
+    breaking ties in its search are drawn as well, so the streams stay in
+    step.
+    """
+
+    def __init__(self, num_agents):
+        self.num_agents = num_agents
+        self._recently_visited_positions = [[] for _ in range(num_agents)]
+        self._recently_visited_length = 6
+        self._prev_direction = [None] * num_agents
+        self._rngs = [random] * num_agents
+
+    def seed(self, slot, seed):
+        '''Gives the agent in slot its own random number generator.'''
+        self._rngs[slot] = random.Random(seed)
+
+    def act(self, observations, slots=None):
+        """Returns the actions of a batch of SimpleAgents.
+
+        Args:
+          observations: A list of observations, one per agent. All of them
+            have to come from boards of the same size.
+          slots: The slot of each observation. Defaults to the first
+            len(observations) slots.
+
+        Returns:
+          An int64 array of the actions.
+        """
+        if slots is None:
+            slots = range(len(observations))
+        num = len(observations)
+        index = np.arange(num)
+        boards = np.stack([obs['board'] for obs in observations])
+        board_size = boards.shape[1]
+        bomb_life = np.stack([obs['bomb_life'] for obs in observations])
+        bomb_blast_strength = np.stack(
+            [obs['bomb_blast_strength'] for obs in observations])
+        positions = [tuple(obs['position']) for obs in observations]
+        my_x, my_y = np.array(positions, dtype=np.int64).reshape(num, 2).T
+        ammo = np.array([obs['ammo'] for obs in observations])
+        blast_strength = np.array(
+            [obs['blast_strength'] for obs in observations])
+
+        # Enemies are ranked by their last place in obs['enemies'], which is
+        # the order SimpleAgent visits them in.
+        enemy_order = np.full((num, 256), -1, dtype=np.int64)
+        for n, obs in enumerate(observations):
+            for rank, enemy in enumerate(obs['enemies']):
+                enemy_order[n, enemy.value if isinstance(
+                    enemy, constants.Item) else enemy] = rank
+        enemy_rank = enemy_order[index[:, None, None], boards]
+        is_enemy = enemy_rank >= 0
+        passable = _PASSABLE[boards] & ~is_enemy
+
+        rows, cols = _board_geometry(board_size)[:2]
+        x = my_x[:, None, None]
+        y = my_y[:, None, None]
+        in_range = (np.abs(rows - x) + np.abs(cols - y) <= _DEPTH) & \
+                   (rows >= x - _DEPTH) & (rows < x + _DEPTH) & \
+                   (cols >= y - _DEPTH) & (cols < y + _DEPTH) & \
+                   ~_EXCLUDED[boards]
+
+        # Breadth first search of every agent at once, one layer at a time.
+        dist = np.where(in_range, np.inf, -1)
+        frontier = np.zeros(boards.shape, dtype=bool)
+        frontier[index, my_x, my_y] = True
+        dist[frontier] = 0
+        reached = frontier.copy()
+        distance = 0
+        while frontier.any():
+            expand = frontier & passable
+            frontier = np.zeros(boards.shape, dtype=bool)
+            frontier[:, 1:] |= expand[:, :-1]
+            frontier[:, :-1] |= expand[:, 1:]
+            frontier[:, :, 1:] |= expand[:, :, :-1]
+            frontier[:, :, :-1] |= expand[:, :, 1:]
+            frontier &= in_range & ~reached
+            distance += 1
+            dist[frontier] = distance
+            reached |= frontier
+
+        # SimpleAgent draws a random number for every parent after the first
+        # on a shortest path to a cell.
+        parent_dist = np.pad(
+            np.where(reached & passable, dist, -np.inf),
+            ((0, 0), (1, 1), (1, 1)),
+            constant_values=-np.inf)
+        parents = sum(
+            parent_dist[:, 1 + row:board_size + 1 + row, 1 + col:
+                        board_size + 1 + col] == dist - 1
+            for _, (row, col) in _NEIGHBORS)
+        ties = np.where(reached & (dist >= 1), parents - 1,
+                        0).sum(axis=(1, 2)).tolist()
+
+        # When the flames reach each cell, and whether the agents are in
+        # danger now.
+        danger = np.stack([
+            utility.get_danger_map(board, life, strength)
+            for board, life, strength in zip(boards, bomb_life,
+                                             bomb_blast_strength)
+        ])
+        in_danger = (danger[index, my_x, my_y] < np.inf).tolist()
+        is_safe = _neighbors(passable & (danger == np.inf), my_x, my_y,
+                             _RANDOM_MOVES).tolist()
+
+        reached_passages = in_range & reached & (danger == np.inf) & \
+            (boards == constants.Item.Passage.value)
+        can_bomb = ((ammo >= 1) & (
+            reached_passages &
+            ((dist > blast_strength[:, None, None]) | ((rows != x) & (cols != y)))
+        ).any(axis=(1, 2))).tolist()
+        adjacent_enemy = (in_range & is_enemy &
+                          (dist == 1)).any(axis=(1, 2)).tolist()
+
+        # The targets of _near_enemy, _near_good_powerup and _near_wood.
+        cells = board_size * board_size
+        flat_dist = np.where(in_range, dist, np.inf).reshape(num, cells)
+        flat_order = np.arange(cells)
+        enemy_rank = enemy_rank.reshape(num, cells)
+        enemy = _nearest(
+            np.where((enemy_rank >= 0) & (flat_dist <= 3), flat_dist, np.inf),
+            enemy_rank * cells + flat_order)
+        powerup_rank = _POWERUP_RANK[boards].reshape(num, cells)
+        powerup = _nearest(
+            np.where((powerup_rank >= 0) & (flat_dist <= 2), flat_dist,
+                     np.inf), powerup_rank * cells + flat_order)
+        wood = (boards == constants.Item.Wood.value).reshape(num, cells)
+        wood = _nearest(
+            np.where(wood & (flat_dist <= 2), flat_dist, np.inf),
+            np.broadcast_to(flat_order, (num, cells)))
+        targets = np.stack([enemy, powerup, wood], axis=1)
+        target_dist = np.where(
+            targets >= 0, flat_dist[index[:, None],
+                                    np.maximum(targets, 0)], 0).tolist()
+        enemy, powerup, wood = enemy.tolist(), powerup.tolist(), wood.tolist()
+        passable = passable.reshape(num, cells)
+
+        actions = []
+        for n, slot in enumerate(slots):
+            rng = self._rngs[slot]
+            my_position = (positions[n][0], positions[n][1])
+            # Draw the random numbers SimpleAgent's search would, and learn
+            # the paths they pick if a target is more than a step away.
+            drawn = 0
+            prev = None
+            depth = max(target_dist[n])
+            if not in_danger[n] and \
+                    not (adjacent_enemy[n] and can_bomb[n]) and depth > 1:
+                prev, drawn = self._break_ties(
+                    board_size, my_position, flat_dist[n].tolist(),
+                    passable[n].tolist(), depth, rng)
+            for _ in range(ties[n] - drawn):
+                rng.random()
+
+            # Move if we are in an unsafe place.
+            if in_danger[n]:
+                directions = SimpleAgent._find_safe_directions(
+                    boards[n], my_position, danger[n], [
+                        constants.Item(e) for e in observations[n]['enemies']
+                    ])
+                actions.append(rng.choice(directions).value)
+                continue
+
+            # Lay pomme if we are adjacent to an enemy.
+            if adjacent_enemy[n] and can_bomb[n]:
+                actions.append(constants.Action.Bomb.value)
+                continue
+
+            # Move towards an enemy if there is one in exactly three reachable
+            # spaces.
+            direction = self._direction_towards(my_position, enemy[n], prev,
+                                                board_size)
+            if direction is not None and (
+                    self._prev_direction[slot] != direction or
+                    rng.random() < .5):
+                self._prev_direction[slot] = direction
+                actions.append(direction.value)
+                continue
+
+            # Move towards a good item if there is one within two reachable
+            # spaces.
+            direction = self._direction_towards(my_position, powerup[n], prev,
+                                                board_size)
+            if direction is not None:
+                actions.append(direction.value)
+                continue
+
+            # Maybe lay a bomb if we are within a space of a wooden wall.
+            if wood[n] >= 0 and target_dist[n][2] <= 1:
+                if can_bomb[n]:
+                    actions.append(constants.Action.Bomb.value)
+                else:
+                    actions.append(constants.Action.Stop.value)
+                continue
+
+            # Move towards a wooden wall if there is one within two reachable
+            # spaces and you have a bomb.
+            direction = self._direction_towards(my_position, wood[n], prev,
+                                                board_size)
+            if direction is not None:
+                next_position = utility.get_next_position(
+                    my_position, direction)
+                if danger[n][next_position] == np.inf:
+                    actions.append(direction.value)
+                    continue
+
+            # Choose a random but valid direction.
+            recently_visited = self._recently_visited_positions[slot]
+            moves = [(direction, (my_position[0] + row, my_position[1] + col))
+                     for (direction, (row, col)), safe in zip(
+                         _RANDOM_MOVES, is_safe[n]) if safe]
+            directions = [
+                direction for direction, position in moves
+                if position not in recently_visited
+            ] or [direction for direction, _ in moves]
+            if len(directions) > 1:
+                directions = [
+                    k for k in directions if k != constants.Action.Stop
+                ]
+            if not len(directions):
+                directions = [constants.Action.Stop]
+
+            # Add this position to the recently visited uninteresting
+            # positions so we don't return immediately.
+            recently_visited.append(my_position)
+            self._recently_visited_positions[slot] = recently_visited[
+                -self._recently_visited_length:]
+
+            actions.append(rng.choice(directions).value)
+
+        return np.array(actions, dtype=np.int64)
+
+    @staticmethod
+    def _break_ties(board_size, my_position, dist, passable, depth, rng):
+        """Replays the start of SimpleAgent's search to break ties the same way.
+
+        The search is replayed until every cell up to depth steps away has its
+        previous cell.
+
+        Returns:
+          prev: The previous cell of each flat index reached, as a flat index.
+          drawn: How many random numbers were drawn.
+        """
+        neighbors = _board_geometry(board_size)[3]
+        start = my_position[0] * board_size + my_position[1]
+        prev = {}
+        drawn = 0
+        queue = [start]
+        for position in queue:
+            val = dist[position] + 1
+            if val > depth:
+                break
+            if not passable[position]:
+                continue
+            for new_position in neighbors[position]:
+                if dist[new_position] != val:
+                    continue
+                if new_position not in prev:
+                    prev[new_position] = position
+                    queue.append(new_position)
+                else:
+                    drawn += 1
+                    if rng.random() < .5:
+                        prev[new_position] = position
+        return prev, drawn
+
+    @staticmethod
+    def _direction_towards(my_position, target, prev, board_size):
+        '''Returns the first step on the path to the flat index target.'''
+        if target < 0:
+            return None
+
+        positions = _board_geometry(board_size)[2]
+        if prev is not None:
+            start = my_position[0] * board_size + my_position[1]
+            while prev[target] != start:
+                target = prev[target]
+        return utility.get_direction(my_position, positions[target])
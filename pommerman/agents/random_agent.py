@@ -1,9 +1,18 @@
 '''An agent that preforms a random action each step'''
+from gym import spaces
+
 from . import BaseAgent
 
 
+def _sample(space, rng):
+    '''Samples an action from a Discrete or Tuple space with rng.'''
+    if isinstance(space, spaces.Tuple):
+        return [_sample(subspace, rng) for subspace in space.spaces]
+    return rng.randrange(space.n)
+
+
 class RandomAgent(BaseAgent):
     """The Random Agent that returns random actions given an action_space."""
 
     def act(self, obs, action_space):
-        return action_space.sample()
+        return _sample(action_space, self._rng)
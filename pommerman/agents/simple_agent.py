@@ -1,8 +1,8 @@
 '''The base simple agent use to train agents.
 This agent is also the benchmark for other agents.
 '''
-from collections import defaultdict
-import queue
+from collections import defaultdict, deque
+import functools
 import random
 
 import numpy as np
@@ -12,6 +12,45 @@ from .. import constants
 from .. import utility
 
 
+def _lookup_table(items):
+    """Returns a table that maps board values to whether they are in items."""
+    table = np.zeros(256, dtype=bool)
+    table[np.array([item.value for item in items], dtype=np.int64)] = True
+    return table
+
+
+_PASSABLE = _lookup_table([
+    constants.Item.Passage, constants.Item.ExtraBomb, constants.Item.IncrRange,
+    constants.Item.Kick, constants.Item.Agent0, constants.Item.Agent1,
+    constants.Item.Agent2, constants.Item.Agent3
+])
+
+
+_DIRECTIONS = [
+    constants.Action.Up, constants.Action.Down, constants.Action.Left,
+    constants.Action.Right
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _board_geometry(board_size):
+    """Returns the row and column of every cell, as arrays and as tuples, and
+    the flat indices of each cell's neighbors up, down, left and right.
+
+    The tuples are followed by None, so that index -1 stands for no cell.
+    """
+    rows, cols = np.indices((board_size, board_size))
+    positions = list(zip(rows.ravel().tolist(), cols.ravel().tolist()))
+    positions.append(None)
+    neighbors = [
+        tuple((x + row) * board_size + y + col
+              for row, col in [(-1, 0), (1, 0), (0, -1), (0, 1)]
+              if 0 <= x + row < board_size and 0 <= y + col < board_size)
+        for x, y in positions[:-1]
+    ]
+    return rows, cols, positions, neighbors
+
+
 class SimpleAgent(BaseAgent):
     """This is a baseline agent. After you can beat it, submit your agent to
     compete.
@@ -42,29 +81,29 @@ class SimpleAgent(BaseAgent):
         my_position = tuple(obs['position'])
         board = np.array(obs['board'])
         bombs = convert_bombs(np.array(obs['bomb_blast_strength']))
+        danger = utility.get_danger_map(board, np.array(obs['bomb_life']),
+                                        np.array(obs['bomb_blast_strength']))
         enemies = [constants.Item(e) for e in obs['enemies']]
         ammo = int(obs['ammo'])
         blast_strength = int(obs['blast_strength'])
         items, dist, prev = self._djikstra(
-            board, my_position, bombs, enemies, depth=10)
+            board, my_position, bombs, enemies, depth=10, rng=self._rng)
 
         # Move if we are in an unsafe place.
-        unsafe_directions = self._directions_in_range_of_bomb(
-            board, my_position, bombs, dist)
-        if unsafe_directions:
-            directions = self._find_safe_directions(
-                board, my_position, unsafe_directions, bombs, enemies)
-            return random.choice(directions).value
+        if danger[my_position] < np.inf:
+            directions = self._find_safe_directions(board, my_position,
+                                                    danger, enemies)
+            return self._rng.choice(directions).value
 
         # Lay pomme if we are adjacent to an enemy.
         if self._is_adjacent_enemy(items, dist, enemies) and self._maybe_bomb(
-                ammo, blast_strength, items, dist, my_position):
+                ammo, blast_strength, items, dist, my_position, danger):
             return constants.Action.Bomb.value
 
         # Move towards an enemy if there is one in exactly three reachable spaces.
         direction = self._near_enemy(my_position, items, dist, prev, enemies, 3)
         if direction is not None and (self._prev_direction != direction or
-                                      random.random() < .5):
+                                      self._rng.random() < .5):
             self._prev_direction = direction
             return direction.value
 
@@ -75,7 +114,8 @@ class SimpleAgent(BaseAgent):
 
         # Maybe lay a bomb if we are within a space of a wooden wall.
         if self._near_wood(my_position, items, dist, prev, 1):
-            if self._maybe_bomb(ammo, blast_strength, items, dist, my_position):
+            if self._maybe_bomb(ammo, blast_strength, items, dist, my_position,
+                                danger):
                 return constants.Action.Bomb.value
             else:
                 return constants.Action.Stop.value
@@ -84,7 +124,7 @@ class SimpleAgent(BaseAgent):
         direction = self._near_wood(my_position, items, dist, prev, 2)
         if direction is not None:
             directions = self._filter_unsafe_directions(board, my_position,
-                                                        [direction], bombs)
+                                                        [direction], danger)
             if directions:
                 return directions[0].value
 
@@ -96,7 +136,7 @@ class SimpleAgent(BaseAgent):
         valid_directions = self._filter_invalid_directions(
             board, my_position, directions, enemies)
         directions = self._filter_unsafe_directions(board, my_position,
-                                                    valid_directions, bombs)
+                                                    valid_directions, danger)
         directions = self._filter_recently_visited(
             directions, my_position, self._recently_visited_positions)
         if len(directions) > 1:
@@ -109,10 +149,28 @@ class SimpleAgent(BaseAgent):
         self._recently_visited_positions = self._recently_visited_positions[
             -self._recently_visited_length:]
 
-        return random.choice(directions).value
+        return self._rng.choice(directions).value
 
     @staticmethod
-    def _djikstra(board, my_position, bombs, enemies, depth=None, exclude=None):
+    def _djikstra(board,
+                  my_position,
+                  bombs,
+                  enemies,
+                  depth=None,
+                  exclude=None,
+                  rng=random):
+        """Runs a breadth first search from my_position.
+
+        The search works on flat cell indices with passability and range
+        masks computed for the whole board at once. Ties between equally short
+        paths are broken with rng exactly as they always were, so the agent
+        makes the same decisions for the same random stream.
+
+        Returns:
+          items: Maps each Item to the cells in range holding it.
+          dist: Maps each cell in range to its distance, np.inf if unreachable.
+          prev: Maps each cell in range to the previous cell on its path.
+        """
         assert (depth is not None)
 
         if exclude is None:
@@ -120,201 +178,110 @@ class SimpleAgent(BaseAgent):
                 constants.Item.Fog, constants.Item.Rigid, constants.Item.Flames
             ]
 
-        def out_of_range(p_1, p_2):
-            '''Determines if two points are out of rang of each other'''
-            x_1, y_1 = p_1
-            x_2, y_2 = p_2
-            return abs(y_2 - y_1) + abs(x_2 - x_1) > depth
-
-        items = defaultdict(list)
-        dist = {}
-        prev = {}
-        Q = queue.Queue()
-
+        board_size = len(board)
+        rows, cols, positions, neighbors = _board_geometry(board_size)
         my_x, my_y = my_position
-        for r in range(max(0, my_x - depth), min(len(board), my_x + depth)):
-            for c in range(max(0, my_y - depth), min(len(board), my_y + depth)):
-                position = (r, c)
-                if any([
-                        out_of_range(my_position, position),
-                        utility.position_in_items(board, position, exclude),
-                ]):
-                    continue
-
-                prev[position] = None
-                item = constants.Item(board[position])
-                items[item].append(position)
-                
-                if position == my_position:
-                    Q.put(position)
-                    dist[position] = 0
-                else:
-                    dist[position] = np.inf
-
+        in_range = (np.abs(rows - my_x) + np.abs(cols - my_y) <= depth) & \
+                   (rows >= my_x - depth) & (rows < my_x + depth) & \
+                   (cols >= my_y - depth) & (cols < my_y + depth) & \
+                   ~_lookup_table(exclude)[board]
+        passable = _PASSABLE[board] & ~_lookup_table(enemies)[board]
+
+        # Cells out of range get a distance of -1 so the search never
+        # enters them.
+        cells = np.flatnonzero(in_range).tolist()
+        passable = passable.ravel().tolist()
+        dist = np.where(in_range, np.inf, -1).ravel().tolist()
+        prev = [-1] * (board_size * board_size)
+
+        start = my_x * board_size + my_y
+        dist[start] = 0
+        Q = deque([start])
+        while Q:
+            position = Q.popleft()
+            if not passable[position]:
+                continue
 
+            val = dist[position] + 1
+            for new_position in neighbors[position]:
+                if val < dist[new_position]:
+                    dist[new_position] = val
+                    prev[new_position] = position
+                    Q.append(new_position)
+                elif (val == dist[new_position] and rng.random() < .5):
+                    prev[new_position] = position
+
+        cell_positions = [positions[cell] for cell in cells]
+        items_by_value = defaultdict(list)
+        for position, value in zip(cell_positions,
+                                   board.ravel()[cells].tolist()):
+            items_by_value[value].append(position)
+        items = defaultdict(list, ((constants.Item(value), item_positions)
+                                   for value, item_positions in
+                                   items_by_value.items()))
         for bomb in bombs:
             if bomb['position'] == my_position:
                 items[constants.Item.Bomb].append(my_position)
 
-        while not Q.empty():
-            position = Q.get()
-
-            if utility.position_is_passable(board, position, enemies):
-                x, y = position
-                val = dist[(x, y)] + 1
-                for row, col in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    new_position = (row + x, col + y)
-                    if new_position not in dist:
-                        continue
-
-                    if val < dist[new_position]:
-                        dist[new_position] = val
-                        prev[new_position] = position
-                        Q.put(new_position)
-                    elif (val == dist[new_position] and random.random() < .5):
-                        dist[new_position] = val
-                        prev[new_position] = position   
-
-
+        dist = dict(zip(cell_positions, [dist[cell] for cell in cells]))
+        prev = dict(
+            zip(cell_positions, [positions[prev[cell]] for cell in cells]))
         return items, dist, prev
 
-    def _directions_in_range_of_bomb(self, board, my_position, bombs, dist):
-        ret = defaultdict(int)
-
-        x, y = my_position
-        for bomb in bombs:
-            position = bomb['position']
-            distance = dist.get(position)
-            if distance is None:
-                continue
-
-            bomb_range = bomb['blast_strength']
-            if distance > bomb_range:
-                continue
-
-            if my_position == position:
-                # We are on a bomb. All directions are in range of bomb.
-                for direction in [
-                        constants.Action.Right,
-                        constants.Action.Left,
-                        constants.Action.Up,
-                        constants.Action.Down,
-                ]:
-                    ret[direction] = max(ret[direction], bomb['blast_strength'])
-            elif x == position[0]:
-                if y < position[1]:
-                    # Bomb is right.
-                    ret[constants.Action.Right] = max(
-                        ret[constants.Action.Right], bomb['blast_strength'])
-                else:
-                    # Bomb is left.
-                    ret[constants.Action.Left] = max(ret[constants.Action.Left],
-                                                     bomb['blast_strength'])
-            elif y == position[1]:
-                if x < position[0]:
-                    # Bomb is down.
-                    ret[constants.Action.Down] = max(ret[constants.Action.Down],
-                                                     bomb['blast_strength'])
-                else:
-                    # Bomb is down.
-                    ret[constants.Action.Up] = max(ret[constants.Action.Up],
-                                                   bomb['blast_strength'])
-        return ret
-
-    def _find_safe_directions(self, board, my_position, unsafe_directions,
-                              bombs, enemies):
-
-        def is_stuck_direction(next_position, bomb_range, next_board, enemies):
-            '''Helper function to do determine if the agents next move is possible.'''
-            Q = queue.PriorityQueue()
-            Q.put((0, next_position))
-            seen = set()
-
-            next_x, next_y = next_position
-            is_stuck = True
-            while not Q.empty():
-                dist, position = Q.get()
-                seen.add(position)
-
-                position_x, position_y = position
-                if next_x != position_x and next_y != position_y:
-                    is_stuck = False
-                    break
-
-                if dist > bomb_range:
-                    is_stuck = False
-                    break
-
-                for row, col in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                    new_position = (row + position_x, col + position_y)
-                    if new_position in seen:
-                        continue
-
-                    if not utility.position_on_board(next_board, new_position):
-                        continue
-
-                    if not utility.position_is_passable(next_board,
-                                                        new_position, enemies):
-                        continue
-
-                    dist = abs(row + position_x - next_x) + abs(col + position_y - next_y)
-                    Q.put((dist, new_position))
-            return is_stuck
-
-        # All directions are unsafe. Return a position that won't leave us locked.
-        safe = []
-
-        if len(unsafe_directions) == 4:
-            next_board = board.copy()
-            next_board[my_position] = constants.Item.Bomb.value
-
-            for direction, bomb_range in unsafe_directions.items():
-                next_position = utility.get_next_position(
-                    my_position, direction)
-                next_x, next_y = next_position
-                if not utility.position_on_board(next_board, next_position) or \
-                   not utility.position_is_passable(next_board, next_position, enemies):
-                    continue
-
-                if not is_stuck_direction(next_position, bomb_range, next_board,
-                                          enemies):
-                    # We found a direction that works. The .items provided
-                    # a small bit of randomness. So let's go with this one.
-                    return [direction]
-            if not safe:
-                safe = [constants.Action.Stop]
-            return safe
-
-        x, y = my_position
-        disallowed = []  # The directions that will go off the board.
-
-        for row, col in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            position = (x + row, y + col)
-            direction = utility.get_direction(my_position, position)
-
-            # Don't include any direction that will go off of the board.
-            if not utility.position_on_board(board, position):
-                disallowed.append(direction)
-                continue
-
-            # Don't include any direction that we know is unsafe.
-            if direction in unsafe_directions:
-                continue
-
-            if utility.position_is_passable(board, position,
-                                            enemies) or utility.position_is_fog(
-                                                board, position):
-                safe.append(direction)
-
-        if not safe:
-            # We don't have any safe directions, so return something that is allowed.
-            safe = [k for k in unsafe_directions if k not in disallowed]
-
-        if not safe:
-            # We don't have ANY directions. So return the stop choice.
-            return [constants.Action.Stop]
+    @staticmethod
+    def _find_safe_directions(board, my_position, danger, enemies):
+        """Returns the first moves of the shortest ways out of danger.
 
-        return safe
+        A way out ends on a cell that no bomb will reach and only goes through
+        cells that are not in flames yet when the agent gets there. If there
+        is none, the moves that keep the agent out of the flames the longest
+        are returned.
+        """
+        passable = _PASSABLE[board] & ~_lookup_table(enemies)[board]
+
+        def moves(position):
+            for direction in _DIRECTIONS:
+                x, y = utility.get_next_position(position, direction)
+                if 0 <= x < len(board) and 0 <= y < len(board) and \
+                   passable[x, y]:
+                    yield direction, (x, y)
+
+        # The cells reached after each step, with the first moves that reach
+        # them that soon.
+        reached = {}
+        for direction, position in moves(my_position):
+            if danger[position] > 1:
+                reached[position] = {direction}
+        seen = set(reached)
+        seen.add(my_position)
+        step = 1
+        while reached:
+            safe = set()
+            for position, first_moves in reached.items():
+                if danger[position] == np.inf:
+                    safe |= first_moves
+            if safe:
+                return [direction for direction in _DIRECTIONS
+                        if direction in safe]
+
+            step += 1
+            next_reached = defaultdict(set)
+            for position, first_moves in reached.items():
+                for _, next_position in moves(position):
+                    if next_position not in seen and \
+                       danger[next_position] > step:
+                        next_reached[next_position] |= first_moves
+            seen.update(next_reached)
+            reached = next_reached
+
+        # There is no way out, so put off the flames as long as we can.
+        latest = {constants.Action.Stop: danger[my_position]}
+        for direction, position in moves(my_position):
+            latest[direction] = danger[position]
+        return [
+            direction for direction, tick in latest.items()
+            if tick == max(latest.values())
+        ]
 
     @staticmethod
     def _is_adjacent_enemy(items, dist, enemies):
@@ -329,7 +296,7 @@ class SimpleAgent(BaseAgent):
         return obs['ammo'] >= 1
 
     @staticmethod
-    def _maybe_bomb(ammo, blast_strength, items, dist, my_position):
+    def _maybe_bomb(ammo, blast_strength, items, dist, my_position, danger):
         """Returns whether we can safely bomb right now.
 
         Decides this based on:
@@ -343,7 +310,7 @@ class SimpleAgent(BaseAgent):
         # Will we be stuck?
         x, y = my_position
         for position in items.get(constants.Item.Passage):
-            if dist[position] == np.inf:
+            if dist[position] == np.inf or danger[position] < np.inf:
                 continue
 
             # We can reach a passage that's outside of the bomb strength.
@@ -418,19 +385,11 @@ class SimpleAgent(BaseAgent):
         return ret
 
     @staticmethod
-    def _filter_unsafe_directions(board, my_position, directions, bombs):
+    def _filter_unsafe_directions(board, my_position, directions, danger):
         ret = []
         for direction in directions:
-            x, y = utility.get_next_position(my_position, direction)
-            is_bad = False
-            for bomb in bombs:
-                bomb_x, bomb_y = bomb['position']
-                blast_strength = bomb['blast_strength']
-                if (x == bomb_x and abs(bomb_y - y) <= blast_strength) or \
-                   (y == bomb_y and abs(bomb_x - x) <= blast_strength):
-                    is_bad = True
-                    break
-            if not is_bad:
+            position = utility.get_next_position(my_position, direction)
+            if danger[position] == np.inf:
                 ret.append(direction)
         return ret
 
@@ -0,0 +1,435 @@
+'''Module to advance many games at once on stacked NumPy arrays.'''
+import numpy as np
+
+from . import constants
+from .state import GameState, NUM_AGENTS
+
+# Row and column offsets for each Action value. Stop and Bomb do not move.
+_ACTION_DELTAS = np.array([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (0, 0)])
+_POWERUPS = [
+    constants.Item.ExtraBomb.value, constants.Item.IncrRange.value,
+    constants.Item.Kick.value
+]
+_WALLS = [constants.Item.Rigid.value, constants.Item.Wood.value]
+_MAX_AMMO = 10
+_FLAME_LIFE = 2
+
+
+class BatchForwardModel(object):
+    """Steps N games in lockstep.
+
+    The board, item, agent, bomb and flame state of every game lives in a
+    `GameState` with a leading game axis, so one call to `step` advances all
+    of them with a fixed number of array operations instead of walking Python
+    object lists. The rules are the ones of `ForwardModel.step`, including
+    kicks, chain explosions and bounce-backs, and the results match it game
+    for game.
+    """
+
+    def __init__(self,
+                 num_games,
+                 board_size=constants.BOARD_SIZE,
+                 max_blast_strength=10,
+                 state=None):
+        self.num_games = num_games
+        self.board_size = board_size
+        self.max_blast_strength = max_blast_strength
+        self.state = state or GameState(num_games, board_size)
+        assert self.state.num_games == num_games
+        assert self.state.board_size == board_size
+
+    def load(self, index, board, agents, bombs, items, flames):
+        """Copies one game given as `ForwardModel` objects into slot index."""
+        self.state.load_objects(index, board, agents, bombs, items, flames)
+
+    def unload(self, index, agents):
+        """Writes game index back into `ForwardModel` objects.
+
+        Returns:
+          board, agents, bombs, items, flames as `ForwardModel.step` would.
+        """
+        return self.state.to_objects(index, agents)
+
+    def step(self, actions):
+        """Advances every game by one step.
+
+        Args:
+          actions: An int array of shape [num_games, 4]. Actions of dead
+            agents are ignored.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        if actions.min() < 0 or actions.max() >= len(_ACTION_DELTAS):
+            raise constants.InvalidAction("We did not receive a valid action.")
+
+        num_games = self.num_games
+        size = self.board_size
+        cells = size * size
+        game = np.arange(num_games)
+        state = self.state
+        board = state.board.reshape(-1)
+        items = state.items.reshape(-1)
+        agents = state.agents
+        ammo = agents['ammo']
+        blast_strength = agents['blast_strength']
+        can_kick = agents['can_kick']
+
+        def flat(games, positions):
+            '''Index of a cell in the flattened stack of boards'''
+            positions = np.asarray(positions, dtype=np.int64)
+            return games * cells + positions[..., 0] * size + positions[..., 1]
+
+        def on_board(positions):
+            '''Whether the positions are on the board'''
+            return np.all((positions >= 0) & (positions < size), axis=-1)
+
+        def count(indices, minlength):
+            '''Occupancy count of every flat index'''
+            return np.bincount(indices, minlength=minlength)
+
+        # Only the first max(count) slots of the bomb and flame arrays hold
+        # anything, so all of the work below happens on views of those.
+        width = state.flame_count.max(initial=0)
+        flames = state.flames[:, :width]
+        flame_position = flames['position']
+        flame_life = flames['life']
+        flame_active = np.arange(width) < state.flame_count[:, None]
+        flame_games = np.broadcast_to(game[:, None], flame_active.shape)
+
+        # Tick the flames. Dead flames reveal the item underneath them, or
+        # leave a passage if several flames died on the same cell.
+        dead = flame_active & (flame_life == 0)
+        dead_cells = flat(flame_games[dead], flame_position[dead])
+        num_dead = count(dead_cells, num_games * cells)[dead_cells]
+        board[dead_cells] = np.where(num_dead == 1, items[dead_cells],
+                                     constants.Item.Passage.value)
+        items[dead_cells] = constants.Item.Passage.value
+        flame_active &= ~dead
+        flame_life[flame_active] -= 1
+        if dead.any():
+            state.flame_count[...] = self._compact(flame_active, flames)
+            flame_active = np.arange(width) < state.flame_count[:, None]
+
+        # Redraw all current flames.
+        board[flat(flame_games[flame_active], flame_position[flame_active])] = \
+            constants.Item.Flames.value
+
+        # Figure out the desired next positions of the living agents and lay
+        # any requested bombs.
+        agent_alive = agents['is_alive'].copy()
+        agent_games = np.broadcast_to(game[:, None], agent_alive.shape)
+        agent_position = agents['position']
+        agent_cells = flat(agent_games, agent_position)
+        board[agent_cells[agent_alive]] = constants.Item.Passage.value
+
+        has_bomb = state.bomb_id.reshape(-1)[agent_cells] >= 0
+        lay = agent_alive & (actions == constants.Action.Bomb.value) & \
+              ~has_bomb & (ammo > 0)
+        ammo[lay] -= 1
+        new_games, new_agents = np.nonzero(lay)
+        slots = self._append_slots(new_games, state.bomb_count)
+        new_bombs = state.bombs[new_games, slots]
+        new_bombs['position'] = agent_position[lay]
+        new_bombs['bomber_id'] = new_agents
+        new_bombs['life'] = constants.DEFAULT_BOMB_LIFE
+        new_bombs['blast_strength'] = blast_strength[lay]
+        new_bombs['moving_direction'] = constants.Action.Stop.value
+        state.bombs[new_games, slots] = new_bombs
+        state.bomb_count += np.bincount(new_games, minlength=num_games)
+
+        targets = agent_position + _ACTION_DELTAS[actions]
+        valid = agent_alive & (actions >= constants.Action.Up.value) & \
+                (actions <= constants.Action.Right.value) & on_board(targets)
+        valid[valid] = ~np.isin(board[flat(agent_games[valid], targets[valid])],
+                                _WALLS)
+        agent_desired = np.where(valid[..., None], targets, agent_position)
+
+        # Gather desired next positions for moving bombs. Handle kicks later.
+        width = state.bomb_count.max(initial=0)
+        bombs = state.bombs[:, :width]
+        bomb_position = bombs['position']
+        bomb_life = bombs['life']
+        bomb_moving_direction = bombs['moving_direction']
+        bomb_active = np.arange(width) < state.bomb_count[:, None]
+        bomb_games = np.broadcast_to(game[:, None], bomb_active.shape)
+        bomb_cells = flat(bomb_games, bomb_position)
+        board[bomb_cells[bomb_active]] = constants.Item.Passage.value
+
+        targets = bomb_position + _ACTION_DELTAS[bomb_moving_direction]
+        valid = bomb_active & (bomb_moving_direction > 0) & on_board(targets)
+        valid[valid] = ~np.isin(board[flat(bomb_games[valid], targets[valid])],
+                                _POWERUPS + _WALLS)
+        bomb_desired = np.where(valid[..., None], targets, bomb_position)
+
+        # Position switches:
+        # Agent <-> Agent => revert both to previous position.
+        # Bomb <-> Bomb => revert both to previous position.
+        # Agent <-> Bomb => revert Bomb to previous position.
+        # A border is identified by the lower cell and the axis of the move.
+        def border(games, current, desired):
+            '''Flat index of the border crossed between two cells'''
+            low = np.minimum(current, desired)
+            axis = (current[..., 0] == desired[..., 0]).astype(np.int64)
+            return 2 * flat(games, low) + axis
+
+        num_borders = 2 * num_games * cells
+        moving = agent_alive & np.any(agent_desired != agent_position, axis=-1)
+        agent_borders = border(agent_games[moving], agent_position[moving],
+                               agent_desired[moving])
+        agent_crossings = count(agent_borders, num_borders)
+        crossed = agent_crossings[agent_borders] > 1
+        agent_desired[moving] = np.where(crossed[:, None],
+                                         agent_position[moving],
+                                         agent_desired[moving])
+
+        moving = valid
+        bomb_borders = border(bomb_games[moving], bomb_position[moving],
+                              bomb_desired[moving])
+        crossed = (agent_crossings[bomb_borders] > 0) | \
+                  (count(bomb_borders, num_borders)[bomb_borders] > 1)
+        bomb_desired[moving] = np.where(crossed[:, None], bomb_position[moving],
+                                        bomb_desired[moving])
+
+        # Deal with multiple agents or multiple bomb collisions on desired next
+        # position by resetting desired position to current position for
+        # everyone involved in the collision. Occupancy counts only ever grow,
+        # so reverting everything that collides in each pass reaches the same
+        # fixed point as reverting one entity at a time.
+        agent_occupancy = count(
+            flat(agent_games[agent_alive], agent_desired[agent_alive]),
+            num_games * cells)
+        bomb_occupancy = count(
+            flat(bomb_games[bomb_active], bomb_desired[bomb_active]),
+            num_games * cells)
+
+        def revert_agents(revert):
+            '''Sends the agents back to their current position'''
+            agent_desired[revert] = agent_position[revert]
+            np.add.at(agent_occupancy, agent_cells[revert], 1)
+
+        def revert_bombs(revert):
+            '''Sends the bombs back to their current position'''
+            bomb_desired[revert] = bomb_position[revert]
+            np.add.at(bomb_occupancy, bomb_cells[revert], 1)
+
+        while True:
+            agent_desired_cells = flat(agent_games, agent_desired)
+            bomb_desired_cells = flat(bomb_games, bomb_desired)
+            revert_agent = agent_alive & \
+                (agent_desired_cells != agent_cells) & \
+                ((agent_occupancy[agent_desired_cells] > 1) |
+                 (bomb_occupancy[agent_desired_cells] > 1))
+            revert_bomb = bomb_active & (bomb_desired_cells != bomb_cells) & \
+                ((bomb_occupancy[bomb_desired_cells] > 1) |
+                 (agent_occupancy[bomb_desired_cells] > 1))
+            if not revert_agent.any() and not revert_bomb.any():
+                break
+            revert_agents(revert_agent)
+            revert_bombs(revert_bomb)
+
+        # Handle kicks. Look at every bomb whose desired position is also the
+        # desired position of an agent.
+        agent_at = np.full(num_games * cells, -1, dtype=np.int64)
+        agent_at[agent_desired_cells[agent_alive]] = \
+            np.nonzero(agent_alive.reshape(-1))[0]
+        kicker = np.where(bomb_active, agent_at[bomb_desired_cells], -1)
+        kicker[agent_occupancy[bomb_desired_cells] == 0] = -1
+        touched = kicker >= 0
+        kicker_ = kicker[touched]
+        agent_stayed = agent_desired_cells.reshape(-1)[kicker_] == \
+                       agent_cells.reshape(-1)[kicker_]
+
+        # Agent did not move. If the bomb moved, it should revert and stop.
+        bomb_stays = np.zeros_like(touched)
+        bomb_stays[touched] = agent_stayed & \
+            (bomb_desired_cells[touched] != bomb_cells[touched])
+
+        # The agent moved into the bomb. See if it can kick it onto a cell
+        # that never had anything on it.
+        kicking = ~agent_stayed & can_kick.reshape(-1)[kicker_]
+        direction = actions.reshape(-1)[kicker_]
+        targets = bomb_desired[touched] + _ACTION_DELTAS[direction]
+        kicking &= on_board(targets)
+        target_cells = flat(bomb_games[touched][kicking], targets[kicking])
+        kicking[kicking] = (agent_occupancy[target_cells] == 0) & \
+                           (bomb_occupancy[target_cells] == 0) & \
+                           ~np.isin(board[target_cells], _POWERUPS + _WALLS)
+        bounced = ~agent_stayed & ~kicking
+
+        kicked = np.zeros_like(touched)
+        kicked[touched] = kicking
+        # The kicker can stay on the bomb's square, so clear that occupancy.
+        bomb_occupancy[bomb_desired_cells[kicked]] = 0
+        bomb_kicker = np.where(kicked, kicker, -1)
+        bomb_moving_direction[kicked] = direction[kicking]
+
+        # Apply the delayed updates: kicked bombs move on, bounced bombs and
+        # agents revert.
+        bomb_stays[touched] |= bounced
+        bomb_desired[kicked] = targets[kicking]
+        np.add.at(bomb_occupancy, flat(bomb_games[kicked], targets[kicking]),
+                  1)
+        revert_bombs(bomb_stays)
+        agent_bounced = np.zeros(num_games * NUM_AGENTS, dtype=bool)
+        agent_bounced[kicker_[bounced]] = True
+        agent_bounced = agent_bounced.reshape(agent_alive.shape)
+        revert_agents(agent_bounced)
+
+        # Late collisions resulting from failed kicks. Only games that had
+        # delayed updates need another pass. Agents and bombs can only share a
+        # square if they are both in their original position.
+        changed = (kicked | bomb_stays).any(axis=1) | agent_bounced.any(axis=1)
+        while changed.any():
+            agent_desired_cells = flat(agent_games, agent_desired)
+            bomb_desired_cells = flat(bomb_games, bomb_desired)
+            revert_agent = changed[:, None] & agent_alive & \
+                (agent_desired_cells != agent_cells) & \
+                ((agent_occupancy[agent_desired_cells] > 1) |
+                 (bomb_occupancy[agent_desired_cells] != 0))
+            # A kicked bomb may be a boomerang, i.e. kicked back to where it
+            # came from. It still reverts its kicker if it is blocked.
+            revert_bomb = changed[:, None] & bomb_active & \
+                ((bomb_desired_cells != bomb_cells) | (bomb_kicker >= 0)) & \
+                ((bomb_occupancy[bomb_desired_cells] > 1) |
+                 (agent_occupancy[bomb_desired_cells] != 0))
+            if not revert_agent.any() and not revert_bomb.any():
+                break
+
+            # Undo kicks where either the kicker or the kicked bomb reverts.
+            undo = bomb_kicker >= 0
+            undo[undo] = revert_bomb[undo] | \
+                revert_agent.reshape(-1)[bomb_kicker[undo]]
+            revert_bomb |= undo
+            revert_agent = revert_agent.reshape(-1)
+            revert_agent[bomb_kicker[undo]] = True
+            revert_agent = revert_agent.reshape(agent_alive.shape)
+            bomb_kicker[undo] = -1
+            revert_agents(revert_agent)
+            revert_bombs(revert_bomb)
+
+        # Move the bombs. Bombs that stay where they are and were not kicked
+        # this turn stop, in case they were moving before.
+        stopped = bomb_active & np.all(bomb_desired == bomb_position,
+                                       axis=-1) & (bomb_kicker < 0)
+        bomb_moving_direction[stopped] = constants.Action.Stop.value
+        bomb_position[...] = bomb_desired
+
+        # Move the agents and pick up powerups.
+        moved = agent_alive & np.any(agent_desired != agent_position, axis=-1)
+        agent_position[...] = agent_desired
+        agent_cells = flat(agent_games, agent_position)
+        picked = np.where(moved, board[agent_cells], 0)
+        extra_bomb = picked == constants.Item.ExtraBomb.value
+        ammo[extra_bomb] = np.minimum(ammo[extra_bomb] + 1, _MAX_AMMO)
+        incr_range = picked == constants.Item.IncrRange.value
+        blast_strength[incr_range] = np.minimum(
+            blast_strength[incr_range] + 1, self.max_blast_strength)
+        can_kick[picked == constants.Item.Kick.value] = True
+
+        # Explode bombs. Bombs whose life ran out or that moved into flames
+        # go off, then everything caught in a blast goes off with them.
+        bomb_cells = flat(bomb_games, bomb_position)
+        bomb_life[bomb_active] -= 1
+        exploding = bomb_active & (bomb_life == 0)
+        fired = bomb_active & ~exploding & \
+                (board[bomb_cells] == constants.Item.Flames.value)
+        bomb_life[fired] = 0
+        exploding |= fired
+
+        exploded_map = np.zeros(num_games * cells, dtype=bool)
+        exploded = np.zeros_like(exploding)
+        while exploding.any():
+            exploded |= exploding
+            exploded_map[self._blast_cells(
+                bomb_games[exploding], bomb_position[exploding],
+                bombs['blast_strength'][exploding])] = True
+            exploding = bomb_active & ~exploded & exploded_map[bomb_cells]
+            bomb_life[exploding] = 0
+
+        if exploded.any():
+            refunds = np.zeros(num_games * NUM_AGENTS, dtype=np.int64)
+            np.add.at(refunds,
+                      bomb_games[exploded] * NUM_AGENTS +
+                      bombs['bomber_id'][exploded], 1)
+            refunds = refunds.reshape(agent_alive.shape)
+            refunded = refunds > 0
+            ammo[refunded] = np.minimum(ammo[refunded] + refunds[refunded],
+                                        _MAX_AMMO)
+
+            bomb_active &= ~exploded
+            state.bomb_count[...] = self._compact(bomb_active, bombs)
+            bomb_active = np.arange(width) < state.bomb_count[:, None]
+
+        # Update the board's bombs.
+        board[flat(bomb_games[bomb_active], bomb_position[bomb_active])] = \
+            constants.Item.Bomb.value
+
+        # Update the board's flames.
+        new_games, new_cells = np.divmod(np.nonzero(exploded_map)[0], cells)
+        slots = self._append_slots(new_games, state.flame_count)
+        new_flames = state.flames[new_games, slots]
+        new_flames['position'] = np.stack(np.divmod(new_cells, size), axis=-1)
+        new_flames['life'] = _FLAME_LIFE
+        state.flames[new_games, slots] = new_flames
+        state.flame_count += np.bincount(new_games, minlength=num_games)
+        width = state.flame_count.max(initial=0)
+        flame_active = np.arange(width) < state.flame_count[:, None]
+        flame_games = np.broadcast_to(game[:, None], flame_active.shape)
+        board[flat(flame_games[flame_active],
+                   state.flames['position'][:, :width][flame_active])] = \
+            constants.Item.Flames.value
+
+        # Kill agents on flames. Otherwise, update position on the board.
+        burnt = agent_alive & (board[agent_cells] == constants.Item.Flames.value)
+        agents['is_alive'][burnt] = False
+        standing = agent_alive & ~burnt
+        board[agent_cells[standing]] = (
+            constants.Item.Agent0.value +
+            np.nonzero(standing)[1]).astype(np.uint8)
+
+        state.update_planes()
+        state.step_count += 1
+
+    def _blast_cells(self, games, positions, blast_strengths):
+        """Flat indices of every cell caught in the given bombs' blasts.
+
+        A blast covers its own cell and up to blast_strength - 1 cells in each
+        direction. It stops before rigid walls and after wooden walls.
+        """
+        size = self.board_size
+        board = self.state.board.reshape(-1)
+        positions = positions.astype(np.int64)
+        offsets = games * size * size
+        ret = [offsets + positions[:, 0] * size + positions[:, 1]]
+        for row, col in _ACTION_DELTAS[1:5]:
+            reaching = np.ones(len(games), dtype=bool)
+            for distance in range(1, max(blast_strengths.max(initial=0), 1)):
+                rows = positions[:, 0] + row * distance
+                cols = positions[:, 1] + col * distance
+                reaching &= (distance < blast_strengths) & (rows >= 0) & \
+                            (rows < size) & (cols >= 0) & (cols < size)
+                if not reaching.any():
+                    break
+                cells = offsets[reaching] + rows[reaching] * size + \
+                        cols[reaching]
+                values = board[cells]
+                rigid = values == constants.Item.Rigid.value
+                ret.append(cells[~rigid])
+                stopped = rigid | (values == constants.Item.Wood.value)
+                reaching[reaching] = ~stopped
+        return np.concatenate(ret)
+
+    @staticmethod
+    def _append_slots(games, counts):
+        """Slots for new entries appended to the given (sorted) games."""
+        first = np.searchsorted(games, games)
+        return counts[games] + np.arange(len(games)) - first
+
+    @staticmethod
+    def _compact(keep, records):
+        """Packs the kept records of each game to the front, in order.
+
+        Returns the number of kept records per game.
+        """
+        order = np.argsort(~keep, axis=1, kind='stable')
+        records[...] = np.take_along_axis(records, order, axis=1)
+        return keep.sum(axis=1)
@@ -1,2 +1,3 @@
 '''CLI module entry point'''
 from . import run_battle
+from . import tournament
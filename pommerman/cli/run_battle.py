@@ -9,6 +9,10 @@ python run_battle.py --agents=test::agents.SimpleAgent,test::agents.SimpleAgent,
 An example with one player, two random agents, and one test agent:
 python run_battle.py --agents=player::arrows,test::agents.SimpleAgent,random::null,random::null --config=PommeFFACompetition-v0
 
+An example of a headless run, which never renders or sleeps and reports the
+steps per second:
+python run_battle.py --agents=test::agents.SimpleAgent,test::agents.SimpleAgent,test::agents.SimpleAgent,test::agents.SimpleAgent --config=PommeFFACompetition-v0 --headless --record_json_dir=battles
+
 An example with a docker agent:
 python run_battle.py --agents=player::arrows,docker::pommerman/test-agent,random::null,random::null --config=PommeFFACompetition-v0
 """
@@ -24,6 +28,7 @@ import numpy as np
 
 from .. import helpers
 from .. import make
+from .. import replay
 from pommerman import utility
 
 
@@ -32,10 +37,12 @@ def run(args, num_times=1, seed=None):
     config = args.config
     record_pngs_dir = args.record_pngs_dir
     record_json_dir = args.record_json_dir
+    record_replay_dir = getattr(args, 'record_replay_dir', None)
     agent_env_vars = args.agent_env_vars
     game_state_file = args.game_state_file
     render_mode = args.render_mode
     do_sleep = args.do_sleep
+    headless = getattr(args, 'headless', False)
 
     agents = [
         helpers.make_agent_from_string(agent_string, agent_id)
@@ -44,16 +51,69 @@ def run(args, num_times=1, seed=None):
 
     env = make(config, agents, game_state_file, render_mode=render_mode)
 
-    def _run(record_pngs_dir=None, record_json_dir=None):
+    def _replay_writer(replay_file):
+        '''Returns a ReplayWriter for replay_file, None if not recording'''
+        if not replay_file:
+            return None
+        return replay.ReplayWriter(
+            replay_file,
+            metadata={'agents': args.agents.split(','), 'config': config})
+
+    def _run_headless(record_json_dir=None, replay_file=None):
+        '''Runs a game at engine speed, without rendering or sleeping'''
+        print("Starting the Game.")
+        writer = None
+        if record_json_dir:
+            if not os.path.isdir(record_json_dir):
+                os.makedirs(record_json_dir)
+            writer = utility.JsonStateWriter(record_json_dir)
+        replay_writer = _replay_writer(replay_file)
+
+        start = time.time()
+        obs = env.reset()
+        done = False
+        if replay_writer:
+            replay_writer.record(env)
+
+        while not done:
+            if writer:
+                writer.record(env)
+            actions = env.act(obs)
+            obs, reward, done, info = env.step(actions)
+            if replay_writer:
+                replay_writer.record(env, actions)
+
+        if writer:
+            writer.record(env)
+        elapsed = time.time() - start
+
+        print("Final Result: ", info)
+        print("Steps/sec: ", env._step_count / elapsed)
+
+        if replay_writer:
+            replay_writer.close(info)
+        if writer:
+            finished_at = datetime.now().isoformat()
+            writer.write(args.agents.split(','), finished_at, config, info)
+
+        return info
+
+    def _run(record_pngs_dir=None, record_json_dir=None, replay_file=None):
         '''Runs a game'''
+        if headless:
+            return _run_headless(record_json_dir, replay_file)
+
         print("Starting the Game.")
         if record_pngs_dir and not os.path.isdir(record_pngs_dir):
             os.makedirs(record_pngs_dir)
         if record_json_dir and not os.path.isdir(record_json_dir):
             os.makedirs(record_json_dir)
+        replay_writer = _replay_writer(replay_file)
 
         obs = env.reset()
         done = False
+        if replay_writer:
+            replay_writer.record(env)
 
         while not done:
             if args.render:
@@ -66,8 +126,12 @@ def run(args, num_times=1, seed=None):
                 time.sleep(1.0 / env._render_fps)
             actions = env.act(obs)
             obs, reward, done, info = env.step(actions)
+            if replay_writer:
+                replay_writer.record(env, actions)
 
         print("Final Result: ", info)
+        if replay_writer:
+            replay_writer.close(info)
         if args.render:
             env.render(
                 record_pngs_dir=record_pngs_dir,
@@ -96,6 +160,9 @@ def run(args, num_times=1, seed=None):
     random.seed(seed)
     env.seed(seed)
 
+    if record_replay_dir and not os.path.isdir(record_replay_dir):
+        os.makedirs(record_replay_dir)
+
     infos = []
     times = []
     for i in range(num_times):
@@ -105,7 +172,9 @@ def run(args, num_times=1, seed=None):
                            if record_pngs_dir else None
         record_json_dir_ = record_json_dir + '/%d' % (i+1) \
                            if record_json_dir else None
-        infos.append(_run(record_pngs_dir_, record_json_dir_))
+        replay_file = os.path.join(record_replay_dir, '%d.replay' % (i+1)) \
+                      if record_replay_dir else None
+        infos.append(_run(record_pngs_dir_, record_json_dir_, replay_file))
 
         times.append(time.time() - start)
         print("Game Time: ", times[-1])
@@ -114,6 +183,11 @@ def run(args, num_times=1, seed=None):
     return infos
 
 
+def _to_bool(value):
+    '''Parses a boolean flag such as "False" or "1"'''
+    return value.lower() in ('true', 'yes', '1')
+
+
 def main():
     '''CLI entry pointed used to bootstrap a battle'''
     simple_agent = 'test::agents.SimpleAgent'
@@ -151,6 +225,11 @@ def main():
         default=None,
         help='Directory to record the JSON representations of '
         "the game. Doesn't record if None.")
+    parser.add_argument(
+        '--record_replay_dir',
+        default=None,
+        help='Directory to record a compact binary replay of each game '
+        "in, see pommerman.replay. Doesn't record if None.")
     parser.add_argument(
         "--render",
         default=False,
@@ -167,7 +246,16 @@ def main():
     parser.add_argument(
         '--do_sleep',
         default=True,
+        type=_to_bool,
         help="Whether we sleep after each rendering.")
+    parser.add_argument(
+        "--headless",
+        default=False,
+        action='store_true',
+        help="Run at engine speed: never render, never sleep and never "
+        "load the graphics. JSON is buffered and written once per game, and "
+        "the steps per second are reported. Ignores --render and "
+        "--record_pngs_dir.")
     args = parser.parse_args()
     run(args)
 
@@ -0,0 +1,273 @@
+"""Run a tournament of many games among the same agents.
+
+The games are spread over a pool of worker processes. Each game gets its own
+seed, drawn from a master seed, and fresh agents, so the results for a master
+seed are the same whatever the number of workers. Results are printed as the
+games finish, followed by each agent's win/tie/loss rates, the average game
+length and each agent's step latency, all with 95% confidence intervals. Docker
+agents get host ports of their own in each worker.
+
+An example with four SimpleAgents playing 1000 games on 8 workers:
+python tournament.py --agents=test::agents.SimpleAgent,test::agents.SimpleAgent,test::agents.SimpleAgent,test::agents.SimpleAgent --config=PommeFFACompetition-v0 --num_games=1000 --num_workers=8
+"""
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import argparse
+import numpy as np
+
+from .. import constants
+from .. import helpers
+from .. import make
+
+# The z-score of a two sided 95% confidence interval.
+_Z = 1.96
+
+# The index of this pool worker, which sets apart the host ports of its docker
+# agents from those of the other workers.
+_WORKER_INDEX = 0
+
+
+def _timed(act, latency):
+    '''Wraps an agent's act to add the time of each call to latency.'''
+
+    def act_(obs, action_space):
+        start = time.perf_counter()
+        action = act(obs, action_space)
+        elapsed = time.perf_counter() - start
+        latency[0] += elapsed
+        latency[1] += elapsed * elapsed
+        latency[2] += 1
+        return action
+
+    return act_
+
+
+def play_game(config, agent_strings, seed, port_offset=0):
+    """Plays one game with fresh agents.
+
+    Args:
+      config: The id of the config to play, e.g. 'PommeFFACompetition-v0'.
+      agent_strings: The agent strings, as accepted by
+        `helpers.make_agent_from_string`.
+      seed: The seed of the game.
+      port_offset: Added to the host ports of the docker agents, so that games
+        played at the same time don't share them.
+
+    Returns:
+      A dict with the seed, the result, the ids of the winners, the number of
+      steps and, for each agent, the sum and the sum of squares of its step
+      latencies in seconds and the number of steps it acted in.
+    """
+    agents = [
+        helpers.make_agent_from_string(
+            agent_string, agent_id, port_offset=port_offset)
+        for agent_id, agent_string in enumerate(agent_strings)
+    ]
+    latencies = [[0., 0., 0] for _ in agents]
+    for agent, latency in zip(agents, latencies):
+        agent.act = _timed(agent.act, latency)
+
+    env = make(config, agents)
+    try:
+        np.random.seed(seed)
+        random.seed(seed)
+        env.seed(seed)
+
+        obs = env.reset()
+        done = False
+        while not done:
+            obs, reward, done, info = env.step(env.act(obs))
+        steps = env._step_count
+    finally:
+        env.close()
+
+    return {
+        'seed': seed,
+        'result': info['result'].name,
+        'winners': info.get('winners', []),
+        'steps': steps,
+        'latencies': latencies
+    }
+
+
+def _init_worker(counter):
+    global _WORKER_INDEX
+    with counter.get_lock():
+        _WORKER_INDEX = counter.value
+        counter.value += 1
+
+
+def _play_game(task):
+    num, (config, agent_strings, seed) = task
+    return num, play_game(config, agent_strings, seed,
+                          _WORKER_INDEX * len(agent_strings))
+
+
+def _rate_interval(count, total):
+    '''Returns the rate count / total and its 95% Wilson score interval.'''
+    rate = count / total
+    denominator = 1 + _Z**2 / total
+    center = (rate + _Z**2 / (2 * total)) / denominator
+    spread = _Z * math.sqrt(rate * (1 - rate) / total +
+                            _Z**2 / (4 * total**2)) / denominator
+    return rate, max(center - spread, 0.), min(center + spread, 1.)
+
+
+def _mean_interval(total, total_squares, count):
+    '''Returns a mean and its 95% confidence interval from running sums.'''
+    if count == 0:
+        return float('nan'), float('nan'), float('nan')
+    mean = total / count
+    variance = max(total_squares / count - mean * mean, 0.)
+    if count > 1:
+        variance *= count / (count - 1)
+    spread = _Z * math.sqrt(variance / count)
+    return mean, mean - spread, mean + spread
+
+
+def summarize(results, num_agents):
+    """Aggregates the results of `play_game`.
+
+    Args:
+      results: A list of the dicts returned by `play_game`.
+      num_agents: The number of agents in each game.
+
+    Returns:
+      A dict with the number of games, the (mean, low, high) game length and,
+      for each agent, its (rate, low, high) 'win', 'tie' and 'loss' rates and
+      its (mean, low, high) step latency in seconds.
+    """
+    num_games = len(results)
+    steps = [result['steps'] for result in results]
+    summary = {
+        'num_games': num_games,
+        'steps': _mean_interval(
+            sum(steps), sum(step * step for step in steps), num_games),
+        'agents': []
+    }
+
+    ties = sum(result['result'] == constants.Result.Tie.name
+               for result in results)
+    for agent_id in range(num_agents):
+        wins = sum(agent_id in result['winners'] for result in results)
+        latency = np.sum([result['latencies'][agent_id] for result in results],
+                         axis=0).tolist()
+        summary['agents'].append({
+            'win': _rate_interval(wins, num_games),
+            'tie': _rate_interval(ties, num_games),
+            'loss': _rate_interval(num_games - wins - ties, num_games),
+            'latency': _mean_interval(latency[0], latency[1], int(latency[2]))
+        })
+    return summary
+
+
+def run(config, agent_strings, num_games, num_workers=None, seed=None,
+        callback=None):
+    """Plays num_games games over a pool of worker processes.
+
+    Args:
+      config: The id of the config to play.
+      agent_strings: The agent strings, as accepted by
+        `helpers.make_agent_from_string`.
+      num_games: The number of games to play.
+      num_workers: The number of worker processes. Defaults to the number of
+        CPUs.
+      seed: The master seed the seeds of the games are drawn from. Defaults
+        to a random one.
+      callback: Called with the result of each game as soon as it finishes.
+
+    Returns:
+      The results of the games, in the order of their seeds, and their
+      summary. See `play_game` and `summarize`.
+    """
+    if seed is None:
+        # Pick a random seed between 0 and 2^31 - 1
+        seed = random.randint(0, np.iinfo(np.int32).max)
+    master = random.Random(seed)
+    seeds = [master.randint(0, np.iinfo(np.int32).max)
+             for _ in range(num_games)]
+
+    results = {}
+    tasks = [(config, agent_strings, game_seed) for game_seed in seeds]
+    counter = multiprocessing.Value('i', 0)
+    with multiprocessing.Pool(
+            num_workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(counter,)) as pool:
+        for num, result in pool.imap_unordered(_play_game, enumerate(tasks)):
+            results[num] = result
+            if callback is not None:
+                callback(result)
+
+    results = [results[num] for num in range(num_games)]
+    return results, summarize(results, len(agent_strings))
+
+
+def _format_interval(name, interval, scale=1, unit=''):
+    value, low, high = [scale * value for value in interval]
+    return '%s %.3f%s [%.3f, %.3f]' % (name, value, unit, low, high)
+
+
+def main():
+    '''CLI entry point to run a tournament'''
+    simple_agent = 'test::agents.SimpleAgent'
+
+    parser = argparse.ArgumentParser(description='Playground Flags.')
+    parser.add_argument(
+        '--config',
+        default='PommeFFACompetition-v0',
+        help='Configuration to execute. See env_ids in '
+        'configs.py for options.')
+    parser.add_argument(
+        '--agents',
+        default=','.join([simple_agent] * 4),
+        help='Comma delineated list of agent types and docker '
+        'locations to run the agents.')
+    parser.add_argument(
+        '--num_games',
+        default=100,
+        type=int,
+        help='Number of games to play.')
+    parser.add_argument(
+        '--num_workers',
+        default=None,
+        type=int,
+        help='Number of worker processes. Defaults to the number of CPUs.')
+    parser.add_argument(
+        '--seed',
+        default=None,
+        type=int,
+        help='Master seed the seeds of the games are drawn from.')
+    args = parser.parse_args()
+
+    agent_strings = args.agents.split(',')
+    finished = [0]
+
+    def _report(result):
+        finished[0] += 1
+        print('Game %d/%d: seed %d, %s, winners %s, %d steps' %
+              (finished[0], args.num_games, result['seed'], result['result'],
+               result['winners'], result['steps']))
+
+    start = time.time()
+    _, summary = run(args.config, agent_strings, args.num_games,
+                     args.num_workers, args.seed, _report)
+
+    print('Played %d games in %.1fs' % (summary['num_games'],
+                                        time.time() - start))
+    print(_format_interval('Game length', summary['steps'], unit=' steps'))
+    for agent_id, (agent_string, stats) in enumerate(
+            zip(agent_strings, summary['agents'])):
+        print('Agent %d (%s): %s, %s, %s, %s' %
+              (agent_id, agent_string, _format_interval('win', stats['win']),
+               _format_interval('tie', stats['tie']),
+               _format_interval('loss', stats['loss']),
+               _format_interval('latency', stats['latency'], 1000, 'ms')))
+
+
+if __name__ == "__main__":
+    main()
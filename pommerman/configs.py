@@ -5,6 +5,10 @@ and loading them.
 
 NOTE: If you add a new config to this, add a _env on the end of the function
 in order for it to be picked up by the gym registrations.
+
+NOTE: The bomb planes of observations are uint8 unless env_kwargs sets an
+observation_dtype. The configs below predate that and keep float64 so that
+agents built against them see the same observations.
 """
 import contextlib
 import logging
@@ -31,6 +35,7 @@ def ffa_competition_env():
         'num_items': constants.NUM_ITEMS,
         'max_steps': constants.MAX_STEPS,
         'render_fps': constants.RENDER_FPS,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -51,6 +56,7 @@ def ffa_competition_fast_env():
         'num_items': constants.NUM_ITEMS,
         'max_steps': constants.MAX_STEPS,
         'render_fps': 1000,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -73,6 +79,7 @@ def team_competition_env():
         'render_fps': constants.RENDER_FPS,
         'agent_view_size': constants.AGENT_VIEW_SIZE,
         'is_partially_observable': True,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -95,6 +102,7 @@ def team_competition_fast_env():
         'render_fps': 1000,
         'agent_view_size': constants.AGENT_VIEW_SIZE,
         'is_partially_observable': True,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -118,6 +126,7 @@ def team_competition_v1_env():
         'render_fps': constants.RENDER_FPS,
         'agent_view_size': constants.AGENT_VIEW_SIZE,
         'is_partially_observable': True,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -138,6 +147,7 @@ def ffa_v0_fast_env():
         'num_items': constants.NUM_ITEMS,
         'max_steps': constants.MAX_STEPS,
         'render_fps': 1000,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -159,6 +169,7 @@ def ffa_v1_env():
         'first_collapse': constants.FIRST_COLLAPSE,
         'max_steps': constants.MAX_STEPS,
         'render_fps': constants.RENDER_FPS,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -179,6 +190,7 @@ def team_v0_env():
         'num_items': constants.NUM_ITEMS,
         'max_steps': constants.MAX_STEPS,
         'render_fps': constants.RENDER_FPS,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -199,6 +211,7 @@ def team_v0_fast_env():
         'num_items': constants.NUM_ITEMS,
         'max_steps': constants.MAX_STEPS,
         'render_fps': 2000,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -223,6 +236,7 @@ def radio_v2_env():
         'radio_vocab_size': constants.RADIO_VOCAB_SIZE,
         'radio_num_words': constants.RADIO_NUM_WORDS,
         'render_fps': constants.RENDER_FPS,
+        'observation_dtype': 'float64',
         'env': env_entry_point,
     }
     agent = characters.Bomber
@@ -128,3 +128,8 @@ class Result(Enum):
 class InvalidAction(Exception):
     '''Invalid Actions Exception'''
     pass
+
+
+class ReplayMismatch(Exception):
+    '''Re-simulating a replay did not reproduce the recorded states'''
+    pass
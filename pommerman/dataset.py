@@ -0,0 +1,304 @@
+'''Columnar datasets of recorded games for offline RL and imitation learning.
+
+`export` turns replays (see `pommerman.replay`) into one row per transition,
+stored column by column in chunks of .npy files that `Dataset` memory maps.
+Batches are gathered from the chunks on demand, so a dataset can be much
+larger than RAM.
+
+Columns, N rows per chunk:
+  board: [N, S, S] uint8, the board, as in `Pomme._board`.
+  bomb_life, bomb_blast_strength, bomb_moving_direction: [N, S, S] uint8
+    bomb planes, 0 where there is no bomb. The moving direction is the
+    Action value.
+  agents: [N, 4, 6] int8, the AGENT_FIELDS of each agent.
+  actions: [N, 4] uint8, the actions the agents took.
+  rewards: [N, 4] int8, the rewards the env gave for the actions.
+  dones: [N] bool, whether the actions ended the game.
+  game: [N] int32, the index of the game in `Dataset.games`.
+  step: [N] int32, the step count of the row.
+
+Example:
+    dataset.export(glob.glob('replays/*.replay'), 'data')
+    data = dataset.Dataset('data')
+    for batch in data.batches(256, seed=0):
+        train(batch['board'], batch['agents'], batch['actions'])
+'''
+import json
+import os
+
+import numpy as np
+
+from . import characters
+from .forward_model import ForwardModel
+from .replay import Replay
+from .state import NUM_AGENTS
+
+AGENT_FIELDS = ('row', 'col', 'is_alive', 'ammo', 'blast_strength', 'can_kick')
+
+_INDEX = 'index.json'
+
+
+def _columns(board_size):
+    '''Returns the dtype and row shape of each column'''
+    plane = (board_size, board_size)
+    return {
+        'board': (np.uint8, plane),
+        'bomb_life': (np.uint8, plane),
+        'bomb_blast_strength': (np.uint8, plane),
+        'bomb_moving_direction': (np.uint8, plane),
+        'agents': (np.int8, (NUM_AGENTS, len(AGENT_FIELDS))),
+        'actions': (np.uint8, (NUM_AGENTS,)),
+        'rewards': (np.int8, (NUM_AGENTS,)),
+        'dones': (np.bool_, ()),
+        'game': (np.int32, ()),
+        'step': (np.int32, ()),
+    }
+
+
+def _rewards(agents, game_type, previous, state, max_steps):
+    """Returns the rewards of the transition from previous to state.
+
+    The rules are those of `ForwardModel.get_rewards`, given the agents of
+    the game. v1 collapses the board after the rewards of a step are given,
+    so the agents the collapse killed count as alive. Agents otherwise only
+    die on flames, which the collapse leaves be, so those are the agents that
+    died without a flame under them.
+    """
+    flames = set(
+        map(tuple, state.flames[0, :state.flame_count[0]]['position'].tolist()))
+    for agent, was_alive, is_alive, position in zip(
+            agents, previous.agents['is_alive'][0].tolist(),
+            state.agents['is_alive'][0].tolist(),
+            state.agents['position'][0].tolist()):
+        agent.is_alive = is_alive or (
+            was_alive and tuple(position) not in flames)
+    return ForwardModel.get_rewards(agents, game_type,
+                                    int(state.step_count[0]) - 1, max_steps)
+
+
+class _ChunkWriter(object):
+    '''Buffers rows and saves them chunk_size rows at a time.'''
+
+    def __init__(self, path, board_size, chunk_size):
+        self._path = path
+        self._chunk_size = chunk_size
+        self._columns = {
+            name: np.zeros((chunk_size,) + shape, dtype)
+            for name, (dtype, shape) in _columns(board_size).items()
+        }
+        self._num_rows = 0
+        self.chunks = []
+
+    def append(self, state, actions, rewards, done, game):
+        '''Adds the transition from state'''
+        row = self._num_rows
+        columns = self._columns
+        columns['board'][row] = state.board[0]
+        for name in ('bomb_life', 'bomb_blast_strength',
+                     'bomb_moving_direction'):
+            columns[name][row] = 0
+        bombs = state.bombs[0, :state.bomb_count[0]]
+        rows, cols = bombs['position'].T
+        columns['bomb_life'][row, rows, cols] = bombs['life']
+        columns['bomb_blast_strength'][row, rows, cols] = \
+            bombs['blast_strength']
+        columns['bomb_moving_direction'][row, rows, cols] = \
+            bombs['moving_direction']
+
+        agents = state.agents[0]
+        columns['agents'][row, :, :2] = agents['position']
+        columns['agents'][row, :, 2] = agents['is_alive']
+        columns['agents'][row, :, 3] = agents['ammo']
+        columns['agents'][row, :, 4] = agents['blast_strength']
+        columns['agents'][row, :, 5] = agents['can_kick']
+
+        columns['actions'][row] = actions
+        columns['rewards'][row] = rewards
+        columns['dones'][row] = done
+        columns['game'][row] = game
+        columns['step'][row] = state.step_count[0]
+
+        self._num_rows += 1
+        if self._num_rows == self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''Saves the buffered rows as a new chunk'''
+        if not self._num_rows:
+            return
+        chunk = 'chunk_%05d' % len(self.chunks)
+        os.makedirs(os.path.join(self._path, chunk))
+        for name, column in self._columns.items():
+            np.save(
+                os.path.join(self._path, chunk, name + '.npy'),
+                column[:self._num_rows])
+        self.chunks.append({'name': chunk, 'num_rows': self._num_rows})
+        self._num_rows = 0
+
+
+def export(replay_paths, path, chunk_size=1 << 16):
+    """Exports replays as a dataset of their transitions.
+
+    Each replay is read one step at a time, and at most chunk_size rows are
+    held in memory.
+
+    Args:
+      replay_paths: The paths of the replay files. They must have the same
+        board size.
+      path: The directory to create the dataset in.
+      chunk_size: The number of rows in each chunk.
+
+    Returns:
+      The `Dataset`.
+
+    Raises:
+      ValueError: There are no replay_paths.
+    """
+    if not replay_paths:
+        raise ValueError("There are no replays to export")
+    os.makedirs(path)
+    writer = None
+    games = []
+    start = 0
+    for game, replay_path in enumerate(replay_paths):
+        replay = Replay(replay_path)
+        if writer is None:
+            board_size = replay.board_size
+            writer = _ChunkWriter(path, board_size, chunk_size)
+        assert replay.board_size == board_size, \
+            "%s has another board size" % replay_path
+
+        num_rows = len(replay) - 1
+        last = replay.first_step + num_rows
+        # The last transition of a finished game is treated as reaching
+        # max_steps, which gives its rewards whether it was won or tied.
+        max_steps = last - 1 if replay.info is not None else float('inf')
+        agents = [
+            characters.Bomber(agent_id, replay.game_type)
+            for agent_id in range(NUM_AGENTS)
+        ]
+        previous = None
+        for state in replay.states():
+            step_count = int(state.step_count[0])
+            if previous is not None:
+                writer.append(
+                    previous,
+                    replay.actions_at(step_count)[:, 0],
+                    _rewards(agents, replay.game_type, previous, state,
+                             max_steps),
+                    replay.info is not None and step_count == last, game)
+            previous = state.copy()
+
+        info = replay.info and {
+            'result': replay.info['result'].name,
+            'winners': replay.info.get('winners', [])
+        }
+        games.append({
+            'replay': replay_path,
+            'metadata': replay.metadata,
+            'info': info,
+            'start': start,
+            'num_rows': num_rows
+        })
+        start += num_rows
+
+    writer.flush()
+    with open(os.path.join(path, _INDEX), 'w') as f:
+        json.dump({
+            'board_size': board_size,
+            'chunks': writer.chunks,
+            'games': games
+        }, f, indent=4)
+    return Dataset(path)
+
+
+class Dataset(object):
+    """A dataset written by `export`, memory mapped.
+
+    Attributes:
+      board_size: The board size of the games.
+      games: A dict per game with its 'replay' path, 'metadata', final 'info'
+        ('result' name and 'winners', None if unfinished), and its rows, from
+        'start' to 'start' + 'num_rows'.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, _INDEX)) as f:
+            index = json.load(f)
+        self.board_size = index['board_size']
+        self.games = index['games']
+        self._chunks = [
+            {
+                name: np.load(
+                    os.path.join(path, chunk['name'], name + '.npy'),
+                    mmap_mode='r')
+                for name in _columns(self.board_size)
+            } for chunk in index['chunks']
+        ]
+        self._offsets = np.cumsum(
+            [0] + [chunk['num_rows'] for chunk in index['chunks']])
+
+    def __len__(self):
+        '''The number of rows'''
+        return int(self._offsets[-1])
+
+    def rows(self, game, step=None):
+        """Returns the rows of game, or the row of its step.
+
+        Args:
+          game: The index of the game in `games`.
+          step: The step count, None for all of the game's rows.
+        """
+        start = self.games[game]['start']
+        num_rows = self.games[game]['num_rows']
+        if step is None:
+            return np.arange(start, start + num_rows)
+        first_step = int(self.get([start])['step'][0])
+        if not 0 <= step - first_step < num_rows:
+            raise IndexError("Step %d is not in game %d" % (step, game))
+        return start + step - first_step
+
+    def get(self, rows):
+        """Returns the columns of rows, in the order given.
+
+        Args:
+          rows: A sequence of row indices.
+
+        Returns:
+          A dict of column name to array, with a leading axis over rows.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        chunks = np.searchsorted(self._offsets, rows, side='right') - 1
+        batch = {
+            name: np.empty((len(rows),) + column.shape[1:], column.dtype)
+            for name, column in self._chunks[0].items()
+        }
+        for chunk in np.unique(chunks).tolist():
+            positions = np.flatnonzero(chunks == chunk)
+            # Read each chunk in file order, which is kinder to the page cache.
+            order = np.argsort(rows[positions], kind='stable')
+            positions = positions[order]
+            local = rows[positions] - self._offsets[chunk]
+            for name, column in self._chunks[chunk].items():
+                batch[name][positions] = column[local]
+        return batch
+
+    def batches(self, batch_size, shuffle=True, seed=None, drop_last=False):
+        """Yields batches of rows, see `get`, over one pass of the dataset.
+
+        Only the permutation of the row indices is held in memory. The rows of
+        each batch are read from the memory mapped chunks.
+
+        Args:
+          batch_size: The number of rows in each batch.
+          shuffle: Whether to visit the rows in a random order.
+          seed: The seed of the shuffle.
+          drop_last: Whether to skip the last batch if it is smaller.
+        """
+        if shuffle:
+            order = np.random.RandomState(seed).permutation(len(self))
+        else:
+            order = np.arange(len(self))
+        stop = len(order) - batch_size + 1 if drop_last else len(order)
+        for start in range(0, stop, batch_size):
+            yield self.get(order[start:start + batch_size])
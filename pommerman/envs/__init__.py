@@ -2,3 +2,7 @@
 from . import v0
 from . import v1
 from . import v2
+from . import vec_env
+from .vec_env import VecEnv
+from . import subproc_vec_env
+from .subproc_vec_env import SubprocVecEnv
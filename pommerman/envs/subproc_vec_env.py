@@ -0,0 +1,207 @@
+"""A VecEnv whose games are stepped in worker processes.
+
+CPU-heavy agents such as SimpleAgent keep a single-process VecEnv bound to the
+GIL. SubprocVecEnv splits the K games into contiguous slices, each owned by a
+worker process that runs a `VecEnv` over its slice. Features, terminal
+features, rewards and dones are written into one shared memory block, so only
+the actions, the small info dicts and control messages cross the pipes.
+
+A worker that dies is restarted with fresh games. The games of its slice are
+reported as done with info['worker_restarted'] set.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from .vec_env import VecEnv
+
+
+def _views(buf, num_envs, num_features):
+    '''Returns the obs, terminal obs, rewards and dones arrays in buf.'''
+    features = num_envs * num_features * 4
+    obs = np.ndarray((num_envs, num_features), np.float32, buf, 0)
+    terminal = np.ndarray((num_envs, num_features), np.float32, buf, features)
+    rewards = np.ndarray((num_envs,), np.float32, buf, 2 * features)
+    dones = np.ndarray((num_envs,), np.bool_, buf,
+                       2 * features + 4 * num_envs)
+    return obs, terminal, rewards, dones
+
+
+def _buffer_size(num_envs, num_features):
+    return 2 * num_envs * num_features * 4 + 5 * num_envs
+
+
+def _worker(conn, env_fns, start, stop, num_envs):
+    '''Runs the games [start, stop) and answers commands from the parent.'''
+    from multiprocessing import shared_memory
+
+    vec_env = VecEnv(env_fns)
+    num_features = vec_env.reset().shape[1]
+    conn.send((num_features, vec_env.action_space, vec_env.observation_space))
+
+    shm = shared_memory.SharedMemory(name=conn.recv())
+    obs, terminal, rewards, dones = [
+        array[start:stop] for array in _views(shm.buf, num_envs, num_features)
+    ]
+    try:
+        while True:
+            command, data = conn.recv()
+            if command == 'step':
+                features, rewards[:], dones[:], infos = vec_env.step(data)
+                obs[:] = features
+                for num, info in enumerate(infos):
+                    if 'terminal_observation' in info:
+                        terminal[num] = info.pop('terminal_observation')
+                conn.send(infos)
+            elif command == 'reset':
+                obs[:] = vec_env.reset()
+                conn.send(None)
+            elif command == 'close':
+                vec_env.close()
+                conn.send(None)
+                break
+    finally:
+        del obs, terminal, rewards, dones
+        shm.close()
+
+
+class SubprocVecEnv(object):
+    '''Steps K Pomme envs in worker processes, like VecEnv.'''
+
+    def __init__(self, env_fns, num_workers=None, start_method=None):
+        """Starts the workers.
+
+        Args:
+          env_fns: A list of K functions that each return a Pomme env with its
+            agents and training agent set. They are sent to the workers, so
+            with the spawn start method they have to be picklable.
+          num_workers: The number of worker processes. Defaults to the number
+            of CPUs, and is never more than K.
+          start_method: The multiprocessing start method, e.g. 'fork' or
+            'spawn'. Defaults to the platform's.
+        """
+        from multiprocessing import resource_tracker, shared_memory
+
+        if os.name == 'posix':
+            # Share one resource tracker with the workers. Otherwise each
+            # worker starts its own when it attaches to the shared memory and
+            # that tracker unlinks the block when the worker dies.
+            resource_tracker.ensure_running()
+
+        self.num_envs = len(env_fns)
+        num_workers = min(num_workers or os.cpu_count(), self.num_envs)
+        bounds = np.linspace(0, self.num_envs, num_workers + 1).astype(int)
+        self._env_fns = env_fns
+        self._slices = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        self._context = multiprocessing.get_context(start_method)
+        self._shm = None
+        self._workers = [None] * num_workers
+        self._conns = [None] * num_workers
+
+        for num in range(num_workers):
+            self._start_worker(num)
+        num_features, self.action_space, self.observation_space = \
+            self._conns[0].recv()
+        self._num_features = num_features
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=_buffer_size(self.num_envs, num_features))
+        self._obs, self._terminal, self._rewards, self._dones = _views(
+            self._shm.buf, self.num_envs, num_features)
+        self._conns[0].send(self._shm.name)
+        for conn in self._conns[1:]:
+            assert conn.recv()[0] == num_features
+            conn.send(self._shm.name)
+
+    def _start_worker(self, num):
+        start, stop = self._slices[num]
+        parent_conn, child_conn = self._context.Pipe()
+        worker = self._context.Process(
+            target=_worker,
+            args=(child_conn, self._env_fns[start:stop], start, stop,
+                  self.num_envs),
+            daemon=True)
+        worker.start()
+        child_conn.close()
+        self._workers[num] = worker
+        self._conns[num] = parent_conn
+
+    def _restart_worker(self, num):
+        '''Replaces a dead worker and resets the games of its slice.'''
+        self._conns[num].close()
+        self._workers[num].join(timeout=1)
+        if self._workers[num].is_alive():
+            self._workers[num].terminate()
+        self._start_worker(num)
+        assert self._conns[num].recv()[0] == self._num_features
+        self._conns[num].send(self._shm.name)
+        self._conns[num].send(('reset', None))
+        self._conns[num].recv()
+
+    def _broadcast(self, command, data=None):
+        """Sends command to every worker and gathers the replies.
+
+        Returns:
+          replies: The reply of each worker, None for those that died.
+          failed: The workers that died. They have been restarted.
+        """
+        failed = set()
+        for num, (start, stop) in enumerate(self._slices):
+            try:
+                payload = None if data is None else data[start:stop]
+                self._conns[num].send((command, payload))
+            except (BrokenPipeError, ConnectionResetError):
+                failed.add(num)
+
+        replies = []
+        for num, conn in enumerate(self._conns):
+            reply = None
+            if num not in failed:
+                try:
+                    reply = conn.recv()
+                except (EOFError, ConnectionResetError):
+                    failed.add(num)
+            replies.append(reply)
+
+        for num in sorted(failed):
+            self._restart_worker(num)
+        return replies, failed
+
+    def reset(self):
+        """Resets every game. See `VecEnv.reset`."""
+        self._broadcast('reset')
+        return self._obs
+
+    def step(self, actions):
+        """Steps every game. See `VecEnv.step`."""
+        assert len(actions) == self.num_envs
+        replies, failed = self._broadcast('step', actions)
+
+        infos = []
+        for num, ((start, stop), reply) in enumerate(zip(self._slices,
+                                                         replies)):
+            if num in failed:
+                self._rewards[start:stop] = 0
+                self._dones[start:stop] = True
+                reply = [{'worker_restarted': True} for _ in range(start, stop)]
+            infos.extend(reply)
+
+        for num in np.flatnonzero(self._dones):
+            if not infos[num].get('worker_restarted'):
+                infos[num]['terminal_observation'] = self._terminal[num].copy()
+        return self._obs, self._rewards.copy(), self._dones.copy(), infos
+
+    def close(self):
+        for conn, worker in zip(self._conns, self._workers):
+            try:
+                conn.send(('close', None))
+                conn.recv()
+            except (BrokenPipeError, ConnectionResetError, EOFError):
+                pass
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+            conn.close()
+        del self._obs, self._terminal, self._rewards, self._dones
+        self._shm.close()
+        self._shm.unlink()
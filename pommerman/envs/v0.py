@@ -5,6 +5,7 @@ such as in v1.py, will inherit from this.
 """
 import json
 import os
+import random
 
 import numpy as np
 import time
@@ -15,7 +16,6 @@ import gym
 from .. import characters
 from .. import constants
 from .. import forward_model
-from .. import graphics
 from .. import utility
 
 
@@ -36,6 +36,7 @@ class Pomme(gym.Env):
                  max_steps=1000,
                  is_partially_observable=False,
                  env=None,
+                 observation_dtype=np.uint8,
                  **kwargs):
         self._render_fps = render_fps
         self._intended_actions = []
@@ -52,7 +53,12 @@ class Pomme(gym.Env):
         self._env = env
 
         self.training_agent = None
-        self.model = forward_model.ForwardModel()
+        self.model = forward_model.ForwardModel(observation_dtype)
+
+        # Set by `seed`. Until then boards are laid out with the global
+        # random module and the agents draw from it as well.
+        self._seed = None
+        self._rng = None
 
         # This can be changed through set_render_mode
         # or from the cli tool using '--render_mode=MODE_TYPE'
@@ -98,6 +104,14 @@ class Pomme(gym.Env):
 
     def set_agents(self, agents):
         self._agents = agents
+        self._seed_agents()
+
+    def _seed_agents(self):
+        '''Seeds each agent from the game seed and its agent id.'''
+        if self._seed is None or self._agents is None:
+            return
+        for agent in self._agents:
+            agent.seed('%d:%d' % (self._seed, agent.agent_id))
 
     def set_training_agent(self, agent_id):
         self.training_agent = agent_id
@@ -126,10 +140,11 @@ class Pomme(gym.Env):
 
     def make_board(self):
         self._board = utility.make_board(self._board_size, self._num_rigid,
-                                         self._num_wood)
+                                         self._num_wood, self._rng)
 
     def make_items(self):
-        self._items = utility.make_items(self._board, self._num_items)
+        self._items = utility.make_items(self._board, self._num_items,
+                                         self._rng)
 
     def act(self, obs):
         agents = [agent for agent in self._agents \
@@ -179,8 +194,17 @@ class Pomme(gym.Env):
         return self.get_observations()
 
     def seed(self, seed=None):
+        """Seeds the board layouts and every agent.
+
+        Each agent gets a generator of its own, derived from seed and its
+        agent id, so a game plays out the same way for the same seed however
+        games are spread over threads or processes.
+        """
         gym.spaces.prng.seed(seed)
         self.np_random, seed = seeding.np_random(seed)
+        self._seed = seed
+        self._rng = random.Random(seed)
+        self._seed_agents()
         return [seed]
 
     def step(self, actions):
@@ -221,6 +245,9 @@ class Pomme(gym.Env):
             self.close()
             return
 
+        # Imported here so that headless runs never load pyglet.
+        from .. import graphics
+
         mode = mode or self._mode or 'human'
 
         if mode == 'rgb_array':
@@ -282,20 +309,84 @@ class Pomme(gym.Env):
 
     @staticmethod
     def featurize(obs):
-        board = obs["board"].reshape(-1).astype(np.float32)
-        bomb_blast_strength = obs["bomb_blast_strength"].reshape(-1) \
-                                                        .astype(np.float32)
-        bomb_life = obs["bomb_life"].reshape(-1).astype(np.float32)
-        position = utility.make_np_float(obs["position"])
-        ammo = utility.make_np_float([obs["ammo"]])
-        blast_strength = utility.make_np_float([obs["blast_strength"]])
-        can_kick = utility.make_np_float([obs["can_kick"]])
-
-        teammate = utility.make_np_float([obs["teammate"].value])
-        enemies = utility.make_np_float([e.value for e in obs["enemies"]])
-        return np.concatenate(
-            (board, bomb_blast_strength, bomb_life, position, ammo,
-             blast_strength, can_kick, teammate, enemies))
+        return Pomme.featurize_batch([obs])[0]
+
+    @staticmethod
+    def feature_size(obs):
+        """Returns the length of the `featurize` vector of obs."""
+        return 3 * obs["board"].size + 6 + len(obs["enemies"])
+
+    @staticmethod
+    def featurize_batch(observations, out=None):
+        """Featurizes many observations, e.g. of several agents or games.
+
+        Every feature is cast straight into the float32 result, whatever the
+        dtype of the observation arrays.
+
+        Args:
+          observations: A list of observations with the same board size.
+          out: Optional float32 array of shape [len(observations), F] to write
+            into, where F is `feature_size`. Reusing it avoids allocating.
+
+        Returns:
+          out, or a new array if none was given. Row i holds the features of
+          observations[i] in the order of the Observation Space.
+        """
+        bss = observations[0]["board"].size
+        size = Pomme.feature_size(observations[0])
+        if out is None:
+            out = np.empty((len(observations), size), dtype=np.float32)
+        assert out.shape == (len(observations), size)
+
+        for row, obs in zip(out, observations):
+            row[:bss] = obs["board"].reshape(-1)
+            row[bss:2 * bss] = obs["bomb_blast_strength"].reshape(-1)
+            row[2 * bss:3 * bss] = obs["bomb_life"].reshape(-1)
+        out[:, 3 * bss:] = [
+            list(obs["position"]) + [
+                obs["ammo"], obs["blast_strength"], obs["can_kick"],
+                obs["teammate"].value
+            ] + [e.value for e in obs["enemies"]] for obs in observations
+        ]
+        return out
+
+    @staticmethod
+    def featurize_spatial(observations, out=None):
+        """Featurizes many observations as planes for convolutional policies.
+
+        The channels are, in order:
+          - one one-hot plane per constants.Item for the board.
+          - bomb blast strength and bomb life.
+          - a one-hot plane of the agent's position.
+          - ammo, blast strength and can_kick, broadcast over the board.
+
+        Args:
+          observations: A list of observations with the same board size.
+          out: Optional float32 array of shape [len(observations),
+            len(constants.Item) + 6, board_size, board_size] to write into.
+
+        Returns:
+          out, or a new array if none was given.
+        """
+        num_items = len(constants.Item)
+        board_size = observations[0]["board"].shape[0]
+        shape = (len(observations), num_items + 6, board_size, board_size)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        assert out.shape == shape
+
+        items = np.arange(num_items).reshape(-1, 1, 1)
+        for planes, obs in zip(out, observations):
+            np.equal(obs["board"], items, out=planes[:num_items],
+                     casting='unsafe')
+            planes[num_items] = obs["bomb_blast_strength"]
+            planes[num_items + 1] = obs["bomb_life"]
+            planes[num_items + 2] = 0
+            planes[num_items + 2][tuple(obs["position"])] = 1
+            planes[num_items + 3] = obs["ammo"]
+            planes[num_items + 4] = obs["blast_strength"]
+            planes[num_items + 5] = obs["can_kick"]
+        return out
 
     def save_json(self, record_json_dir):
         info = self.get_json_info()
@@ -365,3 +456,55 @@ class Pomme(gym.Env):
         for f in flame_array:
             self._flames.append(
                 characters.Flame(tuple(f['position']), f['life']))
+
+    def snapshot(self):
+        """Returns a handle on the current game state for `restore`.
+
+        This is a cheap alternative to `get_json_info` for search agents that
+        need to simulate ahead and rewind. The handle is an opaque dict of
+        plain values which shares nothing mutable with the env, so it can be
+        restored any number of times.
+        """
+        return {
+            'step_count': self._step_count,
+            'board': self._board.copy(),
+            'items': self._items.copy(),
+            'agents': tuple(
+                (agent.position, agent.is_alive, agent.ammo,
+                 agent.blast_strength, agent.can_kick)
+                for agent in self._agents),
+            'bombs': tuple(
+                (bomb.bomber.agent_id, bomb.position, bomb.life,
+                 bomb.blast_strength, bomb.moving_direction)
+                for bomb in self._bombs),
+            'flames': tuple(
+                (flame.position, flame._life) for flame in self._flames),
+            'intended_actions': list(self._intended_actions)
+        }
+
+    def restore(self, snapshot):
+        """Sets the game state to one returned by `snapshot`.
+
+        The agents are updated in place. Call `get_observations` afterwards if
+        the observations of the restored state are needed.
+        """
+        self._step_count = snapshot['step_count']
+        self._board = snapshot['board'].copy()
+        self._items = snapshot['items'].copy()
+
+        for agent, (position, is_alive, ammo, blast_strength, can_kick) in \
+                zip(self._agents, snapshot['agents']):
+            agent.set_start_position(position)
+            agent.reset(ammo, is_alive, blast_strength, can_kick)
+
+        self._bombs = [
+            characters.Bomb(self._agents[bomber_id], position, life,
+                            blast_strength, moving_direction)
+            for bomber_id, position, life, blast_strength, moving_direction in
+            snapshot['bombs']
+        ]
+        self._flames = [
+            characters.Flame(position, life)
+            for position, life in snapshot['flames']
+        ]
+        self._intended_actions = list(snapshot['intended_actions'])
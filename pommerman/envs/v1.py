@@ -15,6 +15,8 @@ The collapsing works in the following manner:
    and turn it into rigid walls. This has the effect of destroying any items,
    bombs (which don't go off), and agents in those squares.
 """
+import json
+
 from .. import constants
 from .. import utility
 from . import v0
@@ -35,64 +37,30 @@ class Pomme(v0.Pomme):
                   int((self._max_steps - first_collapse) / 4)))
 
     def _collapse_board(self, ring):
-        """Collapses the board at a certain ring radius.
-
-        For example, if the board is 13x13 and ring is 0, then the the ring of
-        the first row, last row, first column, and last column is all going to
-        be turned into rigid walls. All agents in that ring die and all bombs
-        are removed without detonating.
-        
-        For further rings, the values get closer to the center.
-
-        Args:
-          ring: Integer value of which cells to collapse.
+        """Collapses the board at a certain ring radius. See `collapse_board`.
         """
-        board = self._board.copy()
-
-        def collapse(r, c):
-            '''Handles the collapsing of the board. Will
-            kill of remove any item/agent that is on the
-            collapsing tile.'''
-            if utility.position_is_agent(board, (r, c)):
-                # Agent. Kill it.
-                num_agent = board[r][c] - constants.Item.Agent0.value
-                agent = self._agents[num_agent]
-                agent.die()
-            elif utility.position_is_bomb(self._bombs, (r, c)):
-                # Bomb. Remove the bomb. Update agent's ammo tally.
-                new_bombs = []
-                for b in self._bombs:
-                    if b.position == (r, c):
-                        b.bomber.incr_ammo()
-                    else:
-                        new_bombs.append(b)
-                self._bombs = new_bombs
-            elif (r, c) in self._items:
-                # Item. Remove the item.
-                del self._items[(r, c)]
-            board[r][c] = constants.Item.Rigid.value
-
-        for cell in range(ring, self._board_size - ring):
-            collapse(ring, cell)
-            if ring != cell:
-                collapse(cell, ring)
-
-            end = self._board_size - ring - 1
-            collapse(end, cell)
-            if end != cell:
-                collapse(cell, end)
-
+        board, self._bombs = collapse_board(
+            ring, self._board, self._agents, self._bombs, self._items)
         return board
 
     def get_json_info(self):
         ret = super().get_json_info()
-        ret['collapses'] = json.dumps(self.collapses, cls=json_encoder)
+        ret['collapses'] = json.dumps(self.collapses, cls=utility.PommermanJSONEncoder)
         return ret
 
     def set_json_info(self):
         super().set_json_info()
         self.collapses = json.loads(self._init_game_state['collapses'])
 
+    def snapshot(self):
+        ret = super().snapshot()
+        ret['collapses'] = tuple(self.collapses)
+        return ret
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.collapses = list(snapshot['collapses'])
+
     def step(self, actions):
         obs, reward, done, info = super().step(actions)
 
@@ -102,3 +70,63 @@ class Pomme(v0.Pomme):
                 break
 
         return obs, reward, done, info
+
+
+def collapse_board(ring, board, agents, bombs, items):
+    """Collapses the board at a certain ring radius.
+
+    For example, if the board is 13x13 and ring is 0, then the the ring of
+    the first row, last row, first column, and last column is all going to
+    be turned into rigid walls. All agents in that ring die and all bombs
+    are removed without detonating.
+    
+    For further rings, the values get closer to the center.
+
+    Args:
+      ring: Integer value of which cells to collapse.
+      board: The board. It is not modified.
+      agents: The agents, indexed by agent id. Those in the ring die.
+      bombs: The bombs.
+      items: The items dict. Items in the ring are removed.
+
+    Returns:
+      The collapsed board and the remaining bombs.
+    """
+    board = board.copy()
+    board_size = len(board)
+
+    def collapse(r, c):
+        '''Handles the collapsing of the board. Will
+        kill of remove any item/agent that is on the
+        collapsing tile.'''
+        nonlocal bombs
+        if utility.position_is_agent(board, (r, c)):
+            # Agent. Kill it.
+            num_agent = board[r][c] - constants.Item.Agent0.value
+            agent = agents[num_agent]
+            agent.die()
+        elif utility.position_is_bomb(bombs, (r, c)):
+            # Bomb. Remove the bomb. Update agent's ammo tally.
+            new_bombs = []
+            for b in bombs:
+                if b.position == (r, c):
+                    b.bomber.incr_ammo()
+                else:
+                    new_bombs.append(b)
+            bombs = new_bombs
+        elif (r, c) in items:
+            # Item. Remove the item.
+            del items[(r, c)]
+        board[r][c] = constants.Item.Rigid.value
+
+    for cell in range(ring, board_size - ring):
+        collapse(ring, cell)
+        if ring != cell:
+            collapse(cell, ring)
+
+        end = board_size - ring - 1
+        collapse(end, cell)
+        if end != cell:
+            collapse(cell, end)
+
+    return board, bombs
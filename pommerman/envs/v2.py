@@ -11,7 +11,6 @@ from gym import spaces
 import numpy as np
 
 from .. import constants
-from .. import utility
 from . import v0
 
 
@@ -97,10 +96,23 @@ class Pomme(v0.Pomme):
 
     @staticmethod
     def featurize(obs):
-        ret = super().featurize(obs)
-        message = obs['message']
-        message = utility.make_np_float(message)
-        return np.concatenate((ret, message))
+        return Pomme.featurize_batch([obs])[0]
+
+    @staticmethod
+    def feature_size(obs):
+        return v0.Pomme.feature_size(obs) + len(obs['message'])
+
+    @staticmethod
+    def featurize_batch(observations, out=None):
+        size = Pomme.feature_size(observations[0])
+        if out is None:
+            out = np.empty((len(observations), size), dtype=np.float32)
+        assert out.shape == (len(observations), size)
+
+        num_words = len(observations[0]['message'])
+        v0.Pomme.featurize_batch(observations, out[:, :-num_words])
+        out[:, -num_words:] = [obs['message'] for obs in observations]
+        return out
 
     def get_json_info(self):
         ret = super().get_json_info()
@@ -120,3 +132,12 @@ class Pomme(v0.Pomme):
             self._init_game_state['radio_num_words'])
         self._radio_from_agent = json.loads(
             self._init_game_state['_radio_from_agent'])
+
+    def snapshot(self):
+        ret = super().snapshot()
+        ret['radio_from_agent'] = self._radio_from_agent.copy()
+        return ret
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self._radio_from_agent = snapshot['radio_from_agent'].copy()
@@ -0,0 +1,99 @@
+"""A vectorized environment that steps K Pomme games for one training agent.
+
+Each game is a full Pomme env with its own agents. The built-in agents act
+inside `step`, finished games are reset automatically and the observations of
+the training agents come back featurized and stacked, ready for a policy.
+
+Example:
+    def make_env():
+        agent_list = [agents.BaseAgent()] + \\
+            [agents.SimpleAgent() for _ in range(3)]
+        env = pommerman.make('PommeFFACompetition-v0', agent_list)
+        env.set_training_agent(0)
+        return env
+
+    vec_env = envs.VecEnv([make_env] * 16)
+    obs = vec_env.reset()
+    obs, rewards, dones, infos = vec_env.step(actions)
+"""
+import numpy as np
+
+
+class VecEnv(object):
+    '''Steps K Pomme envs in lockstep and auto-resets finished games.'''
+
+    def __init__(self, env_fns):
+        """Makes the envs.
+
+        Args:
+          env_fns: A list of K functions that each return a Pomme env with its
+            agents and training agent set.
+        """
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.num_envs = len(self.envs)
+        for env in self.envs:
+            assert env.training_agent is not None
+
+        env = self.envs[0]
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        self._featurize_batch = env.featurize_batch
+        self._observations = [None] * self.num_envs
+        self._features = None
+
+    def _featurize(self):
+        agent_obs = [
+            observations[env.training_agent]
+            for env, observations in zip(self.envs, self._observations)
+        ]
+        self._features = self._featurize_batch(agent_obs, self._features)
+        return self._features
+
+    def reset(self):
+        """Resets every game.
+
+        Returns:
+          A [K, F] float32 array of the training agents' features. It is
+          overwritten by the next call to `reset` or `step`.
+        """
+        self._observations = [env.reset() for env in self.envs]
+        return self._featurize()
+
+    def step(self, actions):
+        """Steps every game with the training agents' actions.
+
+        Games that finish are reset. Their row of the returned observations
+        is the first one of the new game, and their info holds the features of
+        the final observation under 'terminal_observation'.
+
+        Args:
+          actions: K actions, one for the training agent of each game.
+
+        Returns:
+          obs: A [K, F] float32 array of features, overwritten by the next
+            call to `reset` or `step`.
+          rewards: A [K] float32 array of the training agents' rewards.
+          dones: A [K] bool array of which games finished.
+          infos: A list of the K info dicts.
+        """
+        assert len(actions) == self.num_envs
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for num, (env, action) in enumerate(zip(self.envs, actions)):
+            all_actions = env.act(self._observations[num])
+            all_actions.insert(env.training_agent, action)
+            observations, reward, done, info = env.step(all_actions)
+            rewards[num] = reward[env.training_agent]
+            dones[num] = done
+            if done:
+                info['terminal_observation'] = self._featurize_batch(
+                    [observations[env.training_agent]])[0]
+                observations = env.reset()
+            self._observations[num] = observations
+            infos.append(info)
+        return self._featurize(), rewards, dones, infos
+
+    def close(self):
+        for env in self.envs:
+            env.close()
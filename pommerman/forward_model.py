@@ -5,12 +5,17 @@ import numpy as np
 
 from . import constants
 from . import characters
+from . import observation_builder
 from . import utility
 
 
 class ForwardModel(object):
     """Class for helping with the [forward] modeling of the game state."""
 
+    def __init__(self, observation_dtype=np.float64):
+        self._observation_builder = observation_builder.ObservationBuilder(
+            observation_dtype)
+
     def run(self,
             num_times,
             board,
@@ -426,44 +431,46 @@ class ForwardModel(object):
                         constants.Item(curr_board[agent.position]),
                         max_blast_strength=max_blast_strength)
 
-        # Explode bombs.
+        # Explode bombs. Bombs that explode this turn are resolved with a
+        # worklist: each one blasts along its precomputed rays and fires the
+        # bombs it reaches, so every bomb and blast cell is handled once.
         exploded_map = np.zeros_like(curr_board)
-        has_new_explosions = False
+        blast_rays = utility.get_blast_rays(board_size)
+        exploding = []
+        bombs_by_position = defaultdict(list)
 
         for bomb in curr_bombs:
             bomb.tick()
             if bomb.exploded():
-                has_new_explosions = True
+                exploding.append(bomb)
             elif curr_board[bomb.position] == constants.Item.Flames.value:
                 bomb.fire()
-                has_new_explosions = True
+                exploding.append(bomb)
+            else:
+                bombs_by_position[bomb.position].append(bomb)
 
         # Chain the explosions.
-        while has_new_explosions:
-            next_bombs = []
-            has_new_explosions = False
-            for bomb in curr_bombs:
-                if not bomb.exploded():
-                    next_bombs.append(bomb)
-                    continue
-
-                bomb.bomber.incr_ammo()
-                for _, indices in bomb.explode().items():
-                    for r, c in indices:
-                        if not all(
-                            [r >= 0, c >= 0, r < board_size, c < board_size]):
-                            break
-                        if curr_board[r][c] == constants.Item.Rigid.value:
-                            break
-                        exploded_map[r][c] = 1
-                        if curr_board[r][c] == constants.Item.Wood.value:
-                            break
-
-            curr_bombs = next_bombs
-            for bomb in curr_bombs:
-                if bomb.in_range(exploded_map):
-                    bomb.fire()
-                    has_new_explosions = True
+        while exploding:
+            bomb = exploding.pop()
+            bomb.bomber.incr_ammo()
+            reach = max(bomb.blast_strength - 1, 0)
+            up, down, left, right = blast_rays[bomb.position]
+            for ray in (up[:reach], down[:reach + 1], left[:reach],
+                        right[:reach]):
+                for position in ray:
+                    if curr_board[position] == constants.Item.Rigid.value:
+                        break
+                    if not exploded_map[position]:
+                        exploded_map[position] = 1
+                        fired = bombs_by_position.pop(position, None)
+                        if fired:
+                            for next_bomb in fired:
+                                next_bomb.fire()
+                            exploding.extend(fired)
+                    if curr_board[position] == constants.Item.Wood.value:
+                        break
+
+        curr_bombs = [bomb for bomb in curr_bombs if not bomb.exploded()]
 
         # Update the board's bombs.
         for bomb in curr_bombs:
@@ -491,64 +498,12 @@ class ForwardModel(object):
         """Gets the observations as an np.array of the visible squares.
 
         The agent gets to choose whether it wants to keep the fogged part in
-        memory.
+        memory. The board and bomb arrays are buffers of this model that are
+        updated in place on the next call.
         """
-        board_size = len(curr_board)
-
-        def make_bomb_maps(position):
-            ''' Makes an array of an agents bombs and the bombs attributes '''
-            blast_strengths = np.zeros((board_size, board_size))
-            life = np.zeros((board_size, board_size))
-
-            for bomb in bombs:
-                x, y = bomb.position
-                if not is_partially_observable \
-                   or in_view_range(position, x, y):
-                    blast_strengths[(x, y)] = bomb.blast_strength
-                    life[(x, y)] = bomb.life
-            return blast_strengths, life
-
-        def in_view_range(position, v_row, v_col):
-            '''Checks to see if a tile is in an agents viewing area'''
-            row, col = position
-            return all([
-                row >= v_row - agent_view_size, row <= v_row + agent_view_size,
-                col >= v_col - agent_view_size, col <= v_col + agent_view_size
-            ])
-
-        attrs = [
-            'position', 'blast_strength', 'can_kick', 'teammate', 'ammo',
-            'enemies'
-        ]
-        alive_agents = [
-            utility.agent_value(agent.agent_id)
-            for agent in agents
-            if agent.is_alive
-        ]
-
-        observations = []
-        for agent in agents:
-            agent_obs = {'alive': alive_agents}
-            board = curr_board
-            if is_partially_observable:
-                board = board.copy()
-                for row in range(board_size):
-                    for col in range(board_size):
-                        if not in_view_range(agent.position, row, col):
-                            board[row, col] = constants.Item.Fog.value
-            agent_obs['board'] = board
-            bomb_blast_strengths, bomb_life = make_bomb_maps(agent.position)
-            agent_obs['bomb_blast_strength'] = bomb_blast_strengths
-            agent_obs['bomb_life'] = bomb_life
-            agent_obs['game_type'] = game_type.value
-            agent_obs['game_env'] = game_env
-
-            for attr in attrs:
-                assert hasattr(agent, attr)
-                agent_obs[attr] = getattr(agent, attr)
-            observations.append(agent_obs)
-
-        return observations
+        return self._observation_builder.build(
+            curr_board, agents, bombs, is_partially_observable,
+            agent_view_size, game_type, game_env)
 
     @staticmethod
     def get_done(agents, step_count, max_steps, game_type, training_agent):
@@ -8,8 +8,10 @@ GAME_SERVERS = {id_: os.getenv("PLAYGROUND_GAME_INSTANCE_%d" % id_)
 
 
 # NOTE: This routine is meant for internal usage.
-def make_agent_from_string(agent_string, agent_id, docker_env_dict=None):
-    '''Internal helper for building an agent instance'''
+def make_agent_from_string(agent_string, agent_id, docker_env_dict=None,
+                           port_offset=0):
+    '''Internal helper for building an agent instance (Docker agents listen
+    on port 1000 + agent_id + port_offset)'''
     
     agent_type, agent_control = agent_string.split("::")
 
@@ -24,7 +26,7 @@ def make_agent_from_string(agent_string, agent_id, docker_env_dict=None):
     elif agent_type == "random":
         agent_instance = agents.RandomAgent()
     elif agent_type == "docker":
-        port = agent_id + 1000
+        port = agent_id + 1000 + port_offset
         if not USE_GAME_SERVERS:
             server = 'http://localhost'
         else:
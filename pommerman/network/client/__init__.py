@@ -20,7 +20,6 @@ import os
 import pommerman
 import importlib
 import gym
-import numpy
 
 
 def _exit_handler(_s=None, _h=None):
@@ -189,26 +188,28 @@ raised or not)"""
         raise e
     if ui_en:
         ui.info(constants.Strings.replay_start.value, ui.yellow, "#" + str(id))
-    env = pommerman.make(replay_obj["mode"], [
+    env = pommerman.make(replay_obj.metadata["mode"], [
         pommerman.agents.BaseAgent(),
         pommerman.agents.BaseAgent(),
         pommerman.agents.BaseAgent(),
         pommerman.agents.BaseAgent()
     ])
     env.reset()
-    env._board = numpy.array(replay_obj["board"])
     # Note: Render FPS is set to 30 as it'll be smoother
     env._render_fps = 30
-    for i in replay_obj["actions"]:
-        env.render()
-        reward, done = env.step(i)[1:3]
-        if done:
-            break
-    if (reward != replay_obj["reward"]):
+    try:
+        # Note: The replay re-simulates the match, items included, and checks
+        # every step against the one the server played
+        for state in replay_obj.states():
+            env._board, env._agents, env._bombs, env._items, env._flames = \
+                state.to_objects(0, env._agents)
+            env._step_count = int(state.step_count[0])
+            env.render()
+    except pommerman.constants.ReplayMismatch:
         if ui_en:
-            ui.info(ui.yellow, constants.Exceptions.replay_no_reward.value)
+            ui.info(ui.yellow, constants.Exceptions.replay_mismatch.value)
         else:
-            raise Exception(constants.Exceptions.replay_no_reward.value)
+            raise Exception(constants.Exceptions.replay_mismatch.value)
     env.close()
     if ui_en:
         ui.info(ui.yellow, constants.Strings.replay_end.value)
@@ -66,8 +66,9 @@ class Exceptions(enum.Enum):
     net_server_closed = "The connection to the server was closed"
     match_full = "The maximum amount of concurrent matches on the has been exceeded"
     room_full = "The room is full"
+    match_stopped = "The match was stopped by the server"
     replay_notfound = "Couldn't find replay on server"
-    replay_no_reward = "The current reward doesn't match the expected reward"
+    replay_mismatch = "The replay doesn't match the match played on the server"
     invalid_ip = "The provided IP is invalid"
     invalid_id = "The provided match ID is invalid"
     invalid_room = "The provided room name is invalid"
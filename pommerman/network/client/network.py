@@ -7,6 +7,7 @@ thread-safe so feel free to run multiple network clients"""
 import pommerman
 import websocket
 from . import constants
+from .. import wire
 import rapidjson
 import threading
 import gzip
@@ -23,6 +24,8 @@ class Network(object):
         self.ws_ = websocket.create_connection(
             "ws://" + str(ip))
         self.lock = threading.Lock()
+        self.protocol = 0
+        self.decoder = None
 
     def server_status(self):
         """Description: Retrieves the status of the server"""
@@ -42,11 +45,17 @@ class Network(object):
         Arguments:  
         * room: The room to be created/joined. If False, the public room will \
 be joined, it should be a String"""
+        # Note: The server answers with the protocol version both speak. Old
+        # servers don't, which means the JSON protocol
         if not room:
-            self._send(intent=constants.NetworkCommands.match.value)
+            self._send(
+                intent=constants.NetworkCommands.match.value,
+                protocol=wire.PROTOCOL)
         else:
             self._send(
-                intent=constants.NetworkCommands.room.value, room=str(room))
+                intent=constants.NetworkCommands.room.value,
+                room=str(room),
+                protocol=wire.PROTOCOL)
         message_recieved = self._recieve()
         if message_recieved[
                 "intent"] == constants.NetworkCommands.status_full.value:
@@ -56,6 +65,7 @@ be joined, it should be a String"""
                 raise Exception(constants.Exceptions.match_full.value)
         self.id = message_recieved["player_id"]
         self.mode = message_recieved["mode"]
+        self.protocol = message_recieved.get("protocol", 0)
 
     def wait_match(self):
         """Description: Wait for a response from the server regarding a match 
@@ -64,6 +74,10 @@ be joined, it should be a String"""
         if message_recieved[
                 "intent"] == constants.NetworkCommands.match_start.value:
             self.match_id = message_recieved["match_id"]
+            self.decoder = None
+            if self.protocol >= 1:
+                self.decoder = wire.Decoder(message_recieved["game_type"],
+                                            message_recieved["game_env"])
 
     def match_get(self):
         """Description: Get the next step of the match  
@@ -80,6 +94,16 @@ pommerman.constants.Items
             raise Exception(constants.Exceptions.net_respond_fail.value)
         finally:
             self.lock.release()
+        if self.decoder is not None and isinstance(message_recieved, bytes):
+            # Binary protocol: Turns are binary messages while match end
+            # notifications are JSON text
+            try:
+                turn_id, obs = self.decoder.decode(message_recieved)
+            except:
+                raise Exception(constants.Exceptions.net_invalid_response.value)
+            if obs is None:
+                return [1]
+            return [0, obs, turn_id]
         try:
             # Messages with normal match data are compressed using GZIP while
             # match end notifications aren't. So we move on to that if this
@@ -98,6 +122,9 @@ pommerman.constants.Items
                     ]
             except:
                 raise Exception(constants.Exceptions.net_invalid_response.value)
+            if message_decoded[
+                    "intent"] == constants.NetworkCommands.status_fail.value:
+                raise Exception(constants.Exceptions.match_stopped.value)
         # Info: message_decoded - ["d"]=Dead, ["o"]=OBS, ["i"] = Turn ID
         if message_decoded["d"]:
             return [1]
@@ -125,19 +152,17 @@ action of the agent and server)"""
             turn_id=turn_id)
 
     def get_replay(self, id):
-        """Description: Send the action to the server for playing out  
+        """Description: Retrieve the replay of a match, as a \
+`pommerman.replay.Replay`  
         Arguments:  
         * id: The ID of the match to be replayed"""
         self._send(intent=constants.NetworkCommands.replay.value, replay_id=id)
-        try:
-            status, replay = rapidjson.loads(
-                str(gzip.decompress(self.ws_.recv()), "utf-8"))
-        except ValueError:
-            raise Exception(constants.Exceptions.replay_notfound.value)
-        if status == constants.NetworkCommands.status_ok.value:
-            return replay
-        else:
-            raise Exception(constants.Exceptions.replay_notfound.value)
+        # Note: The server sends the replay file as is, or a failure
+        message = self.ws_.recv()
+        if isinstance(message, bytes) and \
+                message.startswith(pommerman.replay.MAGIC):
+            return pommerman.replay.Replay(message)
+        raise Exception(constants.Exceptions.replay_notfound.value)
 
     def _send(self, **kwargs):
         self.lock.acquire()
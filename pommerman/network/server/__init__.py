@@ -4,31 +4,34 @@ WebSockets protocol.
 Functions:  
 init() - If you want to run the application normally  
 run(max_players, max_matches, port, timeout, mode, ui_en=True, 
-exit_handler=True) - If you want to programatically launch the server with
-predefined parameters"""
+exit_handler=True, num_workers=None, num_relays=None) - If you want to
+programatically launch the server with predefined parameters"""
 
 import ui
 import multiprocessing
+import queue
+import socket
 from . import constants
+from . import lobby
 from . import network
 from . import match
 import time
-import random
 import signal
 import pommerman
 
-MATCH_SUBPROCESS = []
+MATCH_WORKERS = []  # This holds the match worker processes
 
 
-def _exit_handler(subprocess_net):
-    """Description: Return the exit handler with a reference to the subprocess_net
+def _exit_handler(relays):
+    """Description: Return the exit handler with a reference to the relays
     variable."""
 
     def exit_handler(_s, _h):
         """Description: Handle exiting the application."""
         ui.info(ui.yellow, "Exiting..")
-        subprocess_net.terminate()
-        for i in MATCH_SUBPROCESS:
+        for i in relays:
+            i.terminate()
+        for i in MATCH_WORKERS:
             i.terminate()
         exit(0)
 
@@ -62,7 +65,9 @@ def run(port,
         mode,
         max_matches=False,
         ui_en=False,
-        exit_handler=False):
+        exit_handler=False,
+        num_workers=None,
+        num_relays=None):
     """Description: This function is responsible for running the server.  
     Arguments:  
     * port: The port used by the server  
@@ -73,41 +78,69 @@ def run(port,
 is set to int(max_players/4))
     * ui_en: If True, UI is enabled else UI is disabled  
     * exit_handler: If True, the exit handler is set else the exit handler \
-isn't set"""
-    netpipe, rnetpipe = multiprocessing.Pipe()
-    netqueue = multiprocessing.Queue()
-    subprocess_net = multiprocessing.Process(
-        target=network.thread,
-        args=(rnetpipe, netqueue, port, max_players, mode, timeout), daemon=True)
-    subprocess_net.start()
+isn't set  
+    * num_workers: The amount of processes playing matches, each of which \
+plays many matches at a time (If not defined this is set to the amount of CPUs)
+    * num_relays: The amount of network processes serving the port, each of \
+which holds the websockets of its players (If not defined this is set to the \
+amount of CPUs where the OS can balance a port among processes, else 1)"""
+    if not num_relays:
+        num_relays = multiprocessing.cpu_count() if hasattr(
+            socket, "SO_REUSEPORT") else 1
+    relay_queues = [multiprocessing.Queue() for _ in range(num_relays)]
+    lobby_queue = multiprocessing.Queue()
+    match_queue = multiprocessing.Queue()
+    # Note: The amount of players and matches, which the relays answer checks
+    # with and cap the players by
+    stats = multiprocessing.Array("i", 2, lock=False)
+    relays = []
+    for x in range(num_relays):
+        relays.append(
+            multiprocessing.Process(
+                target=network.thread,
+                args=(x, lobby_queue, relay_queues[x], stats, port,
+                      max_players, mode, timeout, num_relays > 1),
+                daemon=True))
+        relays[x].start()
     if not max_matches:
         max_matches = int(max_players / 4)
+    if not num_workers:
+        num_workers = multiprocessing.cpu_count()
+    for x in range(num_workers):
+        MATCH_WORKERS.append(
+            _create_worker(x, match_queue, relay_queues, lobby_queue, mode))
+    # Note: The lobby matches the players as the relays report them
+    lobby_ = lobby.Lobby(lobby.MemoryStore(), match_queue, max_matches)
     if exit_handler:
-        signal.signal(signal.SIGINT, _exit_handler(subprocess_net))
+        signal.signal(signal.SIGINT, _exit_handler(relays))
     if ui_en:
         ui.info(ui.yellow, constants.Strings.server_ready.value, ui.white,
                 ui.Symbol("✔", ":)"))
+    tick = 0
     while (True):
-        netpipe.send([constants.SubprocessCommands.get_players.value])
-        concurrent_list, num_players, num_matches = netpipe.recv()
-        if int(num_matches) < max_matches:
-            for x in list(concurrent_list["room"].keys()):
-                i = concurrent_list["room"][x]
-                if len(i) >= 4:
-                    MATCH_SUBPROCESS.append(_create_match(i, netqueue, mode))
-                    del concurrent_list["room"][x]
-            if len(concurrent_list["noroom"]) >= 4:
-                e = random.sample(concurrent_list["noroom"],
-                                  (int(len(concurrent_list["noroom"]) / 4) * 4))
-                for group in range(int(len(concurrent_list["noroom"]) / 4)):
-                    MATCH_SUBPROCESS.append(
-                        _create_match(e[group * 4:(group + 1) * 4], netqueue,
-                                      mode))
-                    for player in e[group * 4:(group + 1) * 4]:
-                        del concurrent_list["noroom"][concurrent_list["noroom"]
-                                                      .index(player)]
-            netpipe.send(
-                [constants.SubprocessCommands.update_cc.value, concurrent_list])
+        try:
+            lobby_.handle(lobby_queue.get(timeout=max(tick - time.time(), 0)))
+            stats[0], stats[1] = lobby_.num_players, lobby_.num_matches
+        except queue.Empty:
+            pass
+        if time.time() < tick:
+            continue
+        tick = time.time() + 2
+        for x, process in enumerate(MATCH_WORKERS):
+            if not process.is_alive():
+                # Note: The events the worker sent before it died are handled
+                # before the slots of its matches are freed
+                while True:
+                    try:
+                        lobby_.handle(lobby_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lobby_.drop_worker(x)
+                MATCH_WORKERS[x] = _create_worker(x, match_queue, relay_queues,
+                                                  lobby_queue, mode)
+        lobby_.tick()
+        num_players, num_matches = stats[0], stats[1] = \
+            lobby_.num_players, lobby_.num_matches
         if ui_en:
             ui.info(
                 "\033[2K\r",
@@ -128,16 +161,15 @@ isn't set"""
                 max_matches,
                 "]",
                 end="")
-        for process in tuple(MATCH_SUBPROCESS):
-            if not process.is_alive():
-                MATCH_SUBPROCESS.remove(process)
-        time.sleep(2)
 
 
-def _create_match(players, queue_subproc, mode):
-    """Description: This function is responsible for creating a match"""
+def _create_worker(worker_id, match_queue, relay_queues, lobby_queue, mode):
+    """Description: This function is responsible for creating a process that
+    plays the matches put on match_queue"""
     subprocess = multiprocessing.Process(
-        target=match.thread, args=(players, queue_subproc, mode), daemon=True)
+        target=match.worker,
+        args=(worker_id, match_queue, relay_queues, lobby_queue, mode),
+        daemon=True)
     subprocess.start()
     return subprocess
 
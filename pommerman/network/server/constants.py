@@ -26,6 +26,8 @@ class SubprocessCommands(enum.Enum):
     match_next = 2
     player_drop = 3
     match_end = 4
+    player_join = 5
+    match_start = 6
 
 
 class NetworkCommands(enum.Enum):
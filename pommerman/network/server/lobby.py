@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""IonServer Lobby
+
+This contains the matchmaking for any amount of network processes (Relays)
+serving the same port. The relays report the players that join or drop, and
+the lobby keeps the players waiting for a match in a store and hands every 4
+of them to the match workers. Players of the public room are only matched
+with players of the same relay, so that the match is pinned to the relay
+holding their sockets, unless they are left waiting with fewer than 4 on
+every relay when the lobby ticks. Players of a room are matched wherever
+they are, the match worker then talks to every relay involved.
+(You shouldn't use this file directly due to the very specialized
+interactions required for it to function in addition to parameters
+i.e: Queues)"""
+
+import fnmatch
+
+from . import constants
+
+_PLAYERS = "players"
+_MATCHES = "matches"
+
+
+class MemoryStore(object):
+    """An in-process stand-in for the subset of Redis used by the lobby: lists
+    of strings and integer counters (A redis.Redis client created with
+    decode_responses=True can be used instead)"""
+
+    def __init__(self):
+        self._data = {}
+
+    def rpush(self, key, *values):
+        """Append values to the list at key"""
+        self._data.setdefault(key, []).extend(values)
+        return len(self._data[key])
+
+    def lrange(self, key, start, stop):
+        """Returns the elements start to stop (Included) of the list at key"""
+        values = self._data.get(key, [])
+        stop = len(values) if stop == -1 else stop + 1
+        return values[start:stop]
+
+    def ltrim(self, key, start, stop):
+        """Keep only the elements start to stop (Included) of the list at
+        key"""
+        values = self.lrange(key, start, stop)
+        if values:
+            self._data[key] = values
+        else:
+            self._data.pop(key, None)
+
+    def lrem(self, key, count, value):
+        """Remove the elements of the list at key equal to value (count is
+        always treated as 0: All of them)"""
+        values = [i for i in self._data.get(key, []) if i != value]
+        removed = len(self._data.get(key, [])) - len(values)
+        if values:
+            self._data[key] = values
+        else:
+            self._data.pop(key, None)
+        return removed
+
+    def llen(self, key):
+        """Returns the length of the list at key"""
+        return len(self._data.get(key, []))
+
+    def keys(self, pattern):
+        """Returns the keys matching the glob-style pattern"""
+        return [key for key in self._data if fnmatch.fnmatchcase(key, pattern)]
+
+    def incrby(self, key, amount):
+        """Add amount to the counter at key"""
+        self._data[key] = int(self._data.get(key, 0)) + amount
+        return self._data[key]
+
+    def get(self, key):
+        """Returns the value at key"""
+        return self._data.get(key)
+
+    def delete(self, key):
+        """Remove key"""
+        return int(self._data.pop(key, None) is not None)
+
+
+def _queue_key(relay_id, room):
+    """Returns the key of the list of players waiting in a room (The public
+    room has a list per relay)"""
+    if room is None:
+        return "noroom:%d" % relay_id
+    return "room:" + room
+
+
+def _worker_key(worker_id):
+    """Returns the key of the list of matches a match worker plays"""
+    return "worker:%d" % worker_id
+
+
+class Lobby(object):
+    """Matches the players reported by the relays"""
+
+    def __init__(self, store, match_queue, max_matches):
+        """Arguments:
+        * store: A `MemoryStore` or a Redis client
+        * match_queue: The queue of the match workers, which get the players \
+of a match as a list of 4 [relay ID, player ID]
+        * max_matches: The maximum amount of concurrent matches"""
+        self.store = store
+        self.match_queue = match_queue
+        self.max_matches = max_matches
+        self.store.incrby(_PLAYERS, 0)
+        self.store.incrby(_MATCHES, 0)
+
+    @property
+    def num_players(self):
+        """The amount of players connected to the relays"""
+        return int(self.store.get(_PLAYERS))
+
+    @property
+    def num_matches(self):
+        """The amount of matches being played"""
+        return int(self.store.get(_MATCHES))
+
+    def handle(self, event):
+        """Handle an event put on the lobby queue by a relay or a worker"""
+        if event[0] is constants.SubprocessCommands.player_join.value:
+            _, relay_id, player_id, room = event
+            self.store.incrby(_PLAYERS, 1)
+            key = _queue_key(relay_id, room)
+            self.store.rpush(key, "%d:%s" % (relay_id, player_id))
+            self._match(key)
+        elif event[0] is constants.SubprocessCommands.player_drop.value:
+            _, relay_id, player_id, room = event
+            self.store.incrby(_PLAYERS, -1)
+            # Note: Does nothing if the player isn't waiting anymore
+            self.store.lrem(
+                _queue_key(relay_id, room), 0, "%d:%s" % (relay_id, player_id))
+        elif event[0] is constants.SubprocessCommands.match_start.value:
+            _, worker_id, match_id = event
+            self.store.rpush(_worker_key(worker_id), match_id)
+        elif event[0] is constants.SubprocessCommands.match_end.value:
+            _, worker_id, match_id = event
+            # Note: Does nothing if the worker was dropped already
+            if self.store.lrem(_worker_key(worker_id), 0, match_id):
+                self._end_matches(1)
+
+    def drop_worker(self, worker_id):
+        """Free the slots of the matches of a match worker that died"""
+        num_matches = self.store.llen(_worker_key(worker_id))
+        self.store.delete(_worker_key(worker_id))
+        if num_matches:
+            self._end_matches(num_matches)
+
+    def tick(self):
+        """Match the players of the public room left waiting on different
+        relays, called periodically"""
+        keys = sorted(self.store.keys("noroom:*"))
+        waiting = []
+        for key in keys:
+            waiting += self.store.lrange(key, 0, -1)
+        while len(waiting) >= 4 and self.num_matches < self.max_matches:
+            players, waiting = waiting[:4], waiting[4:]
+            for player in players:
+                self.store.lrem(
+                    _queue_key(int(player.split(":", 1)[0]), None), 0, player)
+            self._start(players)
+
+    def _end_matches(self, num_matches):
+        """Free the slots of num_matches matches and start the matches they
+        held back"""
+        self.store.incrby(_MATCHES, -num_matches)
+        for key in self.store.keys("room:*") + self.store.keys("noroom:*"):
+            self._match(key)
+
+    def _match(self, key):
+        """Start matches with the players waiting at key, 4 at a time"""
+        while self.store.llen(key) >= 4 and \
+                self.num_matches < self.max_matches:
+            players = self.store.lrange(key, 0, 3)
+            self.store.ltrim(key, 4, -1)
+            self._start(players)
+
+    def _start(self, players):
+        """Hand the players to the match workers"""
+        self.store.incrby(_MATCHES, 1)
+        self.match_queue.put([[int(relay_id), player_id]
+                              for relay_id, player_id in (
+                                  player.split(":", 1) for player in players)])
@@ -1,20 +1,27 @@
 #!/usr/bin/env python
 """IonServer Match handler
 
-This contains functions responsible for playing matches 
+This contains functions responsible for playing matches in long-lived worker
+processes, each of which plays many matches at a time for the network
+processes (Relays) holding their players
 (You shouldn't use this file directly due to the very specialized 
 interactions required for it to function in addition to parameters 
 i.e: Pipes, Queues)"""
 
+import asyncio
+import logging
 import multiprocessing
 from . import constants
+from .. import wire
 import uuid
 import os
-import rapidjson
-import gzip
-import enum
 import pommerman
-import numpy
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8, the frames go through the pipes instead
+    shared_memory = None
+
+LOGGER = logging.getLogger(__name__)
 
 
 def unique_uuid(dir):
@@ -26,87 +33,223 @@ def unique_uuid(dir):
         os.makedirs(dir)
         ls_dir = []
     uuid_ = str(uuid.uuid4())[:10]
-    while uuid_ + ".json" in ls_dir:
+    while uuid_ + ".replay" in ls_dir:
         uuid_ = str(uuid.uuid4())[:10]
     return uuid_
 
 
-def resolve_classes(i):
-    """Resolves observation into JSONable types by looping over every element
-    in it"""
-    if isinstance(i, tuple):
-        i = list(i)
-    for key, value in enumerate(i):
-        if isinstance(i, dict):
-            key = value
-            value = i[key]
-        if hasattr(value, '__iter__') and not isinstance(
-                i[key], str) and not isinstance(i[key], numpy.ndarray):
-            i[key] = resolve_classes(value)
-        elif isinstance(value, enum.Enum):
-            i[key] = str(value.name)
-        elif isinstance(value, numpy.ndarray):
-            i[key] = value.tolist()
-        elif isinstance(value, numpy.uint8) or isinstance(value, numpy.int64):
-            i[key] = int(value)
-    return i
-
-
-def thread(players, queue_subproc, mode):
-    """Handles running of the match loop"""
-    uuid_ = unique_uuid("matches")
+def _make_env(mode):
+    """Returns an env of mode played by BaseAgents"""
     base_agent = pommerman.agents.BaseAgent
-    env = pommerman.make(
+    return pommerman.make(
         mode,
         [base_agent(), base_agent(),
          base_agent(), base_agent()])
-    net, net_end = multiprocessing.Pipe()
-    queue_subproc.put([net_end, players, uuid_])
-    obs = env.reset()
-    record = {
-        "board": numpy.array(env._board, copy=True).tolist(),
-        "actions": [],
-        "mode": str(mode)
-    }
-    done = False
-    while not done:
-        obs_res = resolve_classes(obs.copy())
+
+
+class _Match(object):
+    """A match played by a worker, one turn each time the network processes
+    (Relays) holding its players send their actions"""
+
+    def __init__(self, uuid_, worker_id, players, relay_queues, lobby_queue,
+                 mode, idle_envs):
+        self.uuid_ = uuid_
+        self.worker_id = worker_id
+        self.players = players
+        self.lobby_queue = lobby_queue
+        self.idle_envs = idle_envs
+        self.env = idle_envs.pop() if idle_envs else _make_env(mode)
+        # Note: Every match gets a fresh seed, which its replay records
+        self.env.seed()
+        self.obs = self.env.reset()
+        # Note: Every turn is encoded once into a frame, which the network
+        # processes read from shared memory
+        self.shm = None
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=wire.frame_size(self.env._board_size))
+        self.relays = {}
+        self.record = None
+        self.ended = False
+        try:
+            self._start(relay_queues, mode)
+        except BaseException:
+            # Note: The relays registered already see their pipe close
+            self._release()
+            raise
+
+    def _start(self, relay_queues, mode):
+        """Register the match with its relays and send the first turn"""
+        players = self.players
+        # Note: Every relay holding players of the match gets a pipe, and
+        # only sees its own players (The others are None)
+        for relay_id in set(relay_id for relay_id, _ in players):
+            self.relays[relay_id], net_end = multiprocessing.Pipe()
+            relay_queues[relay_id].put([
+                net_end, [
+                    player_id if relay == relay_id else None
+                    for relay, player_id in players
+                ], self.uuid_, {
+                    "game_type": self.obs[0]["game_type"],
+                    "game_env": self.obs[0]["game_env"],
+                    "shared_memory": self.shm and self.shm.name
+                }
+            ])
+        # An actions only replay, which rebuilds every step of the match,
+        # items included, from a few KB.
+        self.record = pommerman.replay.ReplayWriter(
+            "./matches/" + self.uuid_ + ".replay",
+            actions_only=True,
+            metadata={"mode": str(mode)})
+        self.record.record(self.env)
+        self.rew = None
+        self.act = [0, 0, 0, 0]
+        self.pending = set()
+        for relay_id, net in self.relays.items():
+            asyncio.get_event_loop().add_reader(net.fileno(), self._on_recv,
+                                                relay_id)
+        self._next_turn()
+
+    def _send(self, message):
+        """Send a message to every relay of the match"""
+        for relay_id, net in list(self.relays.items()):
+            try:
+                net.send(message)
+            except OSError:
+                self._drop(relay_id)
+
+    def _next_turn(self):
+        """Send the observations of the next turn to the network processes"""
         turn_id = str(uuid.uuid4())[:5]
+        self.act = [0, 0, 0, 0]
+        self.pending = set(self.relays)
+        if self.shm is not None:
+            wire.encode_turn(self.obs, turn_id, self.shm.buf)
+            self._send([constants.SubprocessCommands.match_next.value])
+        else:
+            self._send([
+                constants.SubprocessCommands.match_next.value,
+                wire.encode_turn(self.obs, turn_id)
+            ])
+
+    def _on_recv(self, relay_id):
+        """Take the actions of a relay's players, or its answer to the end of
+        the match"""
         try:
-            obs_bytes = []
-            for key, value in enumerate(obs_res):
-                if 10 + key in obs[0]["alive"]:
-                    obs_bytes.append(
-                        gzip.compress(
-                            bytes(
-                                rapidjson.dumps({
-                                    "o": value,  # o = obs
-                                    "i": turn_id,  # i = Turn ID
-                                    "d": False  # d = Dead
-                                }),
-                                "utf8")))
-                else:
-                    obs_bytes.append(
-                        gzip.compress(
-                            bytes(
-                                rapidjson.dumps({
-                                    "d": True  # d = Dead
-                                }),
-                                "utf8")))
-            net.send([
-                constants.SubprocessCommands.match_next.value, turn_id,
-                obs_bytes,
-                len(obs[0]["alive"])
+            act = self.relays[relay_id].recv()
+        except (EOFError, OSError):
+            # The network process is gone, its players can't play anymore
+            self._drop(relay_id)
+            return
+        if self.ended:
+            # Note: The network processes answer the end of the match with
+            # "END" once they have told their players
+            self._drop(relay_id)
+            return
+        for agent_id, (relay, _) in enumerate(self.players):
+            if relay == relay_id:
+                self.act[agent_id] = act[agent_id]
+        self.pending.discard(relay_id)
+        if not self.pending:
+            self._step()
+
+    def _step(self):
+        """Play the actions of a turn"""
+        try:
+            self.obs, self.rew, done, info = self.env.step(self.act)
+            self.record.record(self.env, self.act)
+            if not done:
+                self._next_turn()
+                return
+            self.record.close(info)
+        except Exception:  # pylint: disable=broad-except
+            # Note: The relays tell the players once their pipes close
+            LOGGER.exception("Match %s stopped", self.uuid_)
+            self._close()
+            return
+        self.ended = True
+        self._send([constants.SubprocessCommands.match_end.value, self.rew])
+
+    def _drop(self, relay_id):
+        """Stop talking to a relay, and close the match once there is none
+        left"""
+        net = self.relays.pop(relay_id, None)
+        if net is None:
+            return
+        asyncio.get_event_loop().remove_reader(net.fileno())
+        net.close()
+        if not self.relays:
+            self._close()
+        elif relay_id in self.pending:
+            # Note: The players of a relay that's gone stop
+            self.pending.discard(relay_id)
+            if not self.pending and not self.ended:
+                self._step()
+
+    def _release(self):
+        """Close the pipes, the shared memory and the replay of the match"""
+        for net in self.relays.values():
+            asyncio.get_event_loop().remove_reader(net.fileno())
+            net.close()
+        self.relays = {}
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        if self.record is not None and not self.ended:
+            self.record.close()
+        self.ended = True
+
+    def _close(self):
+        """Stop the match and keep its env for the next match"""
+        self._release()
+        self.idle_envs.append(self.env)
+        self.lobby_queue.put([
+            constants.SubprocessCommands.match_end.value, self.worker_id,
+            self.uuid_
+        ])
+
+
+def worker(worker_id, match_queue, relay_queues, lobby_queue, mode):
+    """Plays the matches put on match_queue, as many at a time as there are
+    (The env of a finished match is reused by the next one)
+
+    Arguments:
+    * worker_id: The index of the worker, which the matches it plays are \
+reported to the lobby with
+    * match_queue: The queue the lobby puts the players of the matches on, \
+as a list of 4 [relay ID, player ID]
+    * relay_queues: The queues the network processes (Relays) take the \
+matches of their players from
+    * lobby_queue: The queue the start and the end of the matches are \
+reported on
+    * mode: The env of the matches"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Note: An env is built up front so the first match starts right away
+    idle_envs = [_make_env(mode)]
+
+    async def take_matches():
+        """Start each match put on match_queue"""
+        while True:
+            # Note: A queue can't be waited on by the event loop, so a thread
+            # of the default executor blocks on it instead
+            players = await loop.run_in_executor(None, match_queue.get)
+            uuid_ = unique_uuid("matches")
+            # Note: The lobby frees the slots of the matches of a worker that
+            # dies, so it's told which matches each worker plays
+            lobby_queue.put([
+                constants.SubprocessCommands.match_start.value, worker_id,
+                uuid_
             ])
-            act = net.recv()
-        except:
-            act = [0, 0, 0, 0]
-        record["actions"].append(numpy.array(act, copy=True).tolist())
-        obs, rew, done = env.step(act)[:3]
-    record["reward"] = rew
-    env.close()
-    with open("./matches/" + uuid_ + ".json", "w") as file:
-        rapidjson.dump(record, file)
-    net.send([constants.SubprocessCommands.match_end.value, rew])
-    net.recv()
-    exit(0)
+            try:
+                _Match(uuid_, worker_id, players, relay_queues, lobby_queue,
+                       mode, idle_envs)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Match %s could not start", uuid_)
+                lobby_queue.put([
+                    constants.SubprocessCommands.match_end.value, worker_id,
+                    uuid_
+                ])
+
+    loop.run_until_complete(take_matches())
@@ -9,24 +9,25 @@ for functions)"""
 
 import asyncio
 import websockets
-import threading
-import time
 from . import constants
+from .. import wire
 import os
 import re
 import gzip
 import rapidjson
 import uuid
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8, the frames come through the pipes instead
+    shared_memory = None
 
-CONCURRENTLY_LOOKING = {
-    "room": {},
-    "noroom": []
-}  # This holds the IDs of players concurrently looking for a room
 PLAYER_WS = {}  # This stores the mapping from player ID to the websocket object
 MATCH_PROCESS = {}  # This holds pipes to match processes
 MAX_PLAYERS = 0
-PIPE_MAIN = False  # This holds the queue (Main-proc <-> Network-proc)
+RELAY_ID = 0  # This is the index of this network process (Relay)
+LOBBY_QUEUE = False  # This holds the queue (Network-procs -> Lobby)
 QUEUE_SUBPROC = False  # This holds the queue (Subproc <-> Network-proc)
+STATS = False  # This holds the amount of players and matches of all relays
 MODE = ""
 STOP_TIMEOUT = 0
 
@@ -39,9 +40,9 @@ async def message_parse(message, websocket):
                 "intent":
                 constants.NetworkCommands.status_ok.value,
                 "players":
-                len(PLAYER_WS),
+                STATS[0],
                 "matches":
-                len(MATCH_PROCESS)
+                STATS[1]
             }))
     elif message["intent"] is constants.NetworkCommands.match_act.value:
         if message["turn_id"] == MATCH_PROCESS[message["match_id"]]["turn_id"]:
@@ -51,22 +52,21 @@ async def message_parse(message, websocket):
                     message["player_id"])] = message["act"]
             MATCH_PROCESS[message["match_id"]]["recv"][MATCH_PROCESS[message[
                 "match_id"]]["players"].index(message["player_id"])] = True
+            if MATCH_PROCESS[message["match_id"]]["recv"].count(
+                    True) == MATCH_PROCESS[message["match_id"]]["alive"]:
+                _end_turn(message["match_id"])
     elif message["intent"] is constants.NetworkCommands.replay.value:
         try:
             with open(
                     os.path.join(
                         os.path.join(os.getcwd(), "matches"),
-                        str(message["replay_id"]) + ".json"), 'r') as f:
+                        str(message["replay_id"]) + ".replay"), 'rb') as f:
                 # Note: Registry expression match comes after as it's an expensive operation as compared to file I/O
                 if re.fullmatch("^[a-z0-9-]*$",
                                 message["replay_id"]) is not None:
-                    f = rapidjson.load(f)
-                    await websocket.send(
-                        gzip.compress(
-                            bytes(
-                                rapidjson.dumps([
-                                    constants.NetworkCommands.status_ok.value, f
-                                ]), "utf8")))
+                    # Note: The replay file is compressed already, so it's
+                    # sent as is (Failures are still gzipped JSON)
+                    await websocket.send(f.read())
                 else:
                     await websocket.send(
                         gzip.compress(
@@ -85,7 +85,7 @@ async def message_parse(message, websocket):
             constants.NetworkCommands.match.value,
             constants.NetworkCommands.room.value
     ]:
-        if len(PLAYER_WS) >= MAX_PLAYERS:
+        if STATS[0] >= MAX_PLAYERS:
             await websocket.send(
                 rapidjson.dumps({
                     "intent":
@@ -95,25 +95,20 @@ async def message_parse(message, websocket):
         uuid_ = str(uuid.uuid4())
         while uuid_ in PLAYER_WS:
             uuid_ = str(uuid.uuid4())
-        PLAYER_WS[uuid_] = {"ws": websocket}
-        if message["intent"] is constants.NetworkCommands.match.value:
-            CONCURRENTLY_LOOKING["noroom"].append(uuid_)
-            PLAYER_WS[uuid_]["noroom"] = True
-        elif message["intent"] is constants.NetworkCommands.room.value:
-            if message["room"] in CONCURRENTLY_LOOKING["room"]:
-                if len(CONCURRENTLY_LOOKING["room"][message["room"]]) <= 4:
-                    CONCURRENTLY_LOOKING["room"][message["room"]].append(uuid_)
-                else:
-                    await websocket.send(
-                        rapidjson.dumps({
-                            "intent":
-                            constants.NetworkCommands.status_full.value
-                        }))
-                    return
-            else:
-                CONCURRENTLY_LOOKING["room"][message["room"]] = [uuid_]
-            PLAYER_WS[uuid_]["noroom"] = False
+        # Note: Clients that don't send the version of the binary protocol
+        # they speak get the JSON protocol
+        PLAYER_WS[uuid_] = {
+            "ws": websocket,
+            "protocol": min(int(message.get("protocol", 0)), wire.PROTOCOL),
+            "room": None
+        }
+        if message["intent"] is constants.NetworkCommands.room.value:
+            # Note: Every 4 players of a room play a match together
             PLAYER_WS[uuid_]["room"] = str(message["room"])
+        LOBBY_QUEUE.put([
+            constants.SubprocessCommands.player_join.value, RELAY_ID, uuid_,
+            PLAYER_WS[uuid_]["room"]
+        ])
         await websocket.send(
             rapidjson.dumps({
                 "intent":
@@ -121,7 +116,9 @@ async def message_parse(message, websocket):
                 "player_id":
                 uuid_,
                 "mode":
-                MODE
+                MODE,
+                "protocol":
+                PLAYER_WS[uuid_]["protocol"]
             }))
 
 
@@ -136,124 +133,218 @@ returned by the 'websockets' library)"""
                 pass
     except websockets.exceptions.ConnectionClosed:
         pass
+    finally:
+        _drop_players(websocket)
+
+
+def _drop_players(websocket):
+    """Forget the players registered through a closed websocket"""
+    for uuid_ in [
+            uuid_ for uuid_, player in PLAYER_WS.items()
+            if player["ws"] is websocket
+    ]:
+        player = PLAYER_WS.pop(uuid_)
+        LOBBY_QUEUE.put([
+            constants.SubprocessCommands.player_drop.value, RELAY_ID, uuid_,
+            player["room"]
+        ])
+
+
+async def _send(websocket, message):
+    """Send a message, ignoring websockets that closed in the meantime"""
+    try:
+        await websocket.send(message)
+    except:
+        pass
 
 
-async def program_loop():
-    """Handles other network-related function"""
-    global CONCURRENTLY_LOOKING
-    while (True):
+def _send_to(player_id, message):
+    """Schedule sending a message to a player if it's still connected"""
+    if player_id in PLAYER_WS:
+        asyncio.ensure_future(_send(PLAYER_WS[player_id]["ws"], message))
+        return True
+    return False
+
+
+async def _match_registrations():
+    """Register the matches put on QUEUE_SUBPROC by the match processes (The
+    players of a match that are on other relays are None)"""
+    loop = asyncio.get_event_loop()
+    while True:
+        # Note: A queue can't be waited on by the event loop, so a thread
+        # of the default executor blocks on it instead
+        pipe, players, match_id, info = await loop.run_in_executor(
+            None, QUEUE_SUBPROC.get)
         try:
-            for uuid_ in list(PLAYER_WS.keys()):
-                i = PLAYER_WS[uuid_]
-                if not i["ws"].open:
-                    if i["noroom"] is True:
-                        try:
-                            del CONCURRENTLY_LOOKING["noroom"][CONCURRENTLY_LOOKING[
-                                "noroom"].index(uuid_)]
-                        except:
-                            pass
-                    elif i["noroom"] is False:
-                        try:
-                            del CONCURRENTLY_LOOKING["room"][i["room"]][
-                                CONCURRENTLY_LOOKING["room"][i["room"]].index(
-                                    uuid_)]
-                        except:
-                            pass
-                    try:
-                        del PLAYER_WS[uuid_]
-                    except:
-                        pass
-            if PIPE_MAIN.poll():
-                queue_msg = PIPE_MAIN.recv()
-                if queue_msg[0] is constants.SubprocessCommands.get_players.value:
-                    PIPE_MAIN.send(
-                        [CONCURRENTLY_LOOKING,
-                         len(PLAYER_WS),
-                         len(MATCH_PROCESS)])
-                elif queue_msg[0] is constants.SubprocessCommands.update_cc.value:
-                    CONCURRENTLY_LOOKING = queue_msg[1]
-            if not QUEUE_SUBPROC.empty():
-                queue_msg = QUEUE_SUBPROC.get()
-                MATCH_PROCESS[queue_msg[2]] = {
-                    "pipe": queue_msg[0],
-                    "players": queue_msg[1],
-                    "match_id": queue_msg[2],
-                    "free": False,
-                    "delete": False
-             }
-                for i in queue_msg[1]:
-                    if i in PLAYER_WS:  # If the players didn't quits during matching
-                        await PLAYER_WS[i]["ws"].send(
-                            rapidjson.dumps({
-                                "intent":
-                                constants.NetworkCommands.match_start.value,
-                                "match_id":
-                                queue_msg[2]
-                            }))
-            for key in list(MATCH_PROCESS.keys()):
-                value = MATCH_PROCESS[key]
-                if value["pipe"].poll() and not value["free"]:
-                    pipe_msg = value["pipe"].recv()
-                    if pipe_msg[0] == constants.SubprocessCommands.match_next.value:
-                        value["free"] = True
-                        value["act"] = [0, 0, 0, 0]
-                        value["recv"] = [False, False, False, False]
-                        value["time"] = time.time()
-                        value["turn_id"] = pipe_msg[1]
-                        value["alive"] = pipe_msg[3]
-                        for x, y in enumerate(value["players"]):
-                            if y in list(PLAYER_WS.keys()):
-                                try:
-                                    await PLAYER_WS[y]["ws"].send(pipe_msg[2][x])
-                                except:
-                                    pass
-                            elif y not in PLAYER_WS:
-                                value["act"][x] = 5
-                    if pipe_msg[0] is constants.SubprocessCommands.match_end.value:
-                        value["delete"] = True
-                        for x, y in enumerate(value["players"]):
-                            if y in PLAYER_WS:
-                                await PLAYER_WS[y]["ws"].send(
-                                    rapidjson.dumps({
-                                        "intent":
-                                        constants.NetworkCommands.match_end.value,
-                                        "reward":
-                                        pipe_msg[1][x],
-                                        "agent":
-                                        10 + x
-                                    }))
-                if value["free"]:
-                    if value["time"] + STOP_TIMEOUT < time.time(
-                    ) or value["recv"].count(True) == value["alive"]:
-                        value["pipe"].send(value["act"])
-                        value["free"] = False
-                if value["delete"]:
-                    value["pipe"].send("END")
-                    del MATCH_PROCESS[key]
-        finally:
-            time.sleep(0.0001)  # Sleep for a while so other threads get the GIL
+            shm = info["shared_memory"] and _attach(info["shared_memory"])
+        except OSError:
+            # Note: The match stopped before it could be attached to
+            _stop_players(players)
+            pipe.close()
+            continue
+        MATCH_PROCESS[match_id] = {
+            "pipe": pipe,
+            "players": players,
+            "match_id": match_id,
+            "game_type": info["game_type"],
+            "game_env": info["game_env"],
+            "shm": shm,
+            "free": False,
+            "timer": None
+        }
+        loop.add_reader(pipe.fileno(), _on_match_pipe, match_id)
+        for i in players:
+            # If the players didn't quits during matching
+            if i is None:
+                continue
+            if i in PLAYER_WS and PLAYER_WS[i]["protocol"] >= 1:
+                PLAYER_WS[i]["encoder"] = wire.Encoder()
+            _send_to(
+                i,
+                rapidjson.dumps({
+                    "intent": constants.NetworkCommands.match_start.value,
+                    "match_id": match_id,
+                    "game_type": info["game_type"],
+                    "game_env": info["game_env"]
+                }))
+
+
+def _stop_players(players):
+    """Tell the players of a match that it stopped"""
+    for i in players:
+        if i is not None:
+            _send_to(
+                i,
+                rapidjson.dumps({
+                    "intent": constants.NetworkCommands.status_fail.value
+                }))
+
+
+def _attach(name):
+    """Attach to the shared memory of a match, which its match process owns"""
+    shm = shared_memory.SharedMemory(name)
+    # Note: Before Python 3.13 attaching also registers the memory with the
+    # resource tracker of this process, which would unlink it on exit
+    resource_tracker.unregister(shm._name, "shared_memory")  # pylint: disable=protected-access
+    return shm
+
+
+def _turn_message(value, frame, alive, x, player):
+    """Returns the compressed observation of a player for a turn"""
+    if "encoder" in player:
+        return player["encoder"].encode(frame, x)
+    if x not in alive:
+        return gzip.compress(
+            bytes(
+                rapidjson.dumps({
+                    "d": True  # d = Dead
+                }),
+                "utf8"))
+    return gzip.compress(
+        bytes(
+            rapidjson.dumps({
+                "o": wire.json_observation(frame, x, value["game_type"],
+                                           value["game_env"]),  # o = obs
+                "i": value["turn_id"],  # i = Turn ID
+                "d": False  # d = Dead
+            }),
+            "utf8"))
+
+
+def _on_match_pipe(match_id):
+    """Relay a turn or the end of a match, called when its pipe is readable"""
+    value = MATCH_PROCESS[match_id]
+    try:
+        pipe_msg = value["pipe"].recv()
+    except (EOFError, OSError):
+        # Note: The match process is gone, so the players are told the match
+        # stopped instead of waiting for a turn forever
+        _stop_players(value["players"])
+        _remove_match(match_id)
+        return
+    if pipe_msg[0] == constants.SubprocessCommands.match_next.value:
+        value["free"] = True
+        value["act"] = [0, 0, 0, 0]
+        value["recv"] = [False, False, False, False]
+        frame = value["shm"].buf if value["shm"] else pipe_msg[1]
+        value["turn_id"], _, alive = wire.turn_info(frame)
+        # Note: Only the players of this relay that are alive and still
+        # connected act in the turn
+        value["alive"] = len(
+            [x for x in alive if value["players"][x] in PLAYER_WS])
+        for x, y in enumerate(value["players"]):
+            if y is None:
+                continue
+            if y in PLAYER_WS:
+                _send_to(y,
+                         _turn_message(value, frame, alive, x, PLAYER_WS[y]))
+            else:
+                value["act"][x] = 5
+        value["timer"] = asyncio.get_event_loop().call_later(
+            STOP_TIMEOUT, _end_turn, match_id)
+        if value["alive"] == 0:
+            # Note: Nobody here is going to act, and the match waits for
+            # every relay
+            _end_turn(match_id)
+    elif pipe_msg[0] is constants.SubprocessCommands.match_end.value:
+        for x, y in enumerate(value["players"]):
+            _send_to(
+                y,
+                rapidjson.dumps({
+                    "intent": constants.NetworkCommands.match_end.value,
+                    "reward": pipe_msg[1][x],
+                    "agent": 10 + x
+                }))
+        value["pipe"].send("END")
+        _remove_match(match_id)
+
+
+def _end_turn(match_id):
+    """Send the actions of the turn to the match, once every player alive
+    acted or the turn timed out"""
+    value = MATCH_PROCESS.get(match_id)
+    if value is None or not value["free"]:
+        return
+    value["timer"].cancel()
+    value["free"] = False
+    value["pipe"].send(value["act"])
+
+
+def _remove_match(match_id):
+    """Stop relaying a match"""
+    value = MATCH_PROCESS.pop(match_id)
+    if value["timer"] is not None:
+        value["timer"].cancel()
+    if value["shm"]:
+        value["shm"].close()
+    asyncio.get_event_loop().remove_reader(value["pipe"].fileno())
 
 
-def _run_server(port):
-    """Handles running the websocket thread"""
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    asyncio.get_event_loop().run_until_complete(
-        websockets.serve(ws_handler, 'localhost', port))
-    asyncio.get_event_loop().run_forever()
+async def _serve(port, reuse_port):
+    """Start serving websockets and relaying the pipes and the queue"""
+    # Note: With reuse_port every relay listens on the same port and the
+    # kernel spreads the connections among them
+    await websockets.serve(
+        ws_handler, 'localhost', port, reuse_port=reuse_port)
+    asyncio.ensure_future(_match_registrations())
 
 
-def thread(pipe_main, queue_subproc, port, max_players, mode, stop_timeout):
-    """Creates a network thread"""
-    # Note: Multiple threads are used so globals are used to share data b/w them
-    global MAX_PLAYERS, PIPE_MAIN, QUEUE_SUBPROC, MODE, STOP_TIMEOUT
+def thread(relay_id, lobby_queue, queue_subproc, stats, port, max_players,
+           mode, stop_timeout, reuse_port=False):
+    """Creates a network thread (A relay)"""
+    # Note: Everything runs on a single event loop, which waits on the
+    # websockets, the pipes and the turn timers, so globals are used to share
+    # data b/w the callbacks
+    global MAX_PLAYERS, RELAY_ID, LOBBY_QUEUE, QUEUE_SUBPROC, STATS, MODE, \
+        STOP_TIMEOUT
     MAX_PLAYERS = max_players
-    PIPE_MAIN = pipe_main
+    RELAY_ID = relay_id
+    LOBBY_QUEUE = lobby_queue
     QUEUE_SUBPROC = queue_subproc
+    STATS = stats
     MODE = mode
     STOP_TIMEOUT = stop_timeout
-    ws_thread = threading.Thread(target=_run_server, args=(port,))
-    ws_thread.start()
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    asyncio.get_event_loop().run_until_complete(program_loop())
-    asyncio.get_event_loop().run_forever()
-    ws_thread.join()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(_serve(port, reuse_port))
+    loop.run_forever()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""Compact binary observations
+
+A turn of a match is encoded once, for every player at the same time, into a
+frame of fixed size:
+* A header: the turn ID (5 ASCII characters), the step count, the board size
+and a bit per agent that is alive
+* The board, bomb life and bomb blast strength planes, merged from what the
+agents observed, one byte per cell each
+* Per agent, its scalars (position, blast strength, ammo, flags, teammate,
+enemies and radio message) and its view window. An agent sees the planes
+inside its window and fog outside of it, so the window is all that differs
+between the agents' boards
+
+`observation` rebuilds the observation of a single agent from a frame, fog
+included, and `json_observation` does so in the JSON form of the original
+network protocol. Players of the binary protocol are sent the turns of their
+agent by an `Encoder`, which their client reads with a `Decoder`."""
+
+import struct
+import zlib
+
+import numpy
+
+from .. import constants
+
+# Note: Turn ID, step count, board size, alive bits
+_HEADER = struct.Struct('<5sHBB')
+# Note: Row, col, blast strength, ammo, flags, teammate, 3 enemies, view
+# window (row start, row stop, col start, col stop), 2 message words
+_AGENT = struct.Struct('<15B')
+_NUM_AGENTS = 4
+_NUM_PLANES = 3
+_CAN_KICK = 1
+_HAS_MESSAGE = 2
+_SYNC_FLUSH_TAIL = b"\x00\x00\xff\xff"
+# Note: Lookup tables, which are much faster than calling Item and looping
+# over the alive bits for every observation
+_ITEMS = tuple(constants.Item)
+_ALIVE = tuple(
+    tuple(10 + agent_id
+          for agent_id in range(4)
+          if alive & 1 << agent_id)
+    for alive in range(16))
+# Note: The version of the binary protocol. Peers that don't send one speak
+# the JSON protocol (Version 0)
+PROTOCOL = 1
+
+
+def frame_size(board_size):
+    """Returns the size in bytes of the frames of a board size"""
+    return _HEADER.size + _NUM_PLANES * board_size * board_size + \
+        _NUM_AGENTS * _AGENT.size
+
+
+def _window(board):
+    """Returns the rows and cols of board that aren't fogged"""
+    visible = board != constants.Item.Fog.value
+    rows = numpy.flatnonzero(visible.any(1))
+    cols = numpy.flatnonzero(visible.any(0))
+    if not len(rows):
+        return 0, 0, 0, 0
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def encode_turn(observations, turn_id, buffer=None):
+    """Encodes the observations of a turn into a frame
+
+    Arguments:
+    * observations: The observations of the turn, as returned by the env
+    * turn_id: The 5 character ID of the turn
+    * buffer: A writable buffer of at least `frame_size` bytes to encode the \
+frame into. If None, a new bytearray is returned"""
+    board_size = len(observations[0]["board"])
+    if buffer is None:
+        buffer = bytearray(frame_size(board_size))
+    alive = 0
+    for agent_id in range(_NUM_AGENTS):
+        if 10 + agent_id in observations[0]["alive"]:
+            alive |= 1 << agent_id
+    _HEADER.pack_into(buffer, 0, turn_id.encode(),
+                      observations[0]["step_count"], board_size, alive)
+
+    cells = board_size * board_size
+    planes = numpy.frombuffer(
+        buffer, numpy.uint8, _NUM_PLANES * cells,
+        _HEADER.size).reshape(_NUM_PLANES, board_size, board_size)
+    # Note: The planes are merged from the view windows of the agents, which
+    # hold the board as the env observed it (v1 collapses the env's board
+    # afterwards). Cells outside every window are fog for every agent
+    planes[0] = constants.Item.Fog.value
+    planes[1:] = 0
+    windows = [_window(obs["board"]) for obs in observations]
+    for obs, (row_start, row_stop, col_start, col_stop) in zip(
+            observations, windows):
+        window = (slice(row_start, row_stop), slice(col_start, col_stop))
+        planes[0][window] = obs["board"][window]
+        planes[1][window] = obs["bomb_life"][window]
+        planes[2][window] = obs["bomb_blast_strength"][window]
+
+    offset = _HEADER.size + _NUM_PLANES * cells
+    for obs, window in zip(observations, windows):
+        flags = _CAN_KICK if obs["can_kick"] else 0
+        message = obs.get("message")
+        if message is not None:
+            flags |= _HAS_MESSAGE
+        else:
+            message = (0, 0)
+        enemies = [enemy.value for enemy in obs["enemies"]]
+        enemies += [0] * (3 - len(enemies))
+        _AGENT.pack_into(buffer, offset, obs["position"][0],
+                         obs["position"][1], obs["blast_strength"],
+                         obs["ammo"], flags, obs["teammate"].value, *enemies,
+                         *window, *message)
+        offset += _AGENT.size
+    return buffer
+
+
+def turn_info(frame):
+    """Returns the turn ID, step count and the IDs of the agents alive of a
+    frame"""
+    turn_id, step_count, _, alive = _HEADER.unpack_from(frame)
+    return turn_id.decode(), step_count, [
+        agent_id for agent_id in range(_NUM_AGENTS) if alive & 1 << agent_id
+    ]
+
+
+def _fog(planes, window):
+    """Returns a copy of planes with everything outside window fogged"""
+    row_start, row_stop, col_start, col_stop = window
+    window = (slice(None), slice(row_start, row_stop),
+              slice(col_start, col_stop))
+    fogged = numpy.zeros(planes.shape, dtype=numpy.uint8)
+    fogged[0] = constants.Item.Fog.value
+    fogged[window] = planes[window]
+    return fogged
+
+
+def _observation(header, agent, planes, game_type, game_env):
+    """Returns an observation from the unpacked header and agent structs and
+    the fogged planes"""
+    _, step_count, _, alive = header
+    (row, col, blast_strength, ammo, flags, teammate, enemy_a, enemy_b,
+     enemy_c, _, _, _, _, message_a, message_b) = agent
+    obs = {
+        "alive": list(_ALIVE[alive]),
+        "board": planes[0],
+        "bomb_blast_strength": planes[2].astype(numpy.float64),
+        "bomb_life": planes[1].astype(numpy.float64),
+        "game_type": game_type,
+        "game_env": game_env,
+        "position": (row, col),
+        "blast_strength": blast_strength,
+        "can_kick": bool(flags & _CAN_KICK),
+        "teammate": _ITEMS[teammate],
+        "ammo": ammo,
+        "enemies": [
+            _ITEMS[enemy] for enemy in (enemy_a, enemy_b, enemy_c) if enemy
+        ],
+        "step_count": step_count
+    }
+    if flags & _HAS_MESSAGE:
+        obs["message"] = (message_a, message_b)
+    return obs
+
+
+def _unpack(frame, agent_id):
+    """Returns the header and agent structs and the planes of a frame"""
+    header = _HEADER.unpack_from(frame)
+    board_size = header[2]
+    cells = board_size * board_size
+    planes = numpy.frombuffer(
+        frame, numpy.uint8, _NUM_PLANES * cells,
+        _HEADER.size).reshape(_NUM_PLANES, board_size, board_size)
+    agent = _AGENT.unpack_from(
+        frame, _HEADER.size + _NUM_PLANES * cells + agent_id * _AGENT.size)
+    return header, agent, planes
+
+
+def observation(frame, agent_id, game_type, game_env):
+    """Returns the observation of an agent encoded in frame, as the env would
+
+    Arguments:
+    * frame: A frame returned by `encode_turn`
+    * agent_id: The ID of the agent
+    * game_type: The GameType value of the match
+    * game_env: The env string of the match"""
+    header, agent, planes = _unpack(frame, agent_id)
+    return _observation(header, agent, _fog(planes, agent[9:13]), game_type,
+                        game_env)
+
+
+def json_observation(frame, agent_id, game_type, game_env):
+    """Returns the observation of an agent encoded in frame, with the JSONable
+    types of the original network protocol (Lists, floats for the bomb planes
+    and Item names)"""
+    obs = observation(frame, agent_id, game_type, game_env)
+    for key in ["board", "bomb_blast_strength", "bomb_life"]:
+        obs[key] = obs[key].tolist()
+    obs["position"] = list(obs["position"])
+    obs["teammate"] = obs["teammate"].name
+    obs["enemies"] = [enemy.name for enemy in obs["enemies"]]
+    if "message" in obs:
+        obs["message"] = list(obs["message"])
+    return obs
+
+
+class Encoder(object):
+    """Encodes the turns of a match for a player of the binary protocol
+
+    Every message holds the header of the frame and, if the player is alive,
+    its agent struct and its fogged planes XORed with those of its previous
+    message, so only the cells that changed are non-zero. The messages go
+    through a deflate stream that lasts the whole match, and the
+    `_SYNC_FLUSH_TAIL` that ends each of them is left out (As in
+    permessage-deflate, which the client library doesn't offer)"""
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        self._planes = None
+
+    def encode(self, frame, agent_id):
+        """Returns the message of a frame for the agent"""
+        header, agent, planes = _unpack(frame, agent_id)
+        payload = bytes(frame[:_HEADER.size])
+        if header[3] & 1 << agent_id:
+            planes = _fog(planes, agent[9:13])
+            delta = planes if self._planes is None else planes ^ self._planes
+            self._planes = planes
+            payload += _AGENT.pack(*agent) + delta.tobytes()
+        message = self._compressor.compress(payload) + \
+            self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return message[:-len(_SYNC_FLUSH_TAIL)]
+
+
+class Decoder(object):
+    """Decodes the messages of an `Encoder`, in order"""
+
+    def __init__(self, game_type, game_env):
+        """Arguments:  
+        * game_type: The GameType value of the match  
+        * game_env: The env string of the match"""
+        self.game_type = game_type
+        self.game_env = game_env
+        self._decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+        self._planes = None
+
+    def decode(self, message):
+        """Returns the turn ID of a message and the observation of the agent
+        (None if it's dead)"""
+        payload = self._decompressor.decompress(message + _SYNC_FLUSH_TAIL)
+        header = _HEADER.unpack_from(payload)
+        if len(payload) == _HEADER.size:
+            return header[0].decode(), None
+        board_size = header[2]
+        agent = _AGENT.unpack_from(payload, _HEADER.size)
+        planes = numpy.frombuffer(
+            payload, numpy.uint8, _NUM_PLANES * board_size * board_size,
+            _HEADER.size + _AGENT.size).reshape(_NUM_PLANES, board_size,
+                                                board_size)
+        if self._planes is not None:
+            planes = planes ^ self._planes
+            # Note: The next message is decoded against these planes, so
+            # they are read-only like those the env hands out
+            planes.flags.writeable = False
+        self._planes = planes
+        return header[0].decode(), _observation(header, agent, planes,
+                                                self.game_type, self.game_env)
@@ -0,0 +1,156 @@
+'''Module to build agent observations incrementally.'''
+import numpy as np
+
+from . import constants
+from . import utility
+
+_ATTRS = [
+    'position', 'blast_strength', 'can_kick', 'teammate', 'ammo', 'enemies'
+]
+
+
+def _read_only(array):
+    '''Returns a view of array that can not be written through.'''
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class _Planes(object):
+    '''A board and bomb planes, plus what was last written to them.'''
+
+    def __init__(self, board_size, board_dtype, has_board, dtype):
+        shape = (board_size, board_size)
+        self.board = None
+        self.board_view = None
+        if has_board:
+            self.board = np.full(
+                shape, constants.Item.Fog.value, dtype=board_dtype)
+            self.board_view = _read_only(self.board)
+        self.bomb_blast_strength = np.zeros(shape, dtype=dtype)
+        self.bomb_life = np.zeros(shape, dtype=dtype)
+        self.bomb_blast_strength_view = _read_only(self.bomb_blast_strength)
+        self.bomb_life_view = _read_only(self.bomb_life)
+        self.window = None
+        self.bomb_cells = (np.zeros(0, dtype=np.int64),
+                           np.zeros(0, dtype=np.int64))
+
+    def matches(self, board_size, board_dtype, has_board):
+        if has_board:
+            return self.board is not None and \
+                self.board.shape == (board_size, board_size) and \
+                self.board.dtype == board_dtype
+        return self.board is None and \
+            self.bomb_life.shape == (board_size, board_size)
+
+    def set_bombs(self, rows, cols, blast_strengths, lives):
+        '''Clears the previous bomb cells and writes the given bombs.'''
+        self.bomb_blast_strength[self.bomb_cells] = 0
+        self.bomb_life[self.bomb_cells] = 0
+        self.bomb_blast_strength[rows, cols] = blast_strengths
+        self.bomb_life[rows, cols] = lives
+        self.bomb_cells = (rows, cols)
+
+
+class ObservationBuilder(object):
+    """Builds the agents' observations into buffers kept between steps.
+
+    When the board is fully observable, every agent gets the same read-only
+    views: one of the live board and one of a single pair of bomb planes. When
+    it is partially observable, each agent owns a board and bomb planes and is
+    handed read-only views of them. Every step only rewrites the cells that
+    can have changed: the bomb cells of the previous and the current step and
+    the agent's previous and current view windows. Fog is applied by slicing
+    the view window rather than by testing every cell.
+
+    The views are updated in place by the next call to `build`. Agents that
+    set `copy_observations` get writable copies of their own instead.
+
+    The bomb planes are of the given dtype. Bomb life and blast strength are
+    small non-negative integers, so uint8 holds them exactly.
+    """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self._planes = {}
+        self._board = None
+        self._board_view = None
+
+    def _get_planes(self, key, board_size, board_dtype, has_board):
+        planes = self._planes.get(key)
+        if planes is None or not planes.matches(board_size, board_dtype,
+                                                has_board):
+            planes = _Planes(board_size, board_dtype, has_board, self.dtype)
+            self._planes[key] = planes
+        return planes
+
+    def build(self, curr_board, agents, bombs, is_partially_observable,
+              agent_view_size, game_type, game_env):
+        '''Returns the observations of agents, as `ForwardModel` does.'''
+        board_size = len(curr_board)
+        alive_agents = [
+            utility.agent_value(agent.agent_id)
+            for agent in agents
+            if agent.is_alive
+        ]
+
+        bomb_rows = np.array([bomb.position[0] for bomb in bombs],
+                             dtype=np.int64)
+        bomb_cols = np.array([bomb.position[1] for bomb in bombs],
+                             dtype=np.int64)
+        bomb_blast_strengths = np.array(
+            [bomb.blast_strength for bomb in bombs], dtype=self.dtype)
+        bomb_lives = np.array([bomb.life for bomb in bombs], dtype=self.dtype)
+
+        if not is_partially_observable:
+            if self._board is not curr_board:
+                self._board = curr_board
+                self._board_view = _read_only(curr_board)
+            shared = self._get_planes(None, board_size, curr_board.dtype,
+                                      False)
+            shared.set_bombs(bomb_rows, bomb_cols, bomb_blast_strengths,
+                             bomb_lives)
+
+        observations = []
+        for agent in agents:
+            if is_partially_observable:
+                planes = self._get_planes(agent.agent_id, board_size,
+                                          curr_board.dtype, True)
+                row, col = agent.position
+                window = (slice(max(row - agent_view_size, 0),
+                                row + agent_view_size + 1),
+                          slice(max(col - agent_view_size, 0),
+                                col + agent_view_size + 1))
+                if window != planes.window:
+                    if planes.window is not None:
+                        planes.board[planes.window] = constants.Item.Fog.value
+                    planes.window = window
+                planes.board[window] = curr_board[window]
+
+                visible = (np.abs(bomb_rows - row) <= agent_view_size) & \
+                          (np.abs(bomb_cols - col) <= agent_view_size)
+                planes.set_bombs(bomb_rows[visible], bomb_cols[visible],
+                                 bomb_blast_strengths[visible],
+                                 bomb_lives[visible])
+                board = planes.board_view
+            else:
+                planes = shared
+                board = self._board_view
+
+            agent_obs = {
+                'alive': alive_agents,
+                'board': board,
+                'bomb_blast_strength': planes.bomb_blast_strength_view,
+                'bomb_life': planes.bomb_life_view,
+                'game_type': game_type.value,
+                'game_env': game_env
+            }
+            if getattr(agent, 'copy_observations', False):
+                for key in ['board', 'bomb_blast_strength', 'bomb_life']:
+                    agent_obs[key] = agent_obs[key].copy()
+            for attr in _ATTRS:
+                assert hasattr(agent, attr)
+                agent_obs[attr] = getattr(agent, attr)
+            observations.append(agent_obs)
+
+        return observations
@@ -0,0 +1,416 @@
+'''Compact binary replays.
+
+A replay is one file that a `ReplayWriter` appends to as the game runs. The
+file starts with a small JSON header and is followed by a single zlib stream
+of records:
+  keyframe: The `GameState` buffer of a step, without the bomb_id and
+    flame_life planes, which are rebuilt from the bombs and flames.
+  delta: The bytes of that buffer that changed since the previous step, as
+    their offsets followed by the differences of their values.
+  checksum: The crc32 of the state of a step, see `checksum`.
+  actions: The actions that led to the next step.
+  result: The final info of the game.
+
+Every step is stored as a keyframe and, between keyframes, as a delta or, in
+an actions only replay, just as a checksum. `Replay.state_at` rebuilds a step
+from the keyframe before it, by applying the deltas or by re-simulating the
+actions with `ForwardModel.step` and checking each step against its checksum.
+A whole game is usually a few KB with deltas and about 1KB without.
+
+Example:
+    writer = replay.ReplayWriter('game.replay', metadata={'config': config})
+    obs = env.reset()
+    writer.record(env)
+    while not done:
+        actions = env.act(obs)
+        obs, reward, done, info = env.step(actions)
+        writer.record(env, actions)
+    writer.close(info)
+
+    game = replay.Replay('game.replay')
+    state = game.state_at(100)
+'''
+import json
+import struct
+import zlib
+
+import numpy as np
+
+from . import characters
+from . import constants
+from .envs import v1
+from .forward_model import ForwardModel
+from .state import GameState, NUM_AGENTS
+
+MAGIC = b'PMRP'
+VERSION = 1
+
+_KEYFRAME = b'K'
+_DELTA = b'D'
+_CHECKSUM = b'C'
+_ACTIONS = b'A'
+_RESULT = b'R'
+
+_PREAMBLE = struct.Struct('<4sBI')
+_RECORD = struct.Struct('<cI')
+_CRC = struct.Struct('<I')
+
+
+def _recorded_bytes(state):
+    '''Returns the offsets of the bytes of state's buffer that are stored'''
+    recorded = np.ones(state.buffer.nbytes, dtype=bool)
+    start = state.buffer.ctypes.data
+    for plane in (state.bomb_id, state.flame_life):
+        offset = plane.ctypes.data - start
+        recorded[offset:offset + plane.nbytes] = False
+    return np.flatnonzero(recorded)
+
+
+def _index_dtype(nbytes):
+    '''The dtype of the offsets into nbytes recorded bytes in a delta'''
+    return np.dtype('<u2') if nbytes <= 1 << 16 else np.dtype('<u4')
+
+
+def checksum(state):
+    """Returns the crc32 of the single game in state.
+
+    Only the live bombs and flames are included, so two states of the same
+    game have the same checksum whatever is left in their unused slots.
+    """
+    live = state.bombs.ctypes.data - state.buffer.ctypes.data
+    crc = zlib.crc32(state.buffer[:live])
+    crc = zlib.crc32(state.bombs[0, :state.bomb_count[0]].tobytes(), crc)
+    return zlib.crc32(state.flames[0, :state.flame_count[0]].tobytes(), crc)
+
+
+class ReplayWriter(object):
+    '''Streams the steps of one game into a replay file.'''
+
+    def __init__(self,
+                 path,
+                 keyframe_interval=100,
+                 actions_only=False,
+                 metadata=None):
+        """Creates the replay file.
+
+        Args:
+          path: The path of the replay file.
+          keyframe_interval: A keyframe is stored every keyframe_interval
+            steps. Lower values make `Replay.state_at` faster and the file
+            larger.
+          actions_only: Whether to store only a checksum of the steps between
+            keyframes instead of their deltas. The replay is then several
+            times smaller, and `Replay.state_at` re-simulates those steps.
+          metadata: A JSON-serializable dict stored in the header, e.g. the
+            config and the agents.
+        """
+        self._keyframe_interval = keyframe_interval
+        self._actions_only = actions_only
+        self._metadata = metadata or {}
+        self._state = None
+        self._num_steps = 0
+        self._compressor = zlib.compressobj(9)
+        self._file = open(path, 'wb')
+
+    def _write_header(self, env):
+        '''Writes the header, with what re-simulating env's game takes'''
+        self._state = GameState(board_size=env._board_size)
+        self._recorded = _recorded_bytes(self._state)
+        self._index_dtype = _index_dtype(len(self._recorded))
+        self._previous = None
+
+        header = json.dumps({
+            'board_size': env._board_size,
+            'game_type': env._game_type.value,
+            'seed': env._seed,
+            'max_blast_strength': env._agent_view_size or 10,
+            'collapses': list(getattr(env, 'collapses', [])),
+            'keyframe_interval': self._keyframe_interval,
+            'actions_only': self._actions_only,
+            'metadata': self._metadata
+        }).encode('utf-8')
+        self._file.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        self._file.write(header)
+
+    def _write(self, kind, payload):
+        self._file.write(
+            self._compressor.compress(_RECORD.pack(kind, len(payload))))
+        self._file.write(self._compressor.compress(payload))
+
+    def record(self, env, actions=None):
+        """Appends the current step of env.
+
+        Args:
+          env: The Pomme env, after `reset` or `step`.
+          actions: The actions passed to the `step` that led here. None for
+            the first step.
+        """
+        if self._state is None:
+            self._write_header(env)
+        if actions is not None:
+            self._write(_ACTIONS,
+                        np.asarray(actions, dtype=np.uint8).tobytes())
+
+        self._state.load_objects(0, env._board, env._agents, env._bombs,
+                                 env._items, env._flames, env._step_count)
+        if self._num_steps % self._keyframe_interval == 0:
+            values = self._state.buffer[self._recorded]
+            self._write(_KEYFRAME, values.tobytes())
+            # Make everything up to the keyframe readable if the game dies.
+            self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+            self._previous = values
+        elif self._actions_only:
+            self._write(_CHECKSUM, _CRC.pack(checksum(self._state)))
+        else:
+            # Differences compress better than values: bomb and flame lives
+            # all tick down by one.
+            values = self._state.buffer[self._recorded]
+            changed = np.flatnonzero(values != self._previous)
+            self._write(_DELTA,
+                        changed.astype(self._index_dtype).tobytes() +
+                        (values[changed] - self._previous[changed]).tobytes())
+            self._previous = values
+        self._num_steps += 1
+
+    def close(self, info=None):
+        """Writes the result and closes the file.
+
+        Args:
+          info: The info returned by the last `step`, if the game finished.
+        """
+        if info is not None:
+            result = {'result': info['result'].name}
+            if 'winners' in info:
+                result['winners'] = info['winners']
+            self._write(_RESULT, json.dumps(result).encode('utf-8'))
+        self._file.write(self._compressor.flush())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if not self._file.closed:
+            self.close()
+
+
+class Replay(object):
+    """A replay file loaded for random access.
+
+    Attributes:
+      board_size: The board size of the game.
+      game_type: The `constants.GameType` of the game.
+      seed: The seed of the env, None if it was not seeded.
+      metadata: The metadata given to the `ReplayWriter`.
+      info: The final info of the game, with its 'result' as a
+        `constants.Result`, or None if the game did not finish.
+      first_step: The step count of the first recorded step.
+    """
+
+    def __init__(self, path):
+        """Loads a replay.
+
+        Args:
+          path: The path of the replay file, or the bytes of one.
+        """
+        if isinstance(path, bytes):
+            data, path = path, 'data'
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+
+        magic, version, header_size = _PREAMBLE.unpack_from(data)
+        assert magic == MAGIC, "%s is not a replay file" % path
+        assert version == VERSION, "Unsupported replay version %d" % version
+        start = _PREAMBLE.size
+        header = json.loads(data[start:start + header_size].decode('utf-8'))
+        self.board_size = header['board_size']
+        self.seed = header['seed']
+        self.metadata = header['metadata']
+        self.game_type = constants.GameType(header['game_type'])
+        self._actions_only = header['actions_only']
+        self._max_blast_strength = header['max_blast_strength']
+        self._collapses = header['collapses']
+
+        # A replay whose writer died ends mid-stream. Keep what is there.
+        stream = zlib.decompressobj().decompress(data[start + header_size:])
+
+        self._recorded = _recorded_bytes(GameState(board_size=self.board_size))
+        index_dtype = _index_dtype(len(self._recorded))
+        self._frames = []
+        self._keyframes = []
+        self._actions = []
+        self.info = None
+        offset = 0
+        while offset + _RECORD.size <= len(stream):
+            kind, size = _RECORD.unpack_from(stream, offset)
+            offset += _RECORD.size
+            if offset + size > len(stream):
+                break
+            payload = np.frombuffer(stream, np.uint8, size, offset)
+            offset += size
+
+            if kind == _KEYFRAME:
+                self._keyframes.append(len(self._frames))
+                self._frames.append(payload)
+            elif kind == _DELTA:
+                count = size // (index_dtype.itemsize + 1)
+                split = count * index_dtype.itemsize
+                self._frames.append((payload[:split].view(index_dtype),
+                                     payload[split:]))
+            elif kind == _CHECKSUM:
+                self._frames.append(_CRC.unpack(payload.tobytes())[0])
+            elif kind == _ACTIONS:
+                self._actions.append(payload.reshape(NUM_AGENTS, -1))
+            elif kind == _RESULT:
+                result = json.loads(payload.tobytes().decode('utf-8'))
+                result['result'] = constants.Result[result['result']]
+                self.info = result
+
+        self.first_step = int(self._state(self._frames[0]).step_count[0]) \
+            if self._frames else 0
+
+    def __len__(self):
+        '''The number of recorded steps'''
+        return len(self._frames)
+
+    def _frame(self, step):
+        frame = step - self.first_step
+        if not 0 <= frame < len(self._frames):
+            raise IndexError("Step %d is not in the replay" % step)
+        return frame
+
+    def _state(self, values):
+        '''Returns a GameState holding the recorded bytes values'''
+        state = GameState(board_size=self.board_size)
+        state.buffer[self._recorded] = values
+        state.update_planes()
+        return state
+
+    def _simulate(self, state, frame, stop):
+        """Re-simulates state, the state of frame, up to the frame stop.
+
+        State is updated in place and yielded after each step. Each step is
+        checked against the checksum, keyframe or delta it was
+        recorded as.
+
+        Raises:
+          constants.ReplayMismatch: A step did not match the recording.
+        """
+        agents = [
+            characters.Bomber(agent_id, self.game_type)
+            for agent_id in range(NUM_AGENTS)
+        ]
+        board, agents, bombs, items, flames = state.to_objects(0, agents)
+        step_count = int(state.step_count[0])
+        values = state.buffer[self._recorded]
+
+        for frame in range(frame + 1, stop + 1):
+            actions = self._actions[frame - 1][:, 0].tolist()
+            board, agents, bombs, items, flames = ForwardModel.step(
+                actions, board, agents, bombs, items, flames,
+                max_blast_strength=self._max_blast_strength)
+            step_count += 1
+            if step_count in self._collapses:
+                board, bombs = v1.collapse_board(
+                    self._collapses.index(step_count), board, agents, bombs,
+                    items)
+            state.load_objects(0, board, agents, bombs, items, flames,
+                               step_count)
+
+            recorded = self._frames[frame]
+            if isinstance(recorded, tuple):
+                changed, differences = recorded
+                values = values.copy()
+                values[changed] += differences
+            elif not isinstance(recorded, int):
+                values = recorded
+            expected = recorded if isinstance(recorded, int) else \
+                checksum(self._state(values))
+            if checksum(state) != expected:
+                raise constants.ReplayMismatch(
+                    "Re-simulating step %d does not match the replay" %
+                    step_count)
+            yield state
+
+    def state_at(self, step):
+        """Returns the state of the game at step.
+
+        The keyframe before step is loaded and the steps after it are rebuilt
+        from their deltas, or re-simulated in an actions only replay.
+
+        Args:
+          step: The step count.
+
+        Returns:
+          A new single game `GameState`.
+
+        Raises:
+          constants.ReplayMismatch: Re-simulating did not reproduce the
+            recorded checksums.
+        """
+        frame = self._frame(step)
+        keyframe = self._keyframes[
+            np.searchsorted(self._keyframes, frame, side='right') - 1]
+        if not isinstance(self._frames[frame], tuple):
+            state = self._state(self._frames[keyframe])
+            for state in self._simulate(state, keyframe, frame):
+                pass
+            return state
+
+        values = self._frames[keyframe].copy()
+        for changed, differences in self._frames[keyframe + 1:frame + 1]:
+            values[changed] += differences
+        return self._state(values)
+
+    def states(self):
+        """Yields the state of every recorded step, in order.
+
+        This is much faster than calling `state_at` for each step. The same
+        `GameState` is updated in place and yielded each time; copy it to
+        keep it.
+
+        Raises:
+          constants.ReplayMismatch: Re-simulating an actions only replay did
+            not reproduce the recorded checksums.
+        """
+        state = self._state(self._frames[0])
+        yield state
+        if self._actions_only:
+            yield from self._simulate(state, 0, len(self._frames) - 1)
+            return
+
+        values = self._frames[0].copy()
+        for recorded in self._frames[1:]:
+            if isinstance(recorded, tuple):
+                changed, differences = recorded
+                values[changed] += differences
+            else:
+                values = recorded.copy()
+            state.buffer[self._recorded] = values
+            state.update_planes()
+            yield state
+
+    def actions_at(self, step):
+        """Returns the actions of each agent that led to step.
+
+        The actions are a [4, 1] uint8 array, or [4, 1 + radio_num_words]
+        with the radio messages of v2 games.
+        """
+        frame = self._frame(step)
+        if frame == 0:
+            raise IndexError("The first recorded step has no actions")
+        return self._actions[frame - 1]
+
+    def verify(self):
+        """Re-simulates the whole game from its first step.
+
+        Every step is checked against its recording, including the keyframes,
+        so this also checks that the game is deterministic.
+
+        Raises:
+          constants.ReplayMismatch: A step did not match the recording.
+        """
+        for _ in self._simulate(
+                self._state(self._frames[0]), 0, len(self._frames) - 1):
+            pass
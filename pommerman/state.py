@@ -0,0 +1,287 @@
+'''Array-backed game state.
+
+A GameState holds the board, hidden items, agents, bombs and flames of one or
+more games in fixed-capacity NumPy arrays that are all views into a single
+byte buffer. Copying a state, e.g. for search or rollouts, is therefore one
+buffer copy instead of a deep copy of Bomber/Bomb/Flame object graphs.
+'''
+import json
+
+import numpy as np
+
+from . import characters
+from . import constants
+from . import utility
+
+NUM_AGENTS = 4
+
+AGENT_DTYPE = np.dtype([
+    ('position', np.int8, (2,)),
+    ('is_alive', np.bool_),
+    ('ammo', np.int8),
+    ('blast_strength', np.int8),
+    ('can_kick', np.bool_),
+])
+
+# moving_direction is the Action value, 0 (Stop) when the bomb is not moving.
+BOMB_DTYPE = np.dtype([
+    ('position', np.int8, (2,)),
+    ('bomber_id', np.int8),
+    ('life', np.int8),
+    ('blast_strength', np.int8),
+    ('moving_direction', np.int8),
+])
+
+FLAME_DTYPE = np.dtype([
+    ('position', np.int8, (2,)),
+    ('life', np.int8),
+])
+
+
+class GameState(object):
+    """The state of num_games games, stored in one buffer.
+
+    Arrays, each with a leading game axis:
+      step_count: The step count of each game.
+      board: The board, as in `Pomme._board`.
+      items: The item hidden under each cell, 0 (Passage) if none.
+      bomb_id: Index into `bombs` of the bomb on each cell, -1 if none.
+      flame_life: Largest remaining life of the flames on each cell, -1 if
+        none.
+      agents: AGENT_DTYPE records, indexed by agent id.
+      bombs, bomb_count: BOMB_DTYPE records. The first bomb_count of them
+        are live, in the order `ForwardModel` keeps its bomb list.
+      flames, flame_count: FLAME_DTYPE records, packed the same way.
+    """
+
+    def __init__(self,
+                 num_games=1,
+                 board_size=constants.BOARD_SIZE,
+                 max_bombs=None,
+                 max_flames=None,
+                 buffer=None):
+        self.num_games = num_games
+        self.board_size = board_size
+        # Bombs never share a cell and each cell holds at most three flames
+        # (one per remaining life), so these bounds can not be exceeded.
+        self.max_bombs = max_bombs or board_size**2
+        self.max_flames = max_flames or 3 * board_size**2
+
+        planes = (num_games, board_size, board_size)
+        layout = [
+            ('step_count', np.int32, (num_games,)),
+            ('bomb_count', np.int16, (num_games,)),
+            ('flame_count', np.int16, (num_games,)),
+            ('board', np.uint8, planes),
+            ('items', np.uint8, planes),
+            ('bomb_id', np.int16, planes),
+            ('flame_life', np.int8, planes),
+            ('agents', AGENT_DTYPE, (num_games, NUM_AGENTS)),
+            ('bombs', BOMB_DTYPE, (num_games, self.max_bombs)),
+            ('flames', FLAME_DTYPE, (num_games, self.max_flames)),
+        ]
+        offsets = []
+        nbytes = 0
+        for _, dtype, shape in layout:
+            dtype = np.dtype(dtype)
+            nbytes += -nbytes % dtype.alignment
+            offsets.append(nbytes)
+            nbytes += dtype.itemsize * int(np.prod(shape))
+
+        if buffer is None:
+            buffer = np.zeros(nbytes, dtype=np.uint8)
+            initialize = True
+        else:
+            assert buffer.nbytes == nbytes
+            initialize = False
+        self.buffer = buffer
+
+        for (name, dtype, shape), offset in zip(layout, offsets):
+            setattr(self, name, np.ndarray(shape, dtype, buffer, offset))
+        if initialize:
+            self.bomb_id.fill(-1)
+            self.flame_life.fill(-1)
+
+    def copy(self):
+        """Returns an independent copy of this state."""
+        return GameState(self.num_games, self.board_size, self.max_bombs,
+                         self.max_flames, self.buffer.copy())
+
+    def copy_from(self, other):
+        """Overwrites this state with other, which must have the same shape."""
+        np.copyto(self.buffer, other.buffer)
+
+    def update_planes(self):
+        """Rebuilds bomb_id and flame_life from the bomb and flame arrays."""
+        size = self.board_size
+        self.bomb_id.fill(-1)
+        self.flame_life.fill(-1)
+        bomb_id = self.bomb_id.reshape(-1)
+        flame_life = self.flame_life.reshape(-1)
+
+        width = self.bomb_count.max(initial=0)
+        games, slots = np.nonzero(np.arange(width) < self.bomb_count[:, None])
+        position = self.bombs['position'][games, slots].astype(np.int64)
+        bomb_id[games * size * size + position[:, 0] * size +
+                position[:, 1]] = slots
+
+        width = self.flame_count.max(initial=0)
+        games, slots = np.nonzero(np.arange(width) < self.flame_count[:, None])
+        flames = self.flames[games, slots]
+        position = flames['position'].astype(np.int64)
+        np.maximum.at(
+            flame_life,
+            games * size * size + position[:, 0] * size + position[:, 1],
+            flames['life'])
+
+    def load_objects(self, index, board, agents, bombs, items, flames,
+                     step_count=0):
+        """Copies one game given as `ForwardModel` objects into game index."""
+        self.step_count[index] = step_count
+        self.board[index] = board
+        self.items[index] = constants.Item.Passage.value
+        for position, value in items.items():
+            self.items[index][position] = value
+
+        for agent in agents:
+            self.agents[index, agent.agent_id] = (
+                agent.position, agent.is_alive, agent.ammo,
+                agent.blast_strength, agent.can_kick)
+
+        self.bomb_count[index] = len(bombs)
+        self.bombs[index, :len(bombs)] = [
+            (bomb.position, bomb.bomber.agent_id, bomb.life,
+             bomb.blast_strength,
+             constants.Action(bomb.moving_direction).value
+             if bomb.is_moving() else constants.Action.Stop.value)
+            for bomb in bombs
+        ]
+
+        self.flame_count[index] = len(flames)
+        self.flames[index, :len(flames)] = [
+            (flame.position, flame._life) for flame in flames
+        ]
+        self._update_game_planes(index)
+
+    def to_objects(self, index, agents):
+        """Writes game index back into `ForwardModel` objects.
+
+        The agents are updated in place, the same way `set_json_info` does.
+
+        Returns:
+          board, agents, bombs, items, flames as `ForwardModel.step` would.
+        """
+        for agent in agents:
+            record = self.agents[index, agent.agent_id]
+            agent.set_start_position(tuple(record['position'].tolist()))
+            agent.reset(
+                int(record['ammo']), bool(record['is_alive']),
+                int(record['blast_strength']), bool(record['can_kick']))
+
+        bombers = {agent.agent_id: agent for agent in agents}
+        bombs = [
+            characters.Bomb(bombers[bomber_id], tuple(position), life,
+                            blast_strength,
+                            constants.Action(moving_direction)
+                            if moving_direction else None)
+            for position, bomber_id, life, blast_strength, moving_direction in
+            self.bombs[index, :self.bomb_count[index]].tolist()
+        ]
+
+        rows, cols = np.nonzero(self.items[index])
+        items = {(r, c): v for r, c, v in zip(
+            rows.tolist(), cols.tolist(), self.items[index][rows, cols].tolist())}
+
+        flames = [
+            characters.Flame(tuple(position), life) for position, life in
+            self.flames[index, :self.flame_count[index]].tolist()
+        ]
+        return self.board[index].copy(), agents, bombs, items, flames
+
+    def load_json_info(self, index, json_info):
+        """Loads game index from the `Pomme.get_json_info` format."""
+        assert int(json_info['board_size']) == self.board_size
+        self.step_count[index] = int(json_info['step_count'])
+        self.board[index] = json.loads(json_info['board'])
+
+        self.items[index] = constants.Item.Passage.value
+        for position, value in json.loads(json_info['items']):
+            self.items[index][tuple(position)] = value
+
+        for a in json.loads(json_info['agents']):
+            self.agents[index, a['agent_id']] = (
+                a['position'], a['is_alive'], a['ammo'], a['blast_strength'],
+                a['can_kick'])
+
+        bombs = json.loads(json_info['bombs'])
+        self.bomb_count[index] = len(bombs)
+        self.bombs[index, :len(bombs)] = [
+            (b['position'], b['bomber_id'], b['life'], b['blast_strength'],
+             b['moving_direction'] or constants.Action.Stop.value)
+            for b in bombs
+        ]
+
+        flames = json.loads(json_info['flames'])
+        self.flame_count[index] = len(flames)
+        self.flames[index, :len(flames)] = [
+            (f['position'], f['life']) for f in flames
+        ]
+        self._update_game_planes(index)
+
+    def to_json_info(self, index, intended_actions=None):
+        """Returns game index in the `Pomme.get_json_info` format.
+
+        Items are listed in board order rather than in the order they were
+        laid.
+        """
+        agents = [{
+            'agent_id': agent_id,
+            'is_alive': is_alive,
+            'position': position,
+            'ammo': ammo,
+            'blast_strength': blast_strength,
+            'can_kick': can_kick
+        } for agent_id, (position, is_alive, ammo, blast_strength, can_kick)
+                  in enumerate(self.agents[index].tolist())]
+        bombs = [{
+            'position': position,
+            'bomber_id': bomber_id,
+            'life': life,
+            'blast_strength': blast_strength,
+            'moving_direction': moving_direction or None
+        } for position, bomber_id, life, blast_strength, moving_direction in
+                 self.bombs[index, :self.bomb_count[index]].tolist()]
+        flames = [{
+            'position': position,
+            'life': life
+        } for position, life in
+                  self.flames[index, :self.flame_count[index]].tolist()]
+        rows, cols = np.nonzero(self.items[index])
+        items = [[[r, c], v] for r, c, v in zip(
+            rows.tolist(), cols.tolist(), self.items[index][rows, cols].tolist())]
+
+        ret = {
+            'board_size': self.board_size,
+            'step_count': int(self.step_count[index]),
+            'board': self.board[index],
+            'agents': agents,
+            'bombs': bombs,
+            'flames': flames,
+            'items': items,
+            'intended_actions': intended_actions or []
+        }
+        for key, value in ret.items():
+            ret[key] = json.dumps(value, cls=utility.PommermanJSONEncoder)
+        return ret
+
+    def _update_game_planes(self, index):
+        '''Rebuilds bomb_id and flame_life for a single game'''
+        self.bomb_id[index] = -1
+        for num, (row, col) in enumerate(
+                self.bombs['position'][index, :self.bomb_count[index]].tolist()):
+            self.bomb_id[index, row, col] = num
+        self.flame_life[index] = -1
+        for (row, col), life in \
+                self.flames[index, :self.flame_count[index]].tolist():
+            self.flame_life[index, row, col] = max(
+                self.flame_life[index, row, col], life)
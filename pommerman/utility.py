@@ -1,6 +1,8 @@
 '''This file contains a set of utility functions that
 help with positioning, building a game board, and
 encoding data to be used later'''
+import functools
+import heapq
 import itertools
 import json
 import random
@@ -35,7 +37,7 @@ class PommermanJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def make_board(size, num_rigid=0, num_wood=0):
+def make_board(size, num_rigid=0, num_wood=0, rng=None):
     """Make the random but symmetric board.
 
     The numbers refer to the Item enum in constants. This is:
@@ -55,14 +57,16 @@ def make_board(size, num_rigid=0, num_wood=0):
       size: The dimension of the board, i.e. it's sizeXsize.
       num_rigid: The number of rigid walls on the board. This should be even.
       num_wood: Similar to above but for wood walls.
+      rng: The random.Random to draw from. Defaults to the random module.
 
     Returns:
       board: The resulting random board.
     """
+    rng = rng or random
 
     def lay_wall(value, num_left, coordinates, board):
         '''Lays all of the walls on a board'''
-        x, y = random.sample(coordinates, 1)[0]
+        x, y = rng.sample(coordinates, 1)[0]
         coordinates.remove((x, y))
         coordinates.remove((y, x))
         board[x, y] = value
@@ -141,18 +145,19 @@ def make_board(size, num_rigid=0, num_wood=0):
     return board
 
 
-def make_items(board, num_items):
-    '''Lays all of the items on the board'''
+def make_items(board, num_items, rng=None):
+    '''Lays all of the items on the board, drawing from rng if given'''
+    rng = rng or random
     item_positions = {}
     while num_items > 0:
-        row = random.randint(0, len(board) - 1)
-        col = random.randint(0, len(board[0]) - 1)
+        row = rng.randint(0, len(board) - 1)
+        col = rng.randint(0, len(board[0]) - 1)
         if board[row, col] != constants.Item.Wood.value:
             continue
         if (row, col) in item_positions:
             continue
 
-        item_positions[(row, col)] = random.choice([
+        item_positions[(row, col)] = rng.choice([
             constants.Item.ExtraBomb, constants.Item.IncrRange,
             constants.Item.Kick
         ]).value
@@ -352,15 +357,92 @@ def get_next_position(position, direction):
     raise constants.InvalidAction("We did not receive a valid direction.")
 
 
+@functools.lru_cache(maxsize=None)
+def get_blast_rays(board_size):
+    '''Returns the cells a bomb's blast can reach from every position.
+
+    The rays of a position are ordered as in `Bomb.explode`: up, down, left
+    and right, each running to the edge of the board. The down ray starts at
+    the position itself.
+    '''
+    rays = {}
+    for row in range(board_size):
+        for col in range(board_size):
+            rays[(row, col)] = (
+                tuple((r, col) for r in range(row - 1, -1, -1)),
+                tuple((r, col) for r in range(row, board_size)),
+                tuple((row, c) for c in range(col - 1, -1, -1)),
+                tuple((row, c) for c in range(col + 1, board_size)),
+            )
+    return rays
+
+
+def get_danger_map(board, bomb_life, bomb_blast_strength):
+    """Returns the earliest tick at which each cell will be in flames.
+
+    Cells in flames now are at tick 0 and a bomb with life L explodes at tick
+    L, unless the flames of another bomb reach it first. As in
+    `ForwardModel.step`, a blast stops at rigid walls and at the first wooden
+    wall, which it burns away for the blasts of later ticks. Cells that no
+    bomb in view will reach are np.inf.
+
+    Args:
+      board: The board of an observation.
+      bomb_life: The bomb life of that observation.
+      bomb_blast_strength: The bomb blast strength of that observation.
+
+    Returns:
+      A float array shaped like the board.
+    """
+    danger = np.where(board == constants.Item.Flames.value, 0., np.inf)
+    rows, cols = np.nonzero(bomb_life)
+    if not len(rows):
+        return danger
+
+    # Maps each bomb that has not gone off yet to its tick and strength.
+    pending = {}
+    for row, col, life, blast_strength in zip(
+            rows.tolist(), cols.tolist(), bomb_life[rows, cols].tolist(),
+            bomb_blast_strength[rows, cols].tolist()):
+        # A bomb under flames goes off with the next step.
+        tick = 1 if danger[row, col] == 0 else int(life)
+        pending[(row, col)] = (tick, int(blast_strength))
+    heap = [(tick, position) for position, (tick, _) in pending.items()]
+    heapq.heapify(heap)
+
+    blast_rays = get_blast_rays(len(board))
+    while heap:
+        tick, position = heapq.heappop(heap)
+        if pending.get(position, (None, ))[0] != tick:
+            continue
+
+        reach = max(pending.pop(position)[1] - 1, 0)
+        up, down, left, right = blast_rays[position]
+        for ray in (up[:reach], down[:reach + 1], left[:reach],
+                    right[:reach]):
+            for cell in ray:
+                value = board[cell]
+                if value == constants.Item.Rigid.value:
+                    break
+                burnt = danger[cell] < tick
+                if not burnt:
+                    danger[cell] = tick
+                chained = pending.get(cell)
+                if chained is not None and chained[0] > tick:
+                    pending[cell] = (tick, chained[1])
+                    heapq.heappush(heap, (tick, cell))
+                if value == constants.Item.Wood.value and not burnt:
+                    break
+    return danger
+
+
 def make_np_float(feature):
     '''Converts an integer feature space into a floats'''
     return np.array(feature).astype(np.float32)
 
 
-def join_json_state(record_json_dir, agents, finished_at, config, info):
-    '''Combines all of the json state files into one'''
-    json_schema = {"properties": {"state": {"mergeStrategy": "append"}}}
-    
+def _json_game_template(agents, finished_at, config, info):
+    '''Returns the game_state.json fields other than the states'''
     json_template = {
         "agents": agents,
         "finished_at": finished_at,
@@ -373,7 +455,14 @@ def join_json_state(record_json_dir, agents, finished_at, config, info):
 
     if info['result'] is not constants.Result.Tie:
         json_template['winners'] = info['winners']
+    return json_template
+
 
+def join_json_state(record_json_dir, agents, finished_at, config, info):
+    '''Combines all of the json state files into one'''
+    json_schema = {"properties": {"state": {"mergeStrategy": "append"}}}
+    
+    json_template = _json_game_template(agents, finished_at, config, info)
     json_template['state'] = []
 
     merger = Merger(json_schema)
@@ -395,3 +484,25 @@ def join_json_state(record_json_dir, agents, finished_at, config, info):
         for name in files:
             if "game_state" not in name:
                 os.remove(os.path.join(record_json_dir, name))
+
+
+class JsonStateWriter(object):
+    '''Buffers the json states of a game and writes them straight to
+    game_state.json, in the format of join_json_state, once the game ends.'''
+
+    def __init__(self, record_json_dir):
+        self._record_json_dir = record_json_dir
+        self._states = []
+
+    def record(self, env):
+        '''Buffers the current state of env'''
+        self._states.append(env.get_json_info())
+
+    def write(self, agents, finished_at, config, info):
+        '''Writes the buffered states and the result of the game'''
+        game = _json_game_template(agents, finished_at, config, info)
+        game['state'] = self._states
+        path = os.path.join(self._record_json_dir, 'game_state.json')
+        with open(path, 'w', buffering=1 << 20) as f:
+            json.dump(game, f, sort_keys=True, indent=4)
+        self._states = []
@@ -0,0 +1,51 @@
+'''Tests of the dataset exporter.'''
+import numpy as np
+import pytest
+
+import pommerman
+from pommerman import agents
+from pommerman import dataset
+from pommerman import replay
+
+
+def _play(config, seed, path):
+    '''Plays and records a game, returns the rewards of each step.'''
+    env = pommerman.make(config, [agents.SimpleAgent() for _ in range(4)])
+    env.seed(seed)
+    obs = env.reset()
+    writer = replay.ReplayWriter(path, actions_only=True)
+    writer.record(env)
+    rewards = {}
+    done = False
+    while not done:
+        actions = env.act(obs)
+        obs, reward, done, info = env.step(actions)
+        writer.record(env, actions)
+        rewards[env._step_count] = reward
+    writer.close(info)
+    env.close()
+    return rewards
+
+
+@pytest.mark.parametrize('config', [
+    'PommeFFACompetition-v0', 'PommeTeamCompetition-v0', 'PommeFFA-v1'
+])
+def test_export_rewards_match_env(tmpdir, config):
+    # v1 games run past the collapses, which kill agents after the rewards.
+    paths = []
+    expected = []
+    for seed in range(3):
+        paths.append(str(tmpdir.join('%d.replay' % seed)))
+        expected.append(_play(config, seed, paths[-1]))
+
+    data = dataset.export(paths, str(tmpdir.join('data')))
+    for game, rewards in enumerate(expected):
+        rows = data.get(data.rows(game))
+        assert len(rows['step']) == len(rewards)
+        for step, reward in zip(rows['step'].tolist(), rows['rewards']):
+            assert reward.tolist() == rewards[step + 1]
+
+
+def test_export_without_replays(tmpdir):
+    with pytest.raises(ValueError):
+        dataset.export([], str(tmpdir.join('data')))